@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of per-call client cost with a cold (newly constructed) and a warm (registry) client.
+
+Without arguments only the client acquisition is measured, using anonymous credentials so that no GCP access is
+needed. With `--live`, every iteration also issues a one-minute `list_time_series` call against the project in
+'PROJECT_ID', which requires application default credentials.
+
+Usage:
+    python -m benchmarks.bench_clients [--live] [--iterations N]
+"""
+
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.monitoring_v3 import MetricServiceClient
+from google.cloud.monitoring_v3.query import Query
+
+from util.gcp_clients import _get_client, get_metric_client, reset_clients
+
+
+def _list_one_minute(client: MetricServiceClient) -> None:
+    end_time = datetime.now(timezone.utc)
+    query = Query(
+        client=client,
+        project=os.getenv("PROJECT_ID", default="tsmccareerhack2024-icsd-grp1"),
+        metric_type="run.googleapis.com/container/cpu/utilizations",
+    ).select_interval(end_time=end_time, start_time=end_time - timedelta(minutes=1))
+    list(query.iter(headers_only=True))
+
+
+def _measure(acquire: Callable[[], MetricServiceClient], live: bool, iterations: int) -> list[float]:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        client = acquire()
+        if live:
+            _list_one_minute(client)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="also call Cloud Monitoring on every iteration")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    reset_clients()
+    if args.live:
+        cold_acquire: Callable[[], MetricServiceClient] = MetricServiceClient
+        warm_acquire: Callable[[], MetricServiceClient] = get_metric_client
+    else:
+
+        def anonymous_client(client_options=None) -> MetricServiceClient:
+            return MetricServiceClient(credentials=AnonymousCredentials(), client_options=client_options)
+
+        cold_acquire = anonymous_client
+        warm_acquire = lambda: _get_client("monitoring", anonymous_client, None)  # noqa: E731
+
+    cold = _measure(cold_acquire, args.live, args.iterations)
+    warm = _measure(warm_acquire, args.live, args.iterations)
+
+    print(f"{'client':>6} {'median (ms)':>12} {'p90 (ms)':>10}")
+    for name, latencies in (("cold", cold), ("warm", warm)):
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        p90 = latencies_ms[int(len(latencies_ms) * 0.9) - 1]
+        print(f"{name:>6} {statistics.median(latencies_ms):>12.3f} {p90:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
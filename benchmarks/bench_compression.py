@@ -0,0 +1,55 @@
+"""
+Benchmark of the response compression: CPU time against bytes saved for typical metric windows.
+
+Compresses the legacy `to_json` response and the columnar JSON response of synthetic frames (4 labels, see
+`benchmarks.bench_encoding`) with every available encoding of `util.compression`, at its default level and at
+OTHER_LEVELS, and prints the compressed size, the ratio, the time taken and the milliseconds spent per MiB saved.
+The streamed time compresses the same body in CHUNK_BYTES chunks, as the server does from STREAM_BYTES on.
+
+Usage:
+    python -m benchmarks.bench_compression
+"""
+
+import json
+import timeit
+
+from benchmarks.bench_encoding import WINDOWS_MINUTES, build_metric_frame
+from util.compression import LEVELS, available_encodings, compress, compress_chunks, split_chunks
+from util.metric_format import dumps_columnar, to_columnar
+
+# Levels compared with the default one of every encoding
+OTHER_LEVELS = {"gzip": (1, 9), "br": (4, 9), "zstd": (3, 12)}
+PAYLOADS = {
+    "to_json": lambda df: json.dumps(df.to_json()).encode(),
+    "columnar": lambda df: dumps_columnar(to_columnar(df)).encode(),
+}
+
+
+def best_time(func) -> float:
+    return min(timeit.repeat(func, number=1, repeat=5))
+
+
+def main() -> None:
+    print(
+        f"{'window':>6} {'payload':>8} {'KiB':>8} {'encoding':>8} {'level':>5} {'KiB out':>8} {'ratio':>6}"
+        f" {'ms':>8} {'streamed ms':>11} {'ms/MiB saved':>12}"
+    )
+    for name, minutes in WINDOWS_MINUTES.items():
+        df = build_metric_frame(minutes)
+        for payload, encode in PAYLOADS.items():
+            body = encode(df)
+            for encoding in available_encodings():
+                for level in sorted({LEVELS[encoding], *OTHER_LEVELS[encoding]}):
+                    size = len(compress(body, encoding, level))
+                    seconds = best_time(lambda: compress(body, encoding, level))
+                    streamed = best_time(lambda: b"".join(compress_chunks(split_chunks(body), encoding, level)))
+                    saved_mib = (len(body) - size) / 1024**2
+                    print(
+                        f"{name:>6} {payload:>8} {len(body) / 1024:>8.0f} {encoding:>8} {level:>5}"
+                        f" {size / 1024:>8.1f} {size / len(body):>6.3f} {seconds * 1000:>8.2f}"
+                        f" {streamed * 1000:>11.2f} {seconds * 1000 / saved_mib:>12.2f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
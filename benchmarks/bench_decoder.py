@@ -0,0 +1,91 @@
+"""
+Benchmark of the NumPy time series decoder against `Query.as_dataframe` followed by the normalization the fetch
+paths used before (`benchmarks.legacy_normalize`).
+
+Builds synthetic ListTimeSeries responses for `request_latencies` (Distribution points, the series spread over a few
+response codes, some minutes missing) of increasing series count and window length, checks that both paths produce
+the same frame and prints the timings. Responses above MAX_LEGACY_POINTS are only decoded with the new path, since
+the legacy one takes minutes there.
+
+Usage:
+    python -m benchmarks.bench_decoder
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from google.cloud.monitoring_v3 import TimeSeries, _dataframe
+
+from benchmarks.legacy_normalize import normalize_dataframe
+from util.system_metric import _metric_aggregator
+
+RESPONSE_CODES = ["200", "302", "404", "429", "500"]
+SERIES_COUNTS = [5, 25, 100]
+WINDOWS_MINUTES = {"1h": 60, "1d": 60 * 24, "7d": 60 * 24 * 7}
+MAX_LEGACY_POINTS = 300_000
+
+
+def build_normalized_dataframe(time_series: list[TimeSeries], metric: str) -> pd.DataFrame:
+    """Decodes a response with the aggregator the fetch paths stream its pages into."""
+    aggregator = _metric_aggregator(metric)
+    aggregator.add(time_series)
+    return aggregator.result()
+
+
+def build_response(num_series: int, minutes: int, seed: int = 0) -> list[TimeSeries]:
+    """Builds the time series of a raw request_latencies response, one point per minute with 10% of gaps."""
+    rng = np.random.default_rng(seed)
+    start_seconds = int(pd.Timestamp("2024-01-19").timestamp())
+    response = []
+    for series_number in range(num_series):
+        series = TimeSeries()
+        message = TimeSeries.pb(series)
+        message.metric.labels["response_code"] = RESPONSE_CODES[series_number % len(RESPONSE_CODES)]
+        message.resource.labels["service_name"] = "dvwa"
+        message.value_type = 5
+        present = rng.random(minutes) >= 0.1
+        counts = rng.integers(1, 100, minutes)
+        means = rng.random(minutes) * 500
+        for minute in np.flatnonzero(present):
+            point = message.points.add()
+            point.interval.end_time.seconds = start_seconds + int(minute) * 60
+            point.value.distribution_value.count = int(counts[minute])
+            point.value.distribution_value.mean = float(means[minute])
+        response.append(series)
+    return response
+
+
+def legacy_decode(response: list[TimeSeries]) -> pd.DataFrame:
+    return normalize_dataframe(_dataframe._build_dataframe(response, label="response_code"), "request_latencies")
+
+
+def timed(func, *args) -> tuple[pd.DataFrame, float]:
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main() -> None:
+    print(f"{'series':>6} {'window':>6} {'points':>9} {'as_dataframe (s)':>17} {'decoder (s)':>12} {'speedup':>8}")
+    for num_series in SERIES_COUNTS:
+        for name, minutes in WINDOWS_MINUTES.items():
+            response = build_response(num_series, minutes)
+            num_points = sum(len(TimeSeries.pb(series).points) for series in response)
+            result, decoder_seconds = timed(build_normalized_dataframe, response, "request_latencies")
+            if num_points > MAX_LEGACY_POINTS:
+                print(f"{num_series:>6} {name:>6} {num_points:>9} {'-':>17} {decoder_seconds:>12.4f} {'-':>8}")
+                continue
+            expected, legacy_seconds = timed(legacy_decode, response)
+            pd.testing.assert_frame_equal(result, expected, check_freq=False)
+            print(
+                f"{num_series:>6} {name:>6} {num_points:>9} {legacy_seconds:>17.4f} {decoder_seconds:>12.4f}"
+                f" {legacy_seconds / decoder_seconds:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark of the LTTB downsampling of metric frames for `max_points`.
+
+Builds synthetic frames of 10k to 1M minutes (a daily cycle with noise and a few short spikes per label), reduces
+them to MAX_POINTS rows and prints the time taken, the size of the `DataFrame.to_json` payload before and after, and
+how many of the labels kept their largest spike.
+
+Usage:
+    python -m benchmarks.bench_downsample
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.downsample import downsample
+
+MAX_POINTS = 800
+NUM_ROWS = [10_000, 100_000, 1_000_000]
+LABEL_COUNTS = [1, 5]
+SPIKES_PER_LABEL = 5
+
+
+def build_frame(num_rows: int, num_labels: int, seed: int = 0) -> pd.DataFrame:
+    """Builds a frame of one row per minute with a daily cycle, noise and a few spikes in every label."""
+    rng = np.random.default_rng(seed)
+    minutes = np.arange(num_rows)
+    values = 100 + 50 * np.sin(2 * np.pi * minutes / 1440)[:, None] + rng.normal(0, 5, (num_rows, num_labels))
+    for label in range(num_labels):
+        spikes = rng.choice(num_rows, SPIKES_PER_LABEL, replace=False)
+        values[spikes, label] += rng.uniform(200, 400, SPIKES_PER_LABEL)
+    index = pd.date_range("2024-01-01", periods=num_rows, freq="min")
+    return pd.DataFrame(values, index=index, columns=[str(200 + label) for label in range(num_labels)])
+
+
+def timed(func, *args) -> tuple[pd.DataFrame, float]:
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main() -> None:
+    print(f"{'rows':>9} {'labels':>6} {'downsample (ms)':>16} {'full (KiB)':>11} {'sampled (KiB)':>14} {'peaks':>6}")
+    for num_rows in NUM_ROWS:
+        for num_labels in LABEL_COUNTS:
+            df = build_frame(num_rows, num_labels)
+            result, seconds = timed(downsample, df, MAX_POINTS)
+            full_size = len(df.to_json()) / 1024
+            downsampled_size = len(result.to_json()) / 1024
+            peaks = int((result.max() == df.max()).sum())
+            print(
+                f"{num_rows:>9} {num_labels:>6} {seconds * 1000:>16.1f} {full_size:>11.0f} {downsampled_size:>14.1f}"
+                f" {peaks:>3}/{num_labels:<2}"
+            )
+
+
+if __name__ == "__main__":
+    main()
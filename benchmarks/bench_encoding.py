@@ -0,0 +1,58 @@
+"""
+Benchmark of the metric response encodings: encode time and payload size against the legacy `to_json` response.
+
+Encodes synthetic normalized frames (4 labels) for increasing window sizes with every encoding available in
+`util.metric_format`. The legacy size and time include the second JSON encoding done by `jsonify(df.to_json())`.
+
+Usage:
+    python -m benchmarks.bench_encoding
+"""
+
+import json
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from util.metric_format import dumps_columnar, msgpack, pa, to_arrow, to_columnar, to_msgpack
+
+LABELS = ["200", "302", "404", "500"]
+WINDOWS_MINUTES = {"1h": 60, "1d": 60 * 24, "7d": 60 * 24 * 7, "30d": 60 * 24 * 30}
+
+
+def build_metric_frame(minutes: int, seed: int = 0) -> pd.DataFrame:
+    """Builds a frame shaped like the output of `get_metric`, with a share of idle (0.0) minutes."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01", periods=minutes, freq="min")
+    values = rng.random((minutes, len(LABELS))) * 100
+    values[rng.random(values.shape) < 0.3] = 0.0
+    return pd.DataFrame(values, index=index, columns=LABELS)
+
+
+def main() -> None:
+    encoders = {
+        "to_json (legacy)": lambda df: json.dumps(df.to_json()).encode(),
+        "columnar json": lambda df: dumps_columnar(to_columnar(df)).encode(),
+    }
+    if msgpack is not None:
+        encoders["msgpack"] = to_msgpack
+    if pa is not None:
+        encoders["arrow ipc"] = to_arrow
+
+    print(f"{'window':>6} {'encoding':>18} {'bytes':>10} {'ratio':>7} {'encode (ms)':>12} {'speedup':>8}")
+    for name, minutes in WINDOWS_MINUTES.items():
+        df = build_metric_frame(minutes)
+        legacy_size = legacy_time = 0.0
+        for encoding, encode in encoders.items():
+            size = len(encode(df))
+            seconds = min(timeit.repeat(lambda: encode(df), number=1, repeat=7))
+            if not legacy_size:
+                legacy_size, legacy_time = size, seconds
+            print(
+                f"{name:>6} {encoding:>18} {size:>10} {size / legacy_size:>7.2f} {seconds * 1000:>12.3f}"
+                f" {legacy_time / seconds:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of the vectorized `Query.as_dataframe` normalization (`benchmarks.legacy_normalize`) against the previous
+iterrows-based implementation.
+
+Builds synthetic `request_latencies`-shaped frames (Distribution cells, a few response codes, some gaps) for
+increasing window sizes, checks that both paths produce identical values and prints the timings. The old path left
+the unpacked means in object columns while the new one stores float64, so only the dtype differs; `to_json` output is
+identical.
+
+The response codes are kept unique: with duplicated labels the old `df.loc[index, column_name]` write assigned one
+series' mean to every column sharing the label, so the two paths only agree bit-for-bit on unique labels.
+
+Usage:
+    python -m benchmarks.bench_normalize
+"""
+
+import timeit
+
+import numpy as np
+import pandas as pd
+from google.api.distribution_pb2 import Distribution
+
+from benchmarks.legacy_normalize import normalize_dataframe
+
+RESPONSE_CODES = ["200", "302", "404", "429", "500"]
+WINDOWS_MINUTES = {"1h": 60, "1d": 60 * 24, "7d": 60 * 24 * 7}
+
+
+def _normalize_dataframe_iterrows(df: pd.DataFrame, metric: str = "") -> pd.DataFrame:
+    """The original cell-by-cell implementation, kept as the reference for the benchmark."""
+    df = df.fillna(0.0)
+    df.index = df.index.map(lambda x: x.replace(second=0, microsecond=0))
+    for index, row in df.iterrows():
+        for column_name, value in row.items():
+            if hasattr(value, "mean"):
+                df.loc[index, column_name] = value.mean  # type: ignore
+    match metric:
+        case "request_count" | "request_latencies":
+            df = df.T.groupby(level=0).sum().T
+        case "CPU_utilization" | "memory_utilization":
+            df = df.T.groupby(level=0).max().T
+            df = df * 100
+        case "startup_latency" | "instance_count":
+            df = df.T.groupby(level=0).max().T
+        case _:
+            df = df.T.groupby(level=0).sum().T
+    return df
+
+
+def build_latency_frame(minutes: int, seed: int = 0) -> pd.DataFrame:
+    """Builds a frame shaped like `Query.as_dataframe(label="response_code")` for request_latencies."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-19 00:00:00").value
+    index = pd.to_datetime(start + np.arange(minutes, dtype=np.int64) * 60_000_000_000 + 5_000_000_000)
+    data = np.empty((minutes, len(RESPONSE_CODES)), dtype=object)
+    for row in range(minutes):
+        for column in range(len(RESPONSE_CODES)):
+            if rng.random() < 0.2:
+                data[row, column] = np.nan
+            else:
+                data[row, column] = Distribution(count=int(rng.integers(1, 100)), mean=float(rng.random() * 500))
+    return pd.DataFrame(data, index=index, columns=pd.MultiIndex.from_arrays([RESPONSE_CODES]))
+
+
+def main() -> None:
+    print(f"{'window':>8} {'rows':>7} {'iterrows (s)':>13} {'vectorized (s)':>15} {'speedup':>8}")
+    for name, minutes in WINDOWS_MINUTES.items():
+        df = build_latency_frame(minutes)
+        expected = _normalize_dataframe_iterrows(df.copy(), "request_latencies")
+        actual = normalize_dataframe(df.copy(), "request_latencies")
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_exact=True)
+        assert actual.to_json() == expected.to_json()
+
+        repeat = 1 if minutes > 60 * 24 else 3
+        legacy = min(
+            timeit.repeat(
+                lambda: _normalize_dataframe_iterrows(df.copy(), "request_latencies"), number=1, repeat=repeat
+            )
+        )
+        vectorized = min(
+            timeit.repeat(lambda: normalize_dataframe(df.copy(), "request_latencies"), number=1, repeat=5)
+        )
+        print(f"{name:>8} {minutes:>7} {legacy:>13.4f} {vectorized:>15.4f} {legacy / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+The normalization of `Query.as_dataframe` frames that `util.system_metric` used before the NumPy time series decoder,
+kept as the reference the benchmarks compare `util.timeseries_decoder.MinuteAggregator` with. The fetch paths do not
+use it anymore.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Unpacks Distribution values to their mean and count, element-wise over an object array
+_distribution_mean = np.frompyfunc(lambda value: value.mean if hasattr(value, "mean") else value, 1, 1)
+_distribution_count = np.frompyfunc(lambda value: value.count if hasattr(value, "bucket_counts") else 0, 1, 1)
+
+
+def normalize_dataframe(df: pd.DataFrame, metric: str = "") -> pd.DataFrame:
+    """
+    Normalizes and aggregates a DataFrame with potentially duplicated column names.
+
+    This function first fills any NaN values with 0.0. It then standardizes the data by replacing Distribution values
+    with their mean, one column at a time. Finally, it handles duplicated column names by transposing the DataFrame,
+    grouping by column names, aggregating the values, and transposing back. This method is chosen to avoid the
+    deprecation warning associated with using DataFrame.groupby with axis=1. Latency distributions sharing a label
+    are merged: their means are weighted by their counts.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to be normalized and aggregated.
+        metric (str): The metric the DataFrame belongs to, which selects the aggregation (sum or max) applied to
+                      duplicated columns. Unknown or empty metrics are summed.
+
+    Returns:
+        pd.DataFrame: The normalized and aggregated DataFrame.
+    """
+    # Fill NaN values with 0.0
+    df = df.fillna(0.0)
+
+    # remove seconds and microseconds from the index
+    df.index = df.index.floor("min")
+
+    # Standardize the data (e.g., averaging values across multiple time points)
+    # Only object columns can hold Distribution values, so numeric columns are left untouched. The unpacked columns
+    # are stored as float64 so that the aggregation below runs on a single numeric block instead of per-cell objects
+    counts = np.zeros(df.shape, dtype=np.float64) if metric == "request_latencies" else None
+    for column_position, dtype in enumerate(df.dtypes):
+        if dtype == object:
+            values = df.iloc[:, column_position].to_numpy()
+            if counts is not None:
+                counts[:, column_position] = _distribution_count(values).astype(np.float64)
+            df.isetitem(column_position, _distribution_mean(values).astype(np.float64))
+
+    # Transpose the DataFrame, group by the column names and sum the values, and then transpose back
+    # This approach is used to handle the deprecation warning for DataFrame.groupby with axis=1
+    match metric:
+        case "request_latencies":
+            df = _merge_distribution_means(df, counts)
+        case "request_count":
+            df = df.T.groupby(level=0).sum().T
+        case "CPU_utilization" | "memory_utilization":
+            df = df.T.groupby(level=0).max().T
+            # convert to percentage
+            df = df * 100
+        case "startup_latency" | "instance_count":
+            df = df.T.groupby(level=0).max().T
+        case _:
+            df = df.T.groupby(level=0).sum().T
+    return df
+
+
+def _merge_distribution_means(df: pd.DataFrame, counts: np.ndarray) -> pd.DataFrame:
+    """
+    Merges columns sharing a label into the mean of their merged distributions, i.e. the count-weighted mean.
+
+    Columns with a unique label keep their mean as is, rather than a mean multiplied and divided back by its count,
+    which is not bit-exact. Cells without a count (no Distribution values, e.g. already reduced on the server) keep
+    the sum of the values.
+    """
+    labels = df.columns.get_level_values(0)
+    sums = df.T.groupby(level=0).sum().T
+    shared = sums.columns.isin(labels[labels.duplicated()])
+    if not shared.any():
+        return sums
+    weights = pd.DataFrame(counts, index=df.index, columns=df.columns)
+    weighted_sums = (df * weights).T.groupby(level=0).sum().T
+    total_counts = weights.T.groupby(level=0).sum().T
+    merged = weighted_sums / total_counts.where(total_counts != 0, 1.0)
+    return sums.where((total_counts == 0) | ~shared, merged)
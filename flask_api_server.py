@@ -1,14 +1,60 @@
 import os
+import queue
 import sqlite3
+import time
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt, jwt_required
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from util.async_monitoring import iterate_on_monitoring_loop
 from util.cloud_run_upscale import cloud_run_upscale, get_resources_limits
-from util.system_metric import get_all_metrics, get_metric
+from util.compression import MIN_BYTES, STREAM_BYTES, compress, compress_chunks, negotiate_encoding, split_chunks
+from util.downsample import parse_max_points
+from util.metric_format import (
+    JSON_MIMETYPE,
+    MSGPACK_MIMETYPE,
+    NDJSON_MIMETYPE,
+    SSE_MIMETYPE,
+    all_metrics_to_columnar,
+    binary_mimetypes,
+    dumps_columnar,
+    encode_all_binary,
+    encode_binary,
+    frames_etag,
+    heatmap_to_msgpack,
+    msgpack,
+    parse_format,
+    to_columnar,
+    to_heatmap,
+    to_metric_message,
+    to_ndjson_line,
+    to_sse_event,
+)
+from util.system_metric import (
+    METRICS_INFO,
+    all_metrics_to_json,
+    get_all_metric_frames,
+    get_all_metric_results,
+    get_metric,
+    get_metric_age,
+    get_metric_batch,
+    get_metric_broadcaster,
+    get_metric_heatmap,
+    get_metric_stats,
+    is_immutable_window,
+    iter_all_metric_frames,
+    metric_envelope,
+    parse_metric_batch,
+    parse_metric_percentiles,
+    parse_metric_reducer,
+    parse_resolution,
+    parse_time_range,
+    plan_metric_tier,
+    start_metric_poller,
+)
 
 load_dotenv()
 app = Flask(__name__)
@@ -18,6 +64,190 @@ app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
 jwt = JWTManager(app)
 
 DATABASE_PATH = os.environ.get("DATABASE_PATH", "./db/database.db")
+# Sent with the metrics of windows that cannot change anymore. 'private' keeps shared caches from serving responses
+# of authenticated requests to others, set 'public, ...' when the CDN in front checks the token itself.
+IMMUTABLE_CACHE_CONTROL = os.environ.get("METRIC_IMMUTABLE_CACHE_CONTROL", "private, max-age=31536000, immutable")
+# Seconds between two comments sent on an idle metric stream, so that proxies keep it open and a gone client is noticed
+STREAM_KEEPALIVE = float(os.environ.get("METRIC_STREAM_KEEPALIVE", 15))
+
+
+@app.before_request
+def start_background_tasks():
+    # Started with the first request rather than at import, so that the reloader process of `app.run(debug=True)`
+    # does not poll as well
+    if os.environ.get("METRIC_POLLER", "0") == "1":
+        start_metric_poller()
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """
+    Compresses the body of a successful response with the best encoding of the 'Accept-Encoding' header (zstd,
+    brotli or gzip, see `util.compression`), when it has at least METRIC_COMPRESSION_MIN_BYTES. Bodies of
+    METRIC_COMPRESSION_STREAM_BYTES or more, and streamed ones, are compressed chunk by chunk while they are sent.
+    A strong 'ETag' becomes weak, as the compressed bytes differ with the encoding.
+    """
+    if response.status_code != 200 or "Content-Encoding" in response.headers or response.direct_passthrough:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.iter_encoded(), encoding, flush=True)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_BYTES:
+            return response
+        if len(body) >= STREAM_BYTES:
+            response.response = compress_chunks(split_chunks(body), encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def with_metric_age(response, *results):
+    """
+    Adds an 'X-Metric-Age' header with the age, in seconds, of the oldest metric data in the response.
+    """
+    ages = [age for age in map(get_metric_age, results) if age is not None]
+    if ages:
+        response.headers["X-Metric-Age"] = str(int(max(ages)))
+    return response
+
+
+def with_cache_headers(response: Response, time_range: tuple | None) -> Response:
+    """
+    Marks the response of an absolute window that cannot change anymore as immutable: a long-lived 'Cache-Control'
+    and a strong 'ETag' of the body, with a matching 'If-None-Match' of a GET answered by 304 Not Modified.
+    """
+    if time_range is None or not is_immutable_window(time_range[1]):
+        return response
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add("Accept")
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def not_modified(etag: str) -> Response | None:
+    """
+    Returns a 304 Not Modified response when the 'If-None-Match' header matches `etag`, so that an unchanged poll
+    costs neither the encoding nor the body. The endpoints only read, so a POST is answered like a GET.
+    """
+    # Weak comparison, a compressed response carries the weak form of the ETag
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def request_params() -> dict:
+    """
+    Returns the parameters of a metric request: the JSON body of a POST, or the query string of a GET, whose
+    responses browsers and CDNs can cache.
+    """
+    if request.method == "GET":
+        return request.args.to_dict()
+    return request.json  # type: ignore
+
+
+def parse_flag(value) -> bool:
+    """
+    Converts a boolean parameter, also 'true', 'false', '1' or '0' from a query string.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def parse_list_param(value):
+    """
+    Converts a list parameter, which a query string gives comma separated (e.g. 'percentiles=50,99'), or 'true'.
+    """
+    if not isinstance(value, str):
+        return value
+    if value.strip().lower() in ("", "true", "false", "1", "0"):
+        return parse_flag(value) or None
+    return value.split(",")
+
+
+def parse_int_param(value):
+    """
+    Converts a whole number parameter given as a string by a query string, other values are left as they are.
+    """
+    return int(value) if isinstance(value, str) and value.strip().isdigit() else value
+
+
+def json_response(body: str) -> Response:
+    """
+    Wraps an already serialized JSON document in a response.
+    """
+    return Response(body, mimetype=JSON_MIMETYPE)
+
+
+def ndjson_response(frames, response_format: str) -> Response:
+    """
+    Streams the results of `iter_all_metric_frames` as NDJSON, one line per metric as soon as it is ready (see
+    `util.metric_format.to_ndjson_line`).
+    """
+
+    def lines():
+        for metric, result in iterate_on_monitoring_loop(frames):
+            yield to_ndjson_line(metric, result, response_format, get_metric_age(result))
+
+    response = Response(lines(), mimetype=NDJSON_MIMETYPE)
+    # Keeps proxies such as nginx from holding the lines back until the end of the response
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def sse_response(metrics: list[str], response_format: str, expires_at: float | None) -> Response:
+    """
+    Streams the new minute rows of metrics from the shared broadcaster as Server-Sent Events (see
+    `util.metric_stream.MetricBroadcaster`), until the client goes away or its token expires.
+    """
+
+    def events():
+        broadcaster = get_metric_broadcaster()
+        subscription = broadcaster.subscribe(metrics)
+        try:
+            while expires_at is None or time.time() < expires_at:
+                timeout = STREAM_KEEPALIVE if expires_at is None else min(STREAM_KEEPALIVE, expires_at - time.time())
+                try:
+                    event = subscription.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                kind, metric, payload = event
+                if kind == "error":
+                    yield to_sse_event("metric_error", {"metric": metric, "error": payload})
+                else:
+                    message = to_metric_message(metric, payload, response_format, get_metric_age(payload))
+                    yield to_sse_event("rows", message)
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    response = Response(events(), mimetype=SSE_MIMETYPE)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def negotiate_binary_mimetype() -> str | None:
+    """
+    Returns the binary metric encoding preferred by the 'Accept' header, or None if JSON should be sent.
+    """
+    best_match = request.accept_mimetypes.best_match([JSON_MIMETYPE, *binary_mimetypes()])
+    return best_match if best_match in binary_mimetypes() else None
 
 
 def get_db_connection():
@@ -124,7 +354,7 @@ def check_page():
     return "The server is running!"
 
 
-@app.route("/api/system_metric", methods=["POST"])
+@app.route("/api/system_metric", methods=["GET", "POST"])
 @jwt_required()
 def get_system_metric_api():
     """
@@ -140,25 +370,158 @@ def get_system_metric_api():
         days (int): The number of days to go back in time for the metric data.
         hours (int): The number of hours to go back in time for the metric data.
         minutes (int): The number of minutes to go back in time for the metric data.
+        incremental (bool): Whether to only fetch the minutes added since the previous query of the same window.
+                            Intended for dashboards polling a fixed window. Defaults to False.
+        resolution (str | None): The period the data is aggregated to by Cloud Monitoring, e.g. '60s', '5m', '1h'.
+                                 Defaults to the raw one-minute data.
+        reducer (str | None): How series sharing a label are combined with a resolution: 'sum', 'mean', 'max' or
+                              'min'. Defaults to the aggregation of the metric.
+        percentiles (bool | list[float] | None): For 'request_latencies', 'startup_latency', 'CPU_utilization' and
+                                                 'memory_utilization', the percentiles to return instead of the means
+                                                 per label, e.g. [50, 99], or true for p50, p90, p95 and p99. They
+                                                 are estimated from the histograms of all labels merged per period.
+        points (int | None): The number of rows wanted over the window, for long ranges. The coarsest of the 1 minute,
+                             5 minute and 1 hour rollup tiers that still gives at least that many rows is returned.
+                             Cannot be combined with a resolution, a reducer or percentiles.
+        max_points (int | None): The maximum number of rows per metric, e.g. the width of the chart in pixels. Longer
+                                 series are downsampled with Largest-Triangle-Three-Buckets, which keeps peaks.
+        start (str | int | None): The start of an absolute window instead of days, hours and minutes back from now:
+                                  an ISO 8601 time (UTC unless it has an offset) or an epoch time in seconds,
+                                  floored to the minute. Requires end.
+        end (str | int | None): The end of an absolute window.
+        format (str | None): 'json' for the `DataFrame.to_json` string (default), or 'columnar' for an object with
+                             one epoch-millisecond 'timestamps' array and one float array per label in 'series'.
 
     Returns:
         str: The JSON representation of the metric data. If an error occurs, the JSON representation of the error
-             message is returned instead.
+             message is returned instead. The 'X-Metric-Age' header holds the age of the data in seconds, which
+             grows while the background poller (enabled with METRIC_POLLER=1) cannot refresh it.
+
+    Note:
+        An 'Accept' header preferring 'application/vnd.apache.arrow.stream' or 'application/msgpack' returns the
+        metric data in that binary encoding instead (see `util.metric_format`), when the encoder is installed.
+        The 'ETag' header is a hash of the metric data and the encoding (see `util.metric_format.frames_etag`), and a
+        request whose 'If-None-Match' header matches it gets 304 Not Modified, without encoding the data.
+        The parameters can also be given as the query string of a GET, e.g. '?metric=request_count&start=...'. The
+        response of an absolute window that ended before the settle delay cannot change anymore: it is sent with
+        a long-lived 'Cache-Control' (METRIC_IMMUTABLE_CACHE_CONTROL) and a strong 'ETag', and a GET with a
+        matching 'If-None-Match' gets 304 Not Modified.
     """
-    request_body: dict[str, str] = request.json  # type: ignore
+    request_body: dict[str, str] = request_params()
     metric = request_body["metric"]
     days = int(request_body.get("days", 0))
     hours = int(request_body.get("hours", 0))
     minutes = int(request_body.get("minutes", 0))
+    incremental = parse_flag(request_body.get("incremental", False))
+    resolution = request_body.get("resolution", None)
+    reducer = request_body.get("reducer", None)
+    percentiles = parse_list_param(request_body.get("percentiles", None))
+    points = parse_int_param(request_body.get("points", None))
+    start = request_body.get("start", None)
+    end = request_body.get("end", None)
+    try:
+        parse_resolution(resolution)
+        parse_metric_percentiles(metric, percentiles, parse_metric_reducer(reducer, resolution))
+        max_points = parse_max_points(request_body.get("max_points", None))
+        time_range = parse_time_range(start, end)
+        if points is not None:
+            plan_metric_tier(days, hours, minutes, points, resolution, reducer, percentiles, start, end)
+        response_format = parse_format(request_body.get("format", None))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
-        df = get_metric(metric, days, hours, minutes)
-        return jsonify(df.to_json()), 200
+        df = get_metric(
+            metric,
+            days,
+            hours,
+            minutes,
+            incremental=incremental,
+            resolution=resolution,
+            reducer=reducer,
+            percentiles=percentiles,
+            points=points,
+            max_points=max_points,
+            start=start,
+            end=end,
+        )
+        binary_mimetype = negotiate_binary_mimetype()
+        etag = frames_etag({metric: df}, binary_mimetype or response_format)
+        response = not_modified(etag)
+        if response is None:
+            if binary_mimetype is not None:
+                response = Response(encode_binary(df, binary_mimetype), mimetype=binary_mimetype)
+            elif response_format == "columnar":
+                response = json_response(dumps_columnar(to_columnar(df)))
+            else:
+                response = jsonify(df.to_json())
+            response.set_etag(etag)
+        return with_cache_headers(with_metric_age(response, df), time_range)
     except Exception as e:
         print(f"An error occurred while getting the metric '{metric}':\n{e}")
         return jsonify(f"An error occurred while getting the metric '{metric}':\n{e}"), 500
 
 
-@app.route("/api/all_system_metric", methods=["POST"])
+@app.route("/api/metric_heatmap", methods=["GET", "POST"])
+@jwt_required()
+def get_metric_heatmap_api():
+    """
+    Retrieves the time x bucket heatmap of a distribution metric, e.g. to spot tail-latency regressions.
+
+    Args:
+        metric (str | None): 'request_latencies' (default), 'startup_latency', 'CPU_utilization' or
+                             'memory_utilization'.
+        days (int): The number of days to go back in time for the metric data.
+        hours (int): The number of hours to go back in time for the metric data.
+        minutes (int): The number of minutes to go back in time for the metric data.
+        resolution (str | None): The period of a row, e.g. '60s', '5m', '1h'. Defaults to one minute.
+        start (str | int | None): The start of an absolute window instead of days, hours and minutes back from now:
+                                  an ISO 8601 time (UTC unless it has an offset) or an epoch time in seconds,
+                                  floored to the minute. Requires end.
+        end (str | int | None): The end of an absolute window.
+
+    Returns:
+        str: The JSON object {'timestamps': [...], 'buckets': [...], 'counts': [[...], ...]}, with one epoch
+             millisecond timestamp per row, the lower edge of every bucket and the request count of every row and
+             bucket. If an error occurs, the JSON representation of the error message is returned instead.
+
+    Note:
+        An 'Accept' header preferring 'application/msgpack' returns the arrays as raw little-endian buffers instead
+        (see `util.metric_format.heatmap_to_msgpack`), when msgpack is installed.
+        The parameters can also be given as the query string of a GET, e.g.
+        '?metric=request_latencies&start=...&end=...'. The response of an absolute window that ended before the
+        settle delay cannot change anymore: it is sent with a long-lived 'Cache-Control'
+        (METRIC_IMMUTABLE_CACHE_CONTROL) and a strong 'ETag', and a GET with a matching 'If-None-Match' gets 304 Not
+        Modified.
+    """
+    request_body: dict[str, str] = request_params()
+    metric = request_body.get("metric", "request_latencies")
+    days = int(request_body.get("days", 0))
+    hours = int(request_body.get("hours", 0))
+    minutes = int(request_body.get("minutes", 0))
+    resolution = request_body.get("resolution", None)
+    start = request_body.get("start", None)
+    end = request_body.get("end", None)
+    try:
+        parse_resolution(resolution)
+        time_range = parse_time_range(start, end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        df = get_metric_heatmap(metric, days, hours, minutes, resolution=resolution, start=start, end=end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"An error occurred while getting the heatmap of '{metric}':\n{e}")
+        return jsonify(f"An error occurred while getting the heatmap of '{metric}':\n{e}"), 500
+    accepted = request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE])
+    if msgpack is not None and accepted == MSGPACK_MIMETYPE:
+        response = Response(heatmap_to_msgpack(df), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = json_response(dumps_columnar(to_heatmap(df)))
+    return with_cache_headers(with_metric_age(response, df), time_range)
+
+
+@app.route("/api/all_system_metric", methods=["GET", "POST"])
 @jwt_required()
 async def get_all_system_metric_api():
     """
@@ -174,22 +537,204 @@ async def get_all_system_metric_api():
         days (int): The number of days to go back in time for the metric data.
         hours (int): The number of hours to go back in time for the metric data.
         minutes (int): The number of minutes to go back in time for the metric data.
+        incremental (bool): Whether to only fetch the minutes added since the previous query of the same window.
+                            Intended for dashboards polling a fixed window. Defaults to False.
+        resolution (str | None): The period the data is aggregated to by Cloud Monitoring, e.g. '60s', '5m', '1h'.
+                                 Defaults to the raw one-minute data.
+        reducer (str | None): How series sharing a label are combined with a resolution: 'sum', 'mean', 'max' or
+                              'min'. Defaults to the aggregation of the metric.
+        points (int | None): The number of rows wanted over the window, for long ranges. The coarsest of the 1 minute,
+                             5 minute and 1 hour rollup tiers that still gives at least that many rows is returned.
+                             Cannot be combined with a resolution, a reducer or percentiles.
+        max_points (int | None): The maximum number of rows per metric, e.g. the width of the chart in pixels. Longer
+                                 series are downsampled with Largest-Triangle-Three-Buckets, which keeps peaks.
+        start (str | int | None): The start of an absolute window instead of days, hours and minutes back from now:
+                                  an ISO 8601 time (UTC unless it has an offset) or an epoch time in seconds,
+                                  floored to the minute. Requires end.
+        end (str | int | None): The end of an absolute window.
+        format (str | None): 'json' for the `DataFrame.to_json` string (default), or 'columnar' for an object with
+                             one epoch-millisecond 'timestamps' array and one float array per label in 'series'.
+        stream (bool): Whether to stream the metrics as NDJSON, one line per metric written as soon as it is ready,
+                       e.g. '{"metric": "CPU_utilization", "age": 12.0, "data": ...}' or '{"metric": ..., "error":
+                       ...}', so that the slowest metric does not hold back the others. Defaults to False.
+        envelope (bool): Whether to return, per metric, an object with its 'status' ('ok' or 'error'), 'error_class'
+                         and 'error', where it was served from as 'cache' ('hit', 'miss', 'shared', 'poller' or
+                         'rollup'), 'elapsed_ms', 'upstream_ms', 'normalize_ms', the number of values as 'points',
+                         the 'age' of the data and the data in the requested format as 'data' (see
+                         `util.system_metric.metric_envelope`), rather than the data or an error string. Defaults to
+                         False.
 
     Returns:
         str: The JSON representation of the metric data. If an error occurs, the JSON representation of the error
-             message is returned instead.
+             message is returned instead. The 'X-Metric-Age' header holds the age of the data in seconds, which
+             grows while the background poller (enabled with METRIC_POLLER=1) cannot refresh it.
+
+    Note:
+        An 'Accept' header preferring 'application/vnd.apache.arrow.stream' or 'application/msgpack' returns the
+        metric data in that binary encoding instead (see `util.metric_format`), when the encoder is installed.
+        The 'ETag' header is a hash of the metric data and the encoding (see `util.metric_format.frames_etag`), and a
+        request whose 'If-None-Match' header matches it gets 304 Not Modified, without encoding the data.
+        The parameters can also be given as the query string of a GET, e.g. '?start=...&end=...&format=columnar'.
+        The response of an absolute window that ended before the settle delay cannot change anymore: it is sent with
+        a long-lived 'Cache-Control' (METRIC_IMMUTABLE_CACHE_CONTROL) and a strong 'ETag', and a GET with a
+        matching 'If-None-Match' gets 304 Not Modified.
+        A streamed response has the age of every metric in its line, and neither an 'ETag' nor a binary encoding.
+        An enveloped response is JSON, without an 'ETag', as its timings differ with every request.
     """
-    request_body: dict[str, str] = request.json  # type: ignore
+    request_body: dict[str, str] = request_params()
     days = int(request_body.get("days", 0))
     hours = int(request_body.get("hours", 0))
     minutes = int(request_body.get("minutes", 0))
+    incremental = parse_flag(request_body.get("incremental", False))
+    resolution = request_body.get("resolution", None)
+    reducer = request_body.get("reducer", None)
+    points = parse_int_param(request_body.get("points", None))
+    start = request_body.get("start", None)
+    end = request_body.get("end", None)
     try:
-        return jsonify(await get_all_metrics(days, hours, minutes)), 200
+        parse_resolution(resolution)
+        parse_metric_reducer(reducer, resolution)
+        max_points = parse_max_points(request_body.get("max_points", None))
+        time_range = parse_time_range(start, end)
+        if points is not None:
+            plan_metric_tier(days, hours, minutes, points, resolution, reducer, None, start, end)
+        response_format = parse_format(request_body.get("format", None))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    options = {
+        "incremental": incremental,
+        "resolution": resolution,
+        "reducer": reducer,
+        "points": points,
+        "max_points": max_points,
+        "start": start,
+        "end": end,
+    }
+    if parse_flag(request_body.get("stream", False)):
+        return ndjson_response(iter_all_metric_frames(days, hours, minutes, **options), response_format)
+    try:
+        if parse_flag(request_body.get("envelope", False)):
+            traced_results = await get_all_metric_results(days, hours, minutes, **options)
+            envelopes = {
+                metric: {
+                    **metric_envelope(metric, metric_result),
+                    "data": to_metric_message(metric, metric_result.result, response_format, None).get("data"),
+                }
+                for metric, metric_result in traced_results.items()
+            }
+            frames = [metric_result.result for metric_result in traced_results.values()]
+            return with_metric_age(json_response(dumps_columnar(envelopes)), *frames)
+        results = await get_all_metric_frames(days, hours, minutes, **options)
+        binary_mimetype = negotiate_binary_mimetype()
+        etag = frames_etag(results, binary_mimetype or response_format)
+        response = not_modified(etag)
+        if response is None:
+            if binary_mimetype is not None:
+                response = Response(encode_all_binary(results, binary_mimetype), mimetype=binary_mimetype)
+            elif response_format == "columnar":
+                response = json_response(dumps_columnar(all_metrics_to_columnar(results)))
+            else:
+                response = jsonify(all_metrics_to_json(results))
+            response.set_etag(etag)
+        # A window with a failed metric is not cached, the next request tries again
+        if any(isinstance(result, Exception) for result in results.values()):
+            time_range = None
+        return with_cache_headers(with_metric_age(response, *results.values()), time_range)
     except Exception as e:
         print(f"An error occurred while getting the metrics:\n{e}")
         return jsonify(f"An error occurred while getting the metrics:\n{e}"), 500
 
 
+@app.route("/api/metric_batch", methods=["POST"])
+@jwt_required()
+async def get_metric_batch_api():
+    """
+    Retrieves several metrics, each over its own window, in one request, e.g. CPU over the last hour, the request
+    count over the last day and the latencies over the last week for one dashboard.
+
+    The queries run concurrently and share the clients, the metric cache and the coalescing of identical queries
+    with every other request, so a metric queried twice with the same window is fetched once.
+
+    Args:
+        queries (list[dict]): At most METRIC_BATCH_MAX_QUERIES (default 20) queries, each with a 'metric', a window
+                              given as 'window' (e.g. '1h', '24h', '7d'), as 'days', 'hours' and 'minutes', or as
+                              'start' and 'end', the options 'resolution', 'reducer', 'percentiles', 'points',
+                              'max_points' and 'incremental' of `/api/system_metric`, and an optional 'id'.
+        format (str | None): 'json' for the `DataFrame.to_json` string of every query (default), or 'columnar'.
+
+    Returns:
+        str: {"results": [...], "elapsed_ms": ...} with, in the order of the queries, e.g. {"id": "cpu", "metric":
+             "CPU_utilization", "status": "ok", "elapsed_ms": 180.4, "age": 12.0, "data": ...}, or a status 'error'
+             and an 'error' message for a query that failed. A batch with an invalid query gets 400 and the position
+             of the query.
+    """
+    started = time.perf_counter()
+    request_body: dict = request.json  # type: ignore
+    if type(request_body) is not dict:
+        return jsonify({"error": "Expected an object with a list of 'queries'."}), 400
+    try:
+        queries = parse_metric_batch(request_body.get("queries"))
+        response_format = parse_format(request_body.get("format", None))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        results = []
+        for query, result, elapsed in await get_metric_batch(queries):
+            message = to_metric_message(query.metric, result, response_format, get_metric_age(result))
+            status = "error" if isinstance(result, Exception) else "ok"
+            results.append({"id": query.id, "status": status, "elapsed_ms": round(elapsed * 1000, 1), **message})
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        return json_response(dumps_columnar({"results": results, "elapsed_ms": elapsed_ms}))
+    except Exception as e:
+        print(f"An error occurred while getting the metric batch:\n{e}")
+        return jsonify(f"An error occurred while getting the metric batch:\n{e}"), 500
+
+
+@app.route("/api/metric_stream", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def metric_stream_api():
+    """
+    Streams the new minute rows of metrics as Server-Sent Events, for live screens that would otherwise poll.
+
+    The token is checked once, when the stream opens, and the stream ends when it expires, so that the client
+    reconnects with a new one. As `EventSource` cannot send headers, the token can also be given as the 'jwt'
+    parameter of the query string. All streams share one fetch of every metric per METRIC_STREAM_INTERVAL
+    seconds, whatever the number of clients.
+
+    Args:
+        metrics (str | None): The comma separated metrics to stream, e.g. 'CPU_utilization,memory_utilization'.
+                              Defaults to every metric.
+        format (str | None): 'json' for the `DataFrame.to_json` string of the rows (default), or 'columnar'.
+
+    Returns:
+        str: A 'text/event-stream' of 'rows' events, whose data is e.g. {"metric": "CPU_utilization", "age": 3.0,
+             "data": ...} with the rows that are new or changed since the previous event (the last
+             METRIC_STREAM_WINDOW_MINUTES minutes at first), and 'metric_error' events, whose data is
+             {"metric": ..., "error": ...}, when a metric could not be fetched.
+    """
+    metrics = [metric for metric in request.args.get("metrics", "").split(",") if metric] or list(METRICS_INFO)
+    try:
+        unknown = [metric for metric in metrics if metric not in METRICS_INFO]
+        if unknown:
+            raise ValueError(f"Invalid metrics '{', '.join(unknown)}', expected some of {', '.join(METRICS_INFO)}.")
+        response_format = parse_format(request.args.get("format", None))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return sse_response(metrics, response_format, get_jwt().get("exp"))
+
+
+@app.route("/api/metric_stats", methods=["POST"])
+@jwt_required()
+def get_metric_stats_api():
+    """
+    Retrieves the counters of the metric cache and of the coalescing of identical in-flight metric queries.
+
+    Returns:
+        str: The JSON representation of the counters.
+    """
+    return jsonify(get_metric_stats()), 200
+
+
 @app.route("/api/cloud_run_upscale", methods=["POST"])
 @jwt_required()
 def cloud_run_upscale_api():
@@ -223,18 +768,21 @@ def cloud_run_upscale_api():
     return jsonify("Cloud Run service could not be upscaled."), 500
 
 
-@app.route("/api/get_resources_limits", methods=["POST"])
+@app.route("/api/get_resources_limits", methods=["GET", "POST"])
 def get_resources_limits_api():
     """
     Retrieves the current memory and CPU limits of the Google Cloud Run service.
 
     Returns:
         str: The JSON representation of the resource limits. If an error occurs, the JSON representation of the error
-             message is returned instead.
+             message is returned instead. The 'ETag' header identifies the limits, and a request whose
+             'If-None-Match' header matches it gets 304 Not Modified without a body.
     """
     try:
         result = get_resources_limits()
-        return jsonify(result), 200
+        response = jsonify(result)
+        response.add_etag()
+        return not_modified(response.get_etag()[0]) or response
     except Exception as e:
         return jsonify(f"An error occurred while getting the resource limits:\n{e}"), 500
 
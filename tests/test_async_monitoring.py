@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+from util.async_monitoring import iterate_on_monitoring_loop, run_in_normalize_pool, run_on_monitoring_loop
+
+
+async def _current_thread() -> threading.Thread:
+    return threading.current_thread()
+
+
+def test_run_on_monitoring_loop_shared_across_event_loops():
+    # Flask runs each async view in its own event loop, the Monitoring calls must still share one loop
+    first = asyncio.run(run_on_monitoring_loop(_current_thread()))
+    second = asyncio.run(run_on_monitoring_loop(_current_thread()))
+
+    assert first is second
+    assert first is not threading.current_thread()
+    assert first.name == "monitoring-loop"
+
+
+def test_run_in_normalize_pool():
+    thread = asyncio.run(run_in_normalize_pool(threading.current_thread))
+
+    assert thread.name.startswith("metric-normalize")
+
+
+def test_iterate_on_monitoring_loop():
+    closed = []
+
+    async def numbers():
+        try:
+            for number in range(3):
+                await asyncio.sleep(0)
+                yield number, threading.current_thread().name
+        finally:
+            closed.append(True)
+
+    assert list(iterate_on_monitoring_loop(numbers())) == [(number, "monitoring-loop") for number in range(3)]
+    # Closing the generator early closes the async iterator
+    items = iterate_on_monitoring_loop(numbers())
+    next(items)
+    items.close()
+    assert closed == [True, True]
@@ -0,0 +1,59 @@
+import gzip
+import zlib
+
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from util import compression
+from util.compression import available_encodings, compress, compress_chunks, negotiate_encoding, split_chunks
+
+BODY = b'{"timestamps":[1705622400000,1705622460000],"series":{"200":[0.0,12.5]}}' * 2000
+
+
+def _decompress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return compression.brotli.decompress(body)
+    if encoding == "zstd":
+        return compression.zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return gzip.decompress(body)
+
+
+def test_negotiate_encoding():
+    def negotiate(header):
+        return negotiate_encoding(parse_accept_header(header, Accept))
+
+    preferred = available_encodings()[0]
+    assert negotiate("gzip, deflate, br, zstd") == preferred
+    assert negotiate("gzip;q=1.0, br;q=0.5, zstd;q=0.5") == "gzip"
+    assert negotiate("*") == preferred
+    assert negotiate("deflate") is None
+    assert negotiate("") is None
+    assert negotiate("gzip;q=0") is None
+
+
+@pytest.mark.parametrize("encoding", available_encodings())
+def test_compress_chunks_round_trip(encoding):
+    whole = compress(BODY, encoding)
+    streamed = list(compress_chunks(split_chunks(BODY, 4096), encoding))
+    flushed = list(compress_chunks(split_chunks(BODY, 4096), encoding, flush=True))
+
+    assert len(whole) < len(BODY) / 10
+    assert _decompress(whole, encoding) == BODY
+    assert _decompress(b"".join(streamed), encoding) == BODY
+    assert _decompress(b"".join(flushed), encoding) == BODY
+    # Flushing sends something for every chunk
+    assert len(flushed) > len(BODY) // 4096
+
+
+def test_flushed_gzip_chunks_decode_before_the_end():
+    lines = [b'{"metric": "request_count"}\n', b'{"metric": "request_latencies"}\n']
+    chunks = compress_chunks(lines, "gzip", flush=True)
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    assert decoder.decompress(next(chunks)) == lines[0]
+
+
+def test_compress_unsupported_encoding():
+    with pytest.raises(ValueError):
+        compress(BODY, "deflate")
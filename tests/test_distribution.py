@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+from google.api.distribution_pb2 import Distribution
+from google.cloud.monitoring_v3 import Point, TimeSeries
+
+from util.distribution import (
+    DEFAULT_PERCENTILES,
+    bucket_bounds,
+    heatmap_dataframe,
+    histogram_percentiles,
+    merge_histograms,
+    parse_percentiles,
+    percentiles_dataframe,
+)
+
+# Buckets: underflow (< 1), [1, 2), [2, 4), [4, 8), overflow (>= 8)
+EXPONENTIAL_BUCKETS = Distribution.BucketOptions(
+    exponential_buckets=Distribution.BucketOptions.Exponential(num_finite_buckets=3, growth_factor=2.0, scale=1.0)
+)
+
+
+def build_time_series(points: list[tuple[int, list[int]]]) -> TimeSeries:
+    """Builds a distribution time series from (end time in epoch seconds, bucket counts) pairs."""
+    series = TimeSeries()
+    for end_seconds, bucket_counts in points:
+        point = Point()
+        point.interval.end_time = pd.Timestamp(end_seconds, unit="s", tz="UTC").to_pydatetime()
+        distribution = Distribution(
+            count=sum(bucket_counts), bucket_options=EXPONENTIAL_BUCKETS, bucket_counts=bucket_counts
+        )
+        Point.pb(point).value.distribution_value.CopyFrom(distribution)
+        series.points.append(point)
+    return series
+
+
+def test_bucket_bounds():
+    np.testing.assert_allclose(bucket_bounds(EXPONENTIAL_BUCKETS), [1.0, 2.0, 4.0, 8.0])
+
+    linear = Distribution.BucketOptions(
+        linear_buckets=Distribution.BucketOptions.Linear(num_finite_buckets=2, width=5.0, offset=10.0)
+    )
+    np.testing.assert_allclose(bucket_bounds(linear), [10.0, 15.0, 20.0])
+
+    explicit = Distribution.BucketOptions(explicit_buckets=Distribution.BucketOptions.Explicit(bounds=[0.5, 3.0]))
+    np.testing.assert_allclose(bucket_bounds(explicit), [0.5, 3.0])
+
+    with pytest.raises(ValueError):
+        bucket_bounds(Distribution.BucketOptions())
+
+
+def test_merge_histograms_adds_bucket_counts_per_minute():
+    # Two labels in the same minute (one with trailing buckets omitted), and a second minute
+    first = build_time_series([(1705677245, [0, 2, 1]), (1705677305, [1, 0, 0, 0, 1])])
+    second = build_time_series([(1705677250, [0, 0, 3, 1])])
+
+    minutes, histograms, bounds = merge_histograms([first, second])
+
+    pd.testing.assert_index_equal(minutes, pd.DatetimeIndex(["2024-01-19 15:14:00", "2024-01-19 15:15:00"]))
+    np.testing.assert_array_equal(histograms, [[0, 2, 4, 1, 0], [1, 0, 0, 0, 1]])
+    np.testing.assert_allclose(bounds, [1.0, 2.0, 4.0, 8.0])
+
+
+def test_merge_histograms_without_points():
+    minutes, histograms, _ = merge_histograms([])
+
+    assert len(minutes) == 0
+    assert histograms.size == 0
+
+
+def test_histogram_percentiles_interpolates_inside_buckets():
+    bounds = np.array([1.0, 2.0, 4.0, 8.0])
+    histograms = np.array(
+        [
+            [0, 0, 4, 0, 0],  # all points in [2, 4)
+            [2, 0, 0, 0, 2],  # half underflow, half overflow
+            [0, 0, 0, 0, 0],  # no points
+        ]
+    )
+
+    result = histogram_percentiles(histograms, bounds, [25, 50, 100])
+
+    np.testing.assert_allclose(result, [[2.5, 3.0, 4.0], [0.5, 1.0, 8.0], [0.0, 0.0, 0.0]])
+
+
+def test_percentiles_dataframe():
+    series = build_time_series([(1705677245, [0, 0, 4])])
+
+    df = percentiles_dataframe([series])
+
+    assert list(df.columns) == ["p50", "p90", "p95", "p99"]
+    np.testing.assert_allclose(df.loc["2024-01-19 15:14:00"].to_numpy(), [3.0, 3.8, 3.9, 3.98])
+
+
+def test_parse_percentiles():
+    assert parse_percentiles(None) == ()
+    assert parse_percentiles(False) == ()
+    assert parse_percentiles(True) == DEFAULT_PERCENTILES
+    assert parse_percentiles([50, "99.9"]) == (50.0, 99.9)
+    for invalid in ([], [101], ["p50"], 5):
+        with pytest.raises(ValueError):
+            parse_percentiles(invalid)
+
+
+def test_heatmap_dataframe_is_dense_over_the_window():
+    # Points at 15:14 and 15:16 of a window covering 15:13 - 15:16, the minute 15:15 has no point
+    series = build_time_series([(1705677245, [0, 2, 1]), (1705677365, [1, 0, 0, 0, 1])])
+    start_time = pd.Timestamp("2024-01-19 15:13:30", tz="UTC")
+    end_time = pd.Timestamp("2024-01-19 15:16:30", tz="UTC")
+
+    heatmap = heatmap_dataframe([series], start_time, end_time)
+
+    expected_index = pd.date_range("2024-01-19 15:13:00", periods=4, freq="min")
+    pd.testing.assert_index_equal(heatmap.index, expected_index, exact=False)
+    assert heatmap.columns.tolist() == [0.0, 1.0, 2.0, 4.0, 8.0]
+    np.testing.assert_array_equal(heatmap.to_numpy(), [[0] * 5, [0, 2, 1, 0, 0], [0] * 5, [1, 0, 0, 0, 1]])
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from util import system_metric
+from util.downsample import downsample, lttb_indices, parse_max_points
+
+
+def _frame(num_rows: int, columns: tuple[str, ...] = ("200",), seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-19", periods=num_rows, freq="min")
+    return pd.DataFrame(rng.random((num_rows, len(columns))), index=index, columns=list(columns))
+
+
+def test_parse_max_points():
+    assert parse_max_points(None) is None
+    assert parse_max_points("") is None
+    assert parse_max_points(800) == 800
+    assert parse_max_points("800") == 800
+    for max_points in (2, 0, -5, "abc", 1.5, True):
+        with pytest.raises(ValueError):
+            parse_max_points(max_points)
+
+
+def test_lttb_indices_keeps_ends_and_one_point_per_bucket():
+    x = np.arange(1000, dtype="float64")
+    y = np.sin(x / 50)[:, None]
+
+    rows = lttb_indices(x, y, 100)
+
+    assert len(rows) == 100
+    assert rows[0] == 0 and rows[-1] == 999
+    assert np.all(np.diff(rows) > 0)
+    # Every inner bucket of 998 / 98 points contributes exactly one row
+    edges = np.arange(99) * 998 // 98 + 1
+    assert np.array_equal(np.searchsorted(edges, rows[1:-1], side="right") - 1, np.arange(98))
+
+
+def test_downsample_keeps_peaks_of_every_column():
+    df = _frame(10_000, ("200", "500"))
+    df.iloc[1234, 0] = 50.0
+    df.iloc[8765, 1] = -50.0
+    df.attrs["fetched_at"] = 1.0
+
+    result = downsample(df, 800)
+
+    assert len(result) == 800
+    assert result["200"].max() == 50.0
+    assert result["500"].min() == -50.0
+    # The rows kept are rows of the frame
+    pd.testing.assert_frame_equal(result, df.loc[result.index])
+    assert result.attrs["fetched_at"] == 1.0
+
+
+def test_downsample_short_or_empty_frames_are_unchanged():
+    df = _frame(100)
+
+    assert downsample(df, 800) is df
+    assert downsample(df, None) is df
+    assert downsample(pd.DataFrame(), 3).empty
+
+
+def test_downsample_keeps_integer_dtype():
+    df = pd.DataFrame({"200": np.arange(1000)}, index=pd.date_range("2024-01-19", periods=1000, freq="min"))
+
+    assert downsample(df, 50)["200"].dtype == np.dtype("int64")
+
+
+def test_get_metric_max_points_downsamples_after_the_cache(monkeypatch):
+    calls = []
+
+    def fake_fetch_metric(*metric_query):
+        calls.append(metric_query)
+        return _frame(1440)
+
+    monkeypatch.setattr(system_metric, "_fetch_metric", fake_fetch_metric)
+    system_metric.metric_cache.clear()
+
+    downsampled = system_metric.get_metric("request_count", days=1, max_points=100)
+    full = system_metric.get_metric("request_count", days=1)
+
+    assert len(downsampled) == 100
+    assert len(full) == 1440
+    assert len(calls) == 1
+    system_metric.metric_cache.clear()
@@ -0,0 +1,294 @@
+import asyncio
+import gzip
+import json
+import queue
+import threading
+import time
+
+import pandas as pd
+import pytest
+from flask_jwt_extended import create_access_token
+from google.api.distribution_pb2 import Distribution
+from google.cloud.monitoring_v3 import Point, TimeSeries
+
+import flask_api_server
+from util import system_metric
+
+SLOW_SECONDS = 0.3
+
+
+def _frame(value: float = 1.0, periods: int = 3) -> pd.DataFrame:
+    index = pd.date_range("2024-01-19 12:00", periods=periods, freq="min")
+    return pd.DataFrame({"200": [value] * periods}, index=index)
+
+
+def _latency_series(points: list[tuple[str, list[int]]]) -> TimeSeries:
+    """Builds a distribution time series with buckets < 1, [1, 2), [2, 4) and >= 4 from (end time, counts) pairs."""
+    buckets = Distribution.BucketOptions(
+        exponential_buckets=Distribution.BucketOptions.Exponential(num_finite_buckets=2, growth_factor=2.0, scale=1.0)
+    )
+    series = TimeSeries()
+    for end_time, bucket_counts in points:
+        point = Point()
+        point.interval.end_time = pd.Timestamp(end_time, tz="UTC").to_pydatetime()
+        distribution = Distribution(count=sum(bucket_counts), bucket_options=buckets, bucket_counts=bucket_counts)
+        Point.pb(point).value.distribution_value.CopyFrom(distribution)
+        series.points.append(point)
+    return series
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(flask_api_server.app.config, "JWT_SECRET_KEY", "test-secret")
+    system_metric.metric_cache.clear()
+    yield flask_api_server.app.test_client()
+    system_metric.metric_cache.clear()
+
+
+@pytest.fixture
+def auth(client):
+    with flask_api_server.app.app_context():
+        return {"Authorization": f"Bearer {create_access_token('tester')}"}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Serves every metric from a frame the test can change, through the synchronous fetch path."""
+    frames = {"value": 1.0}
+    monkeypatch.setattr(system_metric, "_fetch_metric", lambda *args: _frame(frames["value"]))
+    monkeypatch.setattr(system_metric, "ASYNC_CLIENT_ENABLED", False)
+    monkeypatch.setattr(system_metric, "metric_store", None)
+    return frames
+
+
+@pytest.mark.parametrize("path", ["/api/system_metric?metric=request_count&hours=1", "/api/all_system_metric?hours=1"])
+def test_unchanged_metric_poll_is_not_modified(client, auth, upstream, path):
+    first = client.get(path, headers=auth)
+    etag = first.headers["ETag"]
+    system_metric.metric_cache.clear()
+    unchanged = client.get(path, headers={**auth, "If-None-Match": etag})
+    upstream["value"] = 2.0
+    system_metric.metric_cache.clear()
+    changed = client.get(path, headers={**auth, "If-None-Match": etag})
+
+    assert first.status_code == 200 and first.data
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+    assert unchanged.headers["ETag"] == etag
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.data != first.data
+
+
+def test_unchanged_resource_limits_are_not_modified(client, monkeypatch):
+    limits = {"memory": "512Mi", "cpu": "1"}
+    monkeypatch.setattr(flask_api_server, "get_resources_limits", lambda: limits)
+
+    first = client.get("/api/get_resources_limits")
+    unchanged = client.get("/api/get_resources_limits", headers={"If-None-Match": first.headers["ETag"]})
+    limits["cpu"] = "2"
+    changed = client.get("/api/get_resources_limits", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200
+    assert first.json == {"memory": "512Mi", "cpu": "1"}
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+    assert changed.status_code == 200
+    assert changed.json["cpu"] == "2"
+
+
+def test_compression_threshold_and_etag(client, auth, upstream, monkeypatch):
+    path = "/api/system_metric?metric=request_count&hours=1"
+    identity = client.get(path, headers=auth)
+    body = identity.data
+    gzip_headers = {**auth, "Accept-Encoding": "gzip"}
+
+    monkeypatch.setattr(flask_api_server, "MIN_BYTES", len(body) + 1)
+    small = client.get(path, headers=gzip_headers)
+    monkeypatch.setattr(flask_api_server, "MIN_BYTES", len(body))
+    compressed = client.get(path, headers=gzip_headers)
+
+    assert "Content-Encoding" not in identity.headers
+    assert "Accept-Encoding" in identity.headers["Vary"]
+    assert "Content-Encoding" not in small.headers
+    assert small.data == body
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert int(compressed.headers["Content-Length"]) == len(compressed.data)
+    assert gzip.decompress(compressed.data) == body
+    # The compressed bytes depend on the encoding, so the strong ETag of the frames becomes weak
+    assert compressed.headers["ETag"] == f"W/{identity.headers['ETag']}"
+    # A client that cached the compressed response revalidates with the weak ETag
+    revalidated = client.get(path, headers={**gzip_headers, "If-None-Match": compressed.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+
+
+def test_large_response_is_compressed_while_sent(client, auth, upstream, monkeypatch):
+    path = "/api/all_system_metric?hours=1"
+    body = client.get(path, headers=auth).data
+    monkeypatch.setattr(flask_api_server, "MIN_BYTES", 1)
+    monkeypatch.setattr(flask_api_server, "STREAM_BYTES", len(body))
+
+    response = client.get(path, headers={**auth, "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == body
+
+
+def test_closed_stream_does_not_cancel_shared_fetches(client, auth, monkeypatch):
+    async def fake_fetch_metric_async(metric, *args):
+        await asyncio.sleep(0 if metric == "CPU_utilization" else SLOW_SECONDS)
+        return _frame()
+
+    monkeypatch.setattr(system_metric, "_fetch_metric_async", fake_fetch_metric_async)
+    monkeypatch.setattr(system_metric, "ASYNC_CLIENT_ENABLED", True)
+    monkeypatch.setattr(system_metric, "metric_store", None)
+
+    stream = client.get("/api/all_system_metric?hours=1&stream=true", headers=auth, buffered=False)
+    lines = iter(stream.response)
+    assert json.loads(next(lines))["metric"] == "CPU_utilization"
+
+    # A second request joins the fetches the stream leads, then the stream is closed
+    responses = []
+    thread = threading.Thread(
+        target=lambda: responses.append(
+            client.get("/api/all_system_metric?hours=1&envelope=true", headers=auth)
+        )
+    )
+    thread.start()
+    time.sleep(SLOW_SECONDS / 3)
+    stream.close()
+    thread.join()
+
+    assert responses[0].status_code == 200
+    envelopes = responses[0].json
+    assert {envelope["status"] for envelope in envelopes.values()} == {"ok"}
+    assert envelopes["request_count"]["cache"] == "shared"
+
+
+def test_metric_batch_parses_options(client, auth, monkeypatch):
+    monkeypatch.setattr(system_metric, "_fetch_metric", lambda *args: _frame(periods=2000))
+    monkeypatch.setattr(system_metric, "ASYNC_CLIENT_ENABLED", False)
+    monkeypatch.setattr(system_metric, "metric_store", None)
+
+    query = {"metric": "CPU_utilization", "window": "1h", "max_points": "800"}
+    response = client.post("/api/metric_batch", json={"queries": [query], "format": "columnar"}, headers=auth)
+    query = {"metric": "CPU_utilization", "days": None}
+    invalid = client.post("/api/metric_batch", json={"queries": [query]}, headers=auth)
+
+    assert response.status_code == 200
+    assert response.json["results"][0]["status"] == "ok"
+    assert len(response.json["results"][0]["data"]["timestamps"]) == 800
+    assert invalid.status_code == 400
+    assert invalid.json["error"].startswith("Invalid query 0")
+
+
+def test_reducer_without_resolution_is_rejected(client, auth):
+    for path in ("/api/system_metric?metric=request_count&hours=1", "/api/all_system_metric?hours=1"):
+        response = client.get(f"{path}&reducer=max", headers=auth)
+
+        assert response.status_code == 400
+        assert "needs a resolution" in response.json["error"]
+
+
+def test_resolution_under_a_minute_is_rejected(client, auth):
+    response = client.get("/api/system_metric?metric=request_count&hours=1&resolution=30s", headers=auth)
+
+    assert response.status_code == 400
+    assert "whole minutes" in response.json["error"]
+
+
+def test_metric_heatmap(client, auth, monkeypatch):
+    series = _latency_series([("2024-01-19 12:00:30", [0, 2, 1, 0]), ("2024-01-19 12:02:30", [1, 0, 0, 3])])
+    monkeypatch.setattr(system_metric, "get_metric_client", lambda: None)
+    monkeypatch.setattr(system_metric, "_build_query", lambda *args, **kwargs: [series])
+
+    response = client.get(
+        "/api/metric_heatmap?metric=request_latencies&start=2024-01-19T12:00:00&end=2024-01-19T12:03:00",
+        headers=auth,
+    )
+
+    assert response.status_code == 200
+    assert response.json["timestamps"] == [
+        int(pd.Timestamp(f"2024-01-19 12:0{minute}:00").timestamp() * 1000) for minute in range(4)
+    ]
+    assert response.json["buckets"] == [0.0, 1.0, 2.0, 4.0]
+    assert response.json["counts"] == [[0, 2, 1, 0], [0, 0, 0, 0], [1, 0, 0, 3], [0, 0, 0, 0]]
+
+
+@pytest.mark.parametrize(
+    "path, error",
+    [
+        ("/api/metric_heatmap?metric=request_count&hours=1", "only available for distribution metrics"),
+        ("/api/metric_heatmap?hours=1&resolution=30s", "whole minutes"),
+        ("/api/metric_heatmap?hours=1&resolution=fast", "Invalid resolution"),
+        ("/api/system_metric?metric=request_latencies&hours=1&percentiles=50,101", "Invalid percentiles"),
+        ("/api/system_metric?metric=request_latencies&hours=1&percentiles=p99", "Invalid percentiles"),
+    ],
+)
+def test_invalid_distribution_request_is_rejected(client, auth, path, error):
+    response = client.get(path, headers=auth)
+
+    assert response.status_code == 400
+    assert error in response.json["error"]
+
+
+class StubBroadcaster:
+    """Replaces the live poller of the metric streams with events queued by the test."""
+
+    def __init__(self, events: list[tuple | None]):
+        self.events = events
+        self.subscribed: list[list[str]] = []
+        self.unsubscribed = 0
+
+    def subscribe(self, metrics):
+        self.subscribed.append(list(metrics))
+        subscription = queue.Queue()
+        for event in self.events:
+            subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.unsubscribed += 1
+
+
+def test_metric_stream_sends_rows_events(client, monkeypatch):
+    broadcaster = StubBroadcaster([("rows", "CPU_utilization", _frame(0.5, periods=2)), None])
+    monkeypatch.setattr(flask_api_server, "get_metric_broadcaster", lambda: broadcaster)
+    with flask_api_server.app.app_context():
+        token = create_access_token("tester")
+
+    response = client.get(f"/api/metric_stream?metrics=CPU_utilization&format=columnar&jwt={token}")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    event, data = response.get_data(as_text=True).split("\n\n")[0].split("\n")
+    assert event == "event: rows"
+    assert data.startswith("data: ")
+    message = json.loads(data.removeprefix("data: "))
+    assert message["metric"] == "CPU_utilization"
+    assert message["data"]["series"] == {"200": [0.5, 0.5]}
+    assert broadcaster.subscribed == [["CPU_utilization"]]
+    assert broadcaster.unsubscribed == 1
+
+
+def test_metric_stream_requires_a_token(client, monkeypatch):
+    monkeypatch.setattr(flask_api_server, "get_metric_broadcaster", lambda: StubBroadcaster([None]))
+
+    assert client.get("/api/metric_stream").status_code == 401
+    assert client.get("/api/metric_stream?jwt=invalid").status_code == 422
+
+
+def test_metric_stream_rejects_unknown_metrics(client, auth, monkeypatch):
+    broadcaster = StubBroadcaster([None])
+    monkeypatch.setattr(flask_api_server, "get_metric_broadcaster", lambda: broadcaster)
+
+    response = client.get("/api/metric_stream?metrics=CPU_utilization,disk_usage", headers=auth)
+
+    assert response.status_code == 400
+    assert "disk_usage" in response.json["error"]
+    assert broadcaster.subscribed == []
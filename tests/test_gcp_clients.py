@@ -0,0 +1,52 @@
+import os
+
+from util import gcp_clients
+from util.gcp_clients import _get_client, reset_clients
+
+
+class _FakeClient:
+    def __init__(self, client_options=None):
+        self.client_options = client_options
+
+
+def test_get_client_reuses_instance(monkeypatch):
+    monkeypatch.delenv("GOOGLE_APPLICATION_CREDENTIALS", raising=False)
+    reset_clients()
+
+    first = _get_client("fake", _FakeClient, None)
+    second = _get_client("fake", _FakeClient, None)
+
+    assert first is second
+    reset_clients()
+
+
+def test_get_client_recreated_when_credentials_change(monkeypatch, tmp_path):
+    credentials_path = tmp_path / "credentials.json"
+    credentials_path.write_text("{}")
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(credentials_path))
+    reset_clients()
+
+    first = _get_client("fake", _FakeClient, None)
+
+    # Rotating the key file changes its modification time
+    mtime = os.path.getmtime(credentials_path)
+    os.utime(credentials_path, (mtime + 10, mtime + 10))
+    second = _get_client("fake", _FakeClient, None)
+
+    assert first is not second
+    assert _get_client("fake", _FakeClient, None) is second
+    # The client built for the outdated credentials is dropped
+    assert len([key for key in gcp_clients._clients if key[0] == "fake"]) == 1
+    reset_clients()
+
+
+def test_get_client_per_endpoint(monkeypatch):
+    monkeypatch.delenv("GOOGLE_APPLICATION_CREDENTIALS", raising=False)
+    reset_clients()
+
+    default_client = _get_client("fake", _FakeClient, None)
+    endpoint_client = _get_client("fake", _FakeClient, "localhost:8085")
+
+    assert default_client is not endpoint_client
+    assert endpoint_client.client_options.api_endpoint == "localhost:8085"
+    reset_clients()
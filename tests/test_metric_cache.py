@@ -0,0 +1,84 @@
+import math
+import time
+
+import pandas as pd
+
+from util.metric_cache import MetricCache
+
+
+def _make_df(rows: int = 5) -> pd.DataFrame:
+    index = pd.date_range("2024-01-19 15:14:00", periods=rows, freq="min")
+    return pd.DataFrame(data={"dvwa": [float(i) for i in range(rows)]}, index=index)
+
+
+def test_metric_cache_hit_and_miss():
+    cache = MetricCache(ttl=60)
+    df = _make_df()
+
+    assert cache.get("CPU_utilization") is None
+    cache.put("CPU_utilization", df)
+    cached = cache.get("CPU_utilization")
+
+    assert cached is not None
+    pd.testing.assert_frame_equal(cached, df)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_metric_cache_returns_copies():
+    cache = MetricCache(ttl=60)
+    cache.put("CPU_utilization", _make_df())
+
+    cached = cache.get("CPU_utilization")
+    assert cached is not None
+    cached.iloc[0, 0] = 100.0
+
+    # Mutating a returned DataFrame must not change the cached entry
+    pd.testing.assert_frame_equal(cache.get("CPU_utilization"), _make_df())
+
+
+def test_metric_cache_ttl_expiry():
+    cache = MetricCache(ttl=0.05)
+    cache.put("CPU_utilization", _make_df())
+    time.sleep(0.1)
+
+    assert cache.get("CPU_utilization") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_metric_cache_entry_ttl_overrides_default():
+    cache = MetricCache(ttl=0.05)
+    cache.put("immutable", _make_df(), ttl=math.inf)
+    cache.put("recent", _make_df())
+    time.sleep(0.1)
+
+    assert cache.get("immutable") is not None
+    assert cache.get("recent") is None
+
+
+def test_metric_cache_lru_eviction_by_entries():
+    cache = MetricCache(ttl=60, max_entries=2)
+    cache.put("request_count", _make_df())
+    cache.put("request_latencies", _make_df())
+
+    # Touch request_count so that request_latencies becomes the least recently used entry
+    cache.get("request_count")
+    cache.put("instance_count", _make_df())
+
+    assert cache.get("request_latencies") is None
+    assert cache.get("request_count") is not None
+    assert cache.get("instance_count") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_metric_cache_lru_eviction_by_bytes():
+    df = _make_df(100)
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    cache = MetricCache(ttl=60, max_bytes=size * 2)
+    cache.put("request_count", df)
+    cache.put("request_latencies", df)
+    cache.put("instance_count", df)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] <= size * 2
+    assert cache.get("request_count") is None
@@ -0,0 +1,131 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.metric_format import (
+    all_metrics_to_arrow,
+    all_metrics_to_columnar,
+    dumps_columnar,
+    frames_etag,
+    heatmap_to_msgpack,
+    parse_format,
+    to_arrow,
+    to_columnar,
+    to_heatmap,
+    to_msgpack,
+)
+
+
+def test_parse_format():
+    assert parse_format(None) == "json"
+    assert parse_format("columnar") == "columnar"
+    with pytest.raises(ValueError):
+        parse_format("xml")
+
+
+def test_to_columnar():
+    index = pd.to_datetime(["2024-01-19 15:14:00", "2024-01-19 15:15:00"])
+    df = pd.DataFrame(data={"200": [1, 2], "500": [0.0, 3.5]}, index=index)
+
+    assert json.loads(dumps_columnar(to_columnar(df))) == {
+        "timestamps": [1705677240000, 1705677300000],
+        "series": {"200": [1.0, 2.0], "500": [0.0, 3.5]},
+    }
+
+
+def test_to_columnar_empty():
+    assert json.loads(dumps_columnar(to_columnar(pd.DataFrame()))) == {"timestamps": [], "series": {}}
+
+
+def test_all_metrics_to_columnar_with_error():
+    index = pd.to_datetime(["2024-01-19 15:14:00"])
+    results = {
+        "CPU_utilization": pd.DataFrame(data={"dvwa": [38.1]}, index=index),
+        "request_latencies": RuntimeError("upstream failed"),
+    }
+
+    response = json.loads(dumps_columnar(all_metrics_to_columnar(results)))
+
+    assert response["CPU_utilization"] == {"timestamps": [1705677240000], "series": {"dvwa": [38.1]}}
+    assert "upstream failed" in response["request_latencies"]["error"]
+
+
+def test_to_arrow_roundtrip():
+    pa = pytest.importorskip("pyarrow")
+    index = pd.to_datetime(["2024-01-19 15:14:00", "2024-01-19 15:15:00"])
+    df = pd.DataFrame(data={"200": [1.0, 2.0], "500": [0.0, 3.5]}, index=index)
+
+    table = pa.ipc.open_stream(to_arrow(df)).read_all()
+
+    assert table.column_names == ["timestamp", "200", "500"]
+    assert table.column("500").to_pylist() == [0.0, 3.5]
+    assert table.column("timestamp").to_pandas().tolist() == list(index)
+
+
+def test_all_metrics_to_arrow_long_format():
+    pa = pytest.importorskip("pyarrow")
+    index = pd.to_datetime(["2024-01-19 15:14:00", "2024-01-19 15:15:00"])
+    results = {
+        "request_count": pd.DataFrame(data={"200": [1.0, 2.0], "500": [0.0, 3.0]}, index=index),
+        "request_latencies": RuntimeError("upstream failed"),
+    }
+
+    table = pa.ipc.open_stream(all_metrics_to_arrow(results)).read_all()
+    df = table.to_pandas()
+
+    assert df["label"].astype(str).tolist() == ["200", "200", "500", "500"]
+    assert df["value"].tolist() == [1.0, 2.0, 0.0, 3.0]
+    assert "upstream failed" in json.loads(table.schema.metadata[b"errors"])["request_latencies"]
+
+
+def test_to_msgpack_buffers():
+    msgpack = pytest.importorskip("msgpack")
+    index = pd.to_datetime(["2024-01-19 15:14:00", "2024-01-19 15:15:00"])
+    df = pd.DataFrame(data={"dvwa": [38.1, 40.2]}, index=index)
+
+    decoded = msgpack.unpackb(to_msgpack(df))
+
+    assert np.frombuffer(decoded["timestamps"], dtype="<i8").tolist() == [1705677240000, 1705677300000]
+    assert np.frombuffer(decoded["series"]["dvwa"], dtype="<f8").tolist() == [38.1, 40.2]
+
+
+def test_to_heatmap():
+    index = pd.to_datetime(["2024-01-19 15:14:00", "2024-01-19 15:15:00"])
+    df = pd.DataFrame(data=[[0, 2, 1], [3, 0, 0]], index=index, columns=pd.Index([0.0, 1.0, 2.0], name="bucket"))
+
+    assert json.loads(dumps_columnar(to_heatmap(df))) == {
+        "timestamps": [1705677240000, 1705677300000],
+        "buckets": [0.0, 1.0, 2.0],
+        "counts": [[0, 2, 1], [3, 0, 0]],
+    }
+
+
+def test_heatmap_to_msgpack_buffers():
+    msgpack = pytest.importorskip("msgpack")
+    index = pd.to_datetime(["2024-01-19 15:14:00", "2024-01-19 15:15:00"])
+    df = pd.DataFrame(data=[[0, 2, 1], [3, 0, 0]], index=index, columns=[0.0, 1.0, 2.0])
+
+    decoded = msgpack.unpackb(heatmap_to_msgpack(df))
+
+    counts = np.frombuffer(decoded["counts"], dtype="<i8").reshape(decoded["shape"])
+    assert counts.tolist() == [[0, 2, 1], [3, 0, 0]]
+    assert np.frombuffer(decoded["buckets"], dtype="<f8").tolist() == [0.0, 1.0, 2.0]
+
+
+def test_frames_etag_changes_with_data_labels_and_variant():
+    index = pd.date_range("2024-01-19 15:14:00", periods=3, freq="min")
+    df = pd.DataFrame({"200": [1.0, 2.0, 3.0], "500": [0.0, 1.0, 0.0]}, index=index)
+    etag = frames_etag({"request_count": df}, "json")
+
+    assert etag == frames_etag({"request_count": df.copy()}, "json")
+    assert len(etag) == 32
+    changed = df.copy()
+    changed.iloc[2, 0] = 4.0
+    assert etag != frames_etag({"request_count": changed}, "json")
+    assert etag != frames_etag({"request_count": df.rename(columns={"500": "503"})}, "json")
+    assert etag != frames_etag({"request_count": df.astype("int64")}, "json")
+    assert etag != frames_etag({"request_count": df}, "columnar")
+    assert etag != frames_etag({"request_latencies": df}, "json")
+    assert frames_etag({"request_count": ValueError("a")}) != frames_etag({"request_count": ValueError("b")})
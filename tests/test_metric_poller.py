@@ -0,0 +1,65 @@
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from util.metric_poller import MetricPoller
+
+
+def _fetch(metric, minutes):
+    index = pd.date_range(end=pd.Timestamp(datetime.utcnow()).floor("min"), periods=minutes, freq="min")
+    df = pd.DataFrame(data={"dvwa": [1.0] * minutes}, index=index)
+    df.attrs["fetched_at"] = time.time()
+    return df
+
+
+def test_metric_poller_serves_window_from_memory():
+    poller = MetricPoller(fetch=_fetch, metrics=["CPU_utilization"], window=timedelta(hours=1))
+
+    assert poller.get("CPU_utilization", timedelta(minutes=10)) is None
+    poller.refresh("CPU_utilization")
+    df = poller.get("CPU_utilization", timedelta(minutes=10))
+
+    assert df is not None
+    assert 10 <= len(df) <= 11
+    assert "fetched_at" in df.attrs
+    # Windows longer than the polled one are not served
+    assert poller.get("CPU_utilization", timedelta(hours=2)) is None
+
+
+def test_metric_poller_backoff_keeps_last_frame():
+    calls = []
+
+    def flaky_fetch(metric, minutes):
+        calls.append(metric)
+        if len(calls) > 1:
+            raise RuntimeError("upstream failed")
+        return _fetch(metric, minutes)
+
+    poller = MetricPoller(
+        fetch=flaky_fetch, metrics=["CPU_utilization"], window=timedelta(hours=1), interval=10, jitter=0
+    )
+    poller.refresh("CPU_utilization")
+    poller.refresh("CPU_utilization")
+    poller.refresh("CPU_utilization")
+
+    status = poller.status()["CPU_utilization"]
+    assert status["failures"] == 2
+    assert status["error"] == "RuntimeError: upstream failed"
+    # The delay doubles per consecutive failure
+    assert 39 < poller._next_refresh["CPU_utilization"] - time.monotonic() <= 40
+    assert poller.get("CPU_utilization", timedelta(minutes=10)) is not None
+
+
+def test_metric_poller_thread_refreshes_all_metrics():
+    metrics = ["CPU_utilization", "memory_utilization"]
+    poller = MetricPoller(fetch=_fetch, metrics=metrics, window=timedelta(minutes=5), interval=60)
+    poller.start()
+    try:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and any(s["fetched_at"] is None for s in poller.status().values()):
+            time.sleep(0.05)
+    finally:
+        poller.stop()
+
+    assert all(status["fetched_at"] is not None for status in poller.status().values())
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+from util import system_metric
+from util.metric_rollup import RollupStore, plan_tier, rollup
+
+KEY = ("request_count", "project", "dvwa")
+START = datetime(2024, 1, 19, 12, 0, tzinfo=pytz.utc)
+
+
+def _minutes(first: datetime, periods: int, values: dict[str, list[float]] | None = None) -> pd.DataFrame:
+    index = pd.date_range(pd.Timestamp(first).tz_localize(None), periods=periods, freq="min")
+    return pd.DataFrame(data=values or {"200": np.arange(periods, dtype="int64")}, index=index)
+
+
+def test_plan_tier_picks_coarsest_tier_with_enough_points():
+    assert plan_tier(timedelta(days=30), 500) == 3600
+    assert plan_tier(timedelta(days=1), 200) == 300
+    assert plan_tier(timedelta(days=1), 1000) == 60
+    # More points than minutes falls back to the raw minutes
+    assert plan_tier(timedelta(hours=1), 10_000) == 60
+    for points in (0, -5, 1.5, "100", True):
+        with pytest.raises(ValueError):
+            plan_tier(timedelta(days=1), points)
+
+
+@pytest.mark.parametrize(
+    "aggregation, expected",
+    # The zero of 12:00 is a minute without data, left out of the mean
+    [("sum", [10, 35, 11]), ("max", [4, 9, 11]), ("mean", [2.5, 7.0, 11.0])],
+)
+def test_rollup_aggregations(aggregation, expected):
+    df = _minutes(START, 12).drop(index=pd.Timestamp("2024-01-19 12:10:00"))
+
+    result = rollup(df, 300, aggregation)
+
+    assert result.index.tolist() == [pd.Timestamp(f"2024-01-19 12:{minute:02d}:00") for minute in (0, 5, 10)]
+    assert result["200"].tolist() == expected
+
+
+def test_rollup_mean_of_sparse_minutes():
+    # One slow request for the response code '500' in an otherwise empty hour, with '200' busy at every minute
+    values = {"200": [100.0] * 60, "500": [0.0] * 60}
+    values["500"][30] = 2000.0
+    df = _minutes(START, 60, values)
+
+    result = rollup(df, 3600, "mean")
+
+    assert result.loc[pd.Timestamp("2024-01-19 12:00:00")].tolist() == [100.0, 2000.0]
+    assert rollup(_minutes(START, 5, {"500": [0.0] * 5}), 300, "mean")["500"].tolist() == [0.0]
+
+
+def test_rollup_invalid_aggregation():
+    with pytest.raises(ValueError):
+        rollup(_minutes(START, 5), 300, "median")
+
+
+def test_rollup_store_keeps_complete_buckets_only():
+    store = RollupStore(tiers=(300,))
+    # The window starts mid-bucket and the last minutes are not settled yet
+    store.update(KEY, _minutes(START, 30), "sum", START - timedelta(minutes=2), START + timedelta(minutes=22))
+
+    buckets, covered_until = store.get(KEY, 300, START - timedelta(minutes=2))
+
+    assert buckets["200"].tolist() == [10, 35, 60, 85]
+    assert covered_until == START + timedelta(minutes=20)
+    # The stored range does not reach back to an earlier window
+    assert store.get(KEY, 300, START - timedelta(minutes=10)) is None
+    assert store.get(("request_count", "project", "other"), 300, START) is None
+
+
+def test_rollup_store_extends_and_replaces_buckets():
+    store = RollupStore(tiers=(300,))
+    store.update(KEY, _minutes(START, 20), "sum", START - timedelta(minutes=1), START + timedelta(minutes=20))
+    # A newer frame recomputes the buckets it covers, with a new label, and extends the range
+    newer = _minutes(START + timedelta(minutes=10), 20, {"200": [1] * 20, "500": [2] * 20})
+    store.update(KEY, newer, "sum", START + timedelta(minutes=9), START + timedelta(minutes=30))
+
+    buckets, covered_until = store.get(KEY, 300, START - timedelta(minutes=1))
+
+    assert buckets["200"].tolist() == [10, 35, 5, 5, 5, 5]
+    assert buckets["500"].tolist() == [0, 0, 10, 10, 10, 10]
+    assert covered_until == START + timedelta(minutes=30)
+    assert store.stats() == {"ranges": 1, "buckets": 6}
+
+
+def test_rollup_store_drops_expired_buckets():
+    store = RollupStore(tiers=(3600,), retention=timedelta(hours=2))
+    minutes = _minutes(START, 240, {"200": [1] * 240})
+    store.update(KEY, minutes, "max", START - timedelta(minutes=1), START + timedelta(hours=4))
+
+    assert store.get(KEY, 3600, START - timedelta(minutes=1)) is None
+    buckets, _ = store.get(KEY, 3600, START + timedelta(hours=1, minutes=59))
+    assert len(buckets) == 2
+
+
+def test_get_metric_points_serves_settled_buckets_from_rollups(monkeypatch):
+    system_metric.metric_rollups.clear()
+    fetched_intervals = []
+
+    def fake_fetch_metric(metric, project_id, service_name, start_time, end_time, *args):
+        fetched_intervals.append((start_time, end_time))
+        first = pd.Timestamp(start_time).ceil("min").tz_localize(None)
+        index = pd.date_range(first, pd.Timestamp(end_time).tz_localize(None), freq="min")
+        return pd.DataFrame(data={"200": [1] * len(index)}, index=index)
+
+    monkeypatch.setattr(system_metric, "_fetch_metric", fake_fetch_metric)
+
+    first = system_metric.get_metric("request_count", days=1, use_cache=False, points=200)
+    fetched_intervals.clear()
+    second = system_metric.get_metric("request_count", days=1, use_cache=False, points=200)
+
+    # One day in 5 minute buckets, without the incomplete first one
+    assert len(first) in (287, 288)
+    assert (first.index.to_series().diff().dropna() == pd.Timedelta(minutes=5)).all()
+    assert (first["200"].iloc[:-1] == 5).all()
+    # The second request only fetched the minutes after the stored buckets
+    assert len(fetched_intervals) == 1
+    assert fetched_intervals[0][1] - fetched_intervals[0][0] < timedelta(minutes=15)
+    # Same buckets, apart from the one in progress (and the first one if a bucket ended between the requests)
+    common = first.index.intersection(second.index)[:-1]
+    assert len(common) >= 285
+    pd.testing.assert_frame_equal(first.loc[common], second.loc[common], check_freq=False)
+    system_metric.metric_rollups.clear()
+
+
+def test_get_metric_points_validation():
+    with pytest.raises(ValueError):
+        system_metric.get_metric("request_count", days=1, points=100, resolution="5m")
+    with pytest.raises(ValueError):
+        system_metric.get_metric("request_count", days=1, points=0)
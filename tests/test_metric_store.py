@@ -0,0 +1,153 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+
+from util import system_metric
+from util.metric_store import MetricStore
+
+KEY = ("request_count", "project", "dvwa")
+MINUTE = int(pd.Timestamp("2024-01-19 15:14:00").timestamp()) // 60
+
+
+def _frame(first_minute: int, values: dict[str, list[float]]) -> pd.DataFrame:
+    periods = len(next(iter(values.values())))
+    index = pd.date_range(pd.Timestamp(first_minute * 60, unit="s"), periods=periods, freq="min")
+    return pd.DataFrame(data=values, index=index)
+
+
+def test_metric_store_write_and_read(tmp_path):
+    store = MetricStore(str(tmp_path / "metrics.db"))
+    store.write(KEY, _frame(MINUTE, {"200": [1.0, 2.0, 3.0], "500": [0.0, 1.0, 0.0]}), MINUTE, MINUTE + 2)
+
+    # Only the rows inside [first_minute, end_minute) are written
+    df = store.read(KEY, MINUTE - 10, MINUTE + 10)
+
+    expected = _frame(MINUTE, {"200": [1.0, 2.0], "500": [0.0, 1.0]})
+    pd.testing.assert_frame_equal(df, expected, check_freq=False)
+    assert store.read(("request_count", "project", "other"), MINUTE, MINUTE + 2).empty
+    assert store.stats() == {"chunks": 2, "ranges": 1}
+    store.close()
+
+
+def test_metric_store_missing_ranges_are_merged(tmp_path):
+    store = MetricStore(str(tmp_path / "metrics.db"))
+    store.write(KEY, _frame(MINUTE, {"200": [1.0]}), MINUTE, MINUTE + 10)
+    store.write(KEY, _frame(MINUTE + 20, {"200": [1.0]}), MINUTE + 20, MINUTE + 30)
+
+    assert store.missing(KEY, MINUTE - 5, MINUTE + 40) == [
+        (MINUTE - 5, MINUTE),
+        (MINUTE + 10, MINUTE + 20),
+        (MINUTE + 30, MINUTE + 40),
+    ]
+
+    # Filling the hole joins the three ranges into one
+    store.write(KEY, _frame(MINUTE + 10, {"200": [1.0]}), MINUTE + 10, MINUTE + 20)
+
+    assert store.missing(KEY, MINUTE, MINUTE + 30) == []
+    assert store.stats()["ranges"] == 1
+    store.close()
+
+
+
+def test_metric_store_restores_integer_dtype(tmp_path):
+    store = MetricStore(str(tmp_path / "metrics.db"))
+    integers = _frame(MINUTE, {"200": [1, 2, 3], "500": [0, 1, 0]})
+    store.write(KEY, integers, MINUTE, MINUTE + 3)
+
+    pd.testing.assert_frame_equal(store.read(KEY, MINUTE, MINUTE + 3), integers, check_freq=False)
+
+    # A label missing from a row is filled like a missing point, which makes the frame float64
+    store.write(KEY, _frame(MINUTE + 3, {"200": [4]}), MINUTE + 3, MINUTE + 4)
+    expected = _frame(MINUTE, {"200": [1.0, 2.0, 3.0, 4.0], "500": [0.0, 1.0, 0.0, 0.0]})
+    pd.testing.assert_frame_equal(store.read(KEY, MINUTE, MINUTE + 4), expected, check_freq=False)
+
+    # A float64 frame written over an int64 chunk keeps the chunk float64
+    store.write(KEY, _frame(MINUTE, {"200": [1.0], "500": [0.0]}), MINUTE, MINUTE + 1)
+    assert (store.read(KEY, MINUTE, MINUTE + 3).dtypes == "float64").all()
+    store.close()
+
+
+def test_metric_store_upgrades_chunks_without_dtype(tmp_path):
+    path = str(tmp_path / "metrics.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE metric_chunks (metric TEXT NOT NULL, project_id TEXT NOT NULL, service_name TEXT NOT NULL,"
+        " chunk INTEGER NOT NULL, label TEXT NOT NULL, minute_values BLOB NOT NULL,"
+        " PRIMARY KEY (metric, project_id, service_name, chunk, label)) WITHOUT ROWID"
+    )
+    connection.close()
+
+    store = MetricStore(path)
+    store.write(KEY, _frame(MINUTE, {"200": [7]}), MINUTE, MINUTE + 1)
+
+    assert store.read(KEY, MINUTE, MINUTE + 1)["200"].tolist() == [7]
+    store.close()
+
+
+def test_metric_store_concurrent_writers_keep_all_minutes(tmp_path):
+    path = str(tmp_path / "metrics.db")
+    stores = [MetricStore(path), MetricStore(path)]
+    # Every writer fills its own minutes of the same chunk, so a lost update would drop minutes
+    threads = [
+        threading.Thread(
+            target=lambda store=store, offset=offset: [
+                store.write(KEY, _frame(MINUTE + minute, {"200": [1]}), MINUTE + minute, MINUTE + minute + 1)
+                for minute in range(offset, 40, 2)
+            ]
+        )
+        for offset, store in enumerate(stores)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stores[0].read(KEY, MINUTE, MINUTE + 40)["200"].tolist() == [1] * 40
+    for store in stores:
+        store.close()
+
+def test_metric_store_persists_across_instances(tmp_path):
+    path = str(tmp_path / "metrics.db")
+    store = MetricStore(path)
+    store.write(KEY, _frame(MINUTE, {"200": [5.0]}), MINUTE, MINUTE + 1)
+    store.close()
+
+    assert MetricStore(path).read(KEY, MINUTE, MINUTE + 1).iloc[0, 0] == 5.0
+
+
+def test_get_metric_stored_fetches_only_missing_minutes(monkeypatch, tmp_path):
+    store = MetricStore(str(tmp_path / "metrics.db"))
+    fetched_intervals = []
+
+    def fake_fetch_metric(metric, project_id, service_name, start_time, end_time):
+        fetched_intervals.append((start_time, end_time))
+        first = pd.Timestamp(start_time).ceil("min").tz_localize(None)
+        index = pd.date_range(first, pd.Timestamp(end_time).tz_localize(None), freq="min")
+        return pd.DataFrame(data={"200": [1.0] * len(index)}, index=index)
+
+    monkeypatch.setattr(system_metric, "_fetch_metric", fake_fetch_metric)
+    end_time = datetime(2024, 1, 19, 16, 0, 30, tzinfo=pytz.utc)
+
+    first = system_metric._get_metric_stored(store, *KEY, end_time - timedelta(hours=1), end_time)
+    # The settled part of the window now comes from the store, only the recent minutes go upstream
+    fetched_intervals.clear()
+    second = system_metric._get_metric_stored(store, *KEY, end_time - timedelta(hours=1), end_time)
+
+    pd.testing.assert_frame_equal(first, second)
+    assert len(fetched_intervals) == 1
+    assert fetched_intervals[0][0] == datetime(2024, 1, 19, 15, 54, 59, tzinfo=pytz.utc)
+    assert first.index.min() == pd.Timestamp("2024-01-19 15:00:00")
+    assert first.index.max() == pd.Timestamp("2024-01-19 16:00:00")
+
+    # A longer window only fetches the minutes before the stored ones
+    fetched_intervals.clear()
+    system_metric._get_metric_stored(store, *KEY, end_time - timedelta(hours=2), end_time)
+
+    assert fetched_intervals[0] == (
+        datetime(2024, 1, 19, 14, 0, tzinfo=pytz.utc) - timedelta(seconds=1),
+        datetime(2024, 1, 19, 15, 0, tzinfo=pytz.utc),
+    )
+    store.close()
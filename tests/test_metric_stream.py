@@ -0,0 +1,103 @@
+import queue
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.metric_format import to_sse_event
+from util.metric_stream import MetricBroadcaster, changed_rows
+
+START = pd.Timestamp("2024-01-19 12:00:00")
+
+
+def _minutes(first: pd.Timestamp, values: list[float]) -> pd.DataFrame:
+    return pd.DataFrame({"200": values}, index=pd.date_range(first, periods=len(values), freq="min"))
+
+
+class FakeUpstream:
+    """Returns a window that moves one minute further at every fetch."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, metric, minutes):
+        self.calls.append(metric)
+        return _minutes(START + pd.Timedelta(minutes=len(self.calls)), [1.0] * minutes)
+
+
+def test_changed_rows():
+    previous = _minutes(START, [1.0, 2.0, np.nan])
+    current = _minutes(START + pd.Timedelta(minutes=1), [2.0, np.nan, 4.0])
+    current["500"] = [np.nan, np.nan, 1.0]
+
+    assert changed_rows(None, current) is current
+    assert changed_rows(previous, current).index.tolist() == [START + pd.Timedelta(minutes=3)]
+    current.iloc[0, 0] = 2.5
+    assert len(changed_rows(previous, current)) == 2
+
+
+def test_broadcaster_fetches_once_for_all_subscribers():
+    upstream = FakeUpstream()
+    broadcaster = MetricBroadcaster(upstream, window=timedelta(minutes=5), interval=0.2)
+    subscriptions = [broadcaster.subscribe(["CPU_utilization"]) for _ in range(10)]
+    try:
+        first = [subscription.get(timeout=2) for subscription in subscriptions]
+        second = [subscription.get(timeout=2) for subscription in subscriptions]
+    finally:
+        for subscription in subscriptions:
+            broadcaster.unsubscribe(subscription)
+
+    assert all(event[0] == "rows" and len(event[2]) == 5 for event in first)
+    # Afterwards only the minute added by the next fetch is sent
+    assert all(len(event[2]) == 1 for event in second)
+    assert len(upstream.calls) <= 3
+    deadline = time.monotonic() + 2
+    while broadcaster._thread is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert broadcaster._thread is None
+    assert broadcaster.stats() == {"subscribers": 0, "metrics": 0, "fetches": len(upstream.calls)}
+
+
+def test_broadcaster_new_subscriber_gets_last_window():
+    upstream = FakeUpstream()
+    broadcaster = MetricBroadcaster(upstream, window=timedelta(minutes=5), interval=60)
+    first = broadcaster.subscribe(["CPU_utilization"])
+    try:
+        first.get(timeout=2)
+        late = broadcaster.subscribe(["CPU_utilization"])
+        event = late.get(timeout=2)
+        broadcaster.unsubscribe(late)
+    finally:
+        broadcaster.unsubscribe(first)
+
+    assert event[0] == "rows" and len(event[2]) == 5
+    assert len(upstream.calls) == 1
+
+
+def test_broadcaster_reports_errors_and_drops_slow_subscribers():
+    def failing_fetch(metric, minutes):
+        raise RuntimeError("upstream failed")
+
+    broadcaster = MetricBroadcaster(failing_fetch, interval=60, max_events=2)
+    subscription = broadcaster.subscribe(["request_count"])
+    try:
+        message = "An error occurred while getting the metric 'request_count'"
+        assert subscription.get(timeout=2) == ("error", "request_count", message)
+        broadcaster.broadcast()
+        broadcaster.broadcast()
+        broadcaster.broadcast()
+        # The queue overflowed: the subscriber only gets the end of its stream
+        assert subscription.get(timeout=2) is None
+        with pytest.raises(queue.Empty):
+            subscription.get(timeout=0.05)
+        assert broadcaster.stats()["subscribers"] == 0
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+def test_to_sse_event():
+    assert to_sse_event("rows", {"metric": "CPU_utilization", "error": "a\nb"}, "1") == (
+        'event: rows\nid: 1\ndata: {"metric":"CPU_utilization","error":"a\\nb"}\n\n'
+    )
@@ -0,0 +1,52 @@
+import asyncio
+import contextvars
+import time
+
+from util.metric_trace import start_trace, trace_cache, traced
+
+
+def test_trace_records_first_cache_outcome_and_phases():
+    def request():
+        trace = start_trace()
+        trace_cache("rollup")
+        trace_cache("miss")
+        with traced("upstream"):
+            time.sleep(0.02)
+        with traced("normalize"):
+            pass
+        with traced("upstream"):
+            time.sleep(0.01)
+        return trace
+
+    trace = contextvars.copy_context().run(request)
+
+    assert trace.cache == "rollup"
+    assert 0.03 <= trace.upstream_seconds < 0.5
+    assert trace.normalize_seconds < trace.upstream_seconds
+
+
+def test_trace_without_active_trace_is_a_no_op():
+    def request():
+        trace_cache("hit")
+        with traced("upstream"):
+            pass
+
+    contextvars.copy_context().run(request)
+
+
+def test_concurrent_tasks_have_their_own_trace():
+    async def request(outcome, delay):
+        trace = start_trace()
+        await asyncio.sleep(0)
+        trace_cache(outcome)
+        with traced("upstream"):
+            await asyncio.sleep(delay)
+        return trace
+
+    async def main():
+        return await asyncio.gather(request("hit", 0.0), request("miss", 0.05))
+
+    hit, miss = asyncio.run(main())
+
+    assert (hit.cache, miss.cache) == ("hit", "miss")
+    assert hit.upstream_seconds < 0.04 <= miss.upstream_seconds
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from util.single_flight import SingleFlight
+
+
+def test_single_flight_threads_share_one_call():
+    flights = SingleFlight()
+    executions = []
+
+    def fetch():
+        executions.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: flights.do("CPU_utilization", fetch), range(8)))
+
+    assert len(executions) == 1
+    assert [result for result, _ in results] == ["result"] * 8
+    assert sum(shared for _, shared in results) == 7
+    assert flights.stats() == {"calls": 1, "deduplicated": 7, "in_flight": 0}
+
+
+def test_single_flight_async_tasks_share_one_call():
+    flights = SingleFlight()
+    executions = []
+
+    async def fetch():
+        executions.append(1)
+        await asyncio.sleep(0.1)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flights.do_async("CPU_utilization", fetch) for _ in range(8)))
+
+    results = asyncio.run(run())
+
+    assert len(executions) == 1
+    assert [result for result, _ in results] == ["result"] * 8
+    assert flights.stats()["deduplicated"] == 7
+
+
+def test_single_flight_async_task_joins_thread_flight():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def fetch():
+        started.set()
+        time.sleep(0.1)
+        return "result"
+
+    thread = threading.Thread(target=flights.do, args=("CPU_utilization", fetch))
+    thread.start()
+    started.wait()
+
+    async def never_called():
+        raise AssertionError("The async caller should have joined the running flight")
+
+    result, shared = asyncio.run(flights.do_async("CPU_utilization", never_called))
+    thread.join()
+
+    assert result == "result"
+    assert shared
+
+
+def test_single_flight_propagates_exceptions_and_forgets_key():
+    flights = SingleFlight()
+
+    def failing_fetch():
+        raise RuntimeError("upstream failed")
+
+    with pytest.raises(RuntimeError):
+        flights.do("CPU_utilization", failing_fetch)
+
+    # A failed flight is not remembered, so the next call runs again
+    assert flights.do("CPU_utilization", lambda: "result") == ("result", False)
+    assert flights.stats()["calls"] == 2
+
+
+def test_single_flight_cancelled_leader_keeps_flight_for_waiters():
+    flights = SingleFlight()
+    executions = []
+
+    async def fetch():
+        executions.append(1)
+        await asyncio.sleep(0.1)
+        return "result"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do_async("CPU_utilization", fetch))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flights.do_async("CPU_utilization", fetch))
+        await asyncio.sleep(0.01)
+        # E.g. the client of a streamed response went away
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(run()) == ("result", True)
+    assert len(executions) == 1
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_single_flight_cancelled_waiter_does_not_cancel_flight():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do_async("CPU_utilization", fetch))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flights.do_async("CPU_utilization", fetch))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(run()) == ("result", False)
+
+
+def test_single_flight_abandoned_flight_is_retried_by_waiters():
+    flights = SingleFlight()
+    executions = []
+
+    async def fetch():
+        executions.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    def abandoned_leader():
+        # The event loop of the leader ends while its work is in flight, which cancels the work
+        async def lead():
+            asyncio.ensure_future(flights.do_async("CPU_utilization", fetch))
+            await asyncio.sleep(0.01)
+
+        asyncio.run(lead())
+
+    async def run():
+        thread = threading.Thread(target=abandoned_leader)
+        thread.start()
+        await asyncio.sleep(0.005)
+        result = await flights.do_async("CPU_utilization", fetch)
+        thread.join()
+        return result
+
+    assert asyncio.run(run()) == ("result", False)
+    assert len(executions) == 2
+    assert flights.stats()["in_flight"] == 0
@@ -1,10 +1,26 @@
 import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
 from io import StringIO
 
 import pandas as pd
 import pytest
+import pytz
+from google.cloud.monitoring_v3 import Aggregation, ListTimeSeriesResponse, TimeSeries
 
-from util.system_metric import _normalize_dataframe, get_metric_async
+from util import system_metric
+from util.system_metric import (
+    _get_metric_incremental,
+    _merge_incremental_frame,
+    _to_naive_utc,
+    get_metric_async,
+    incremental_frames,
+    metric_cache,
+    parse_metric_reducer,
+    parse_reducer,
+    parse_resolution,
+)
 
 
 @pytest.mark.asyncio
@@ -43,87 +59,422 @@ async def test_get_metric_async():
             assert False, f"Failed to convert JSON back to DataFrame for metric '{metric}':\n{e}"
 
 
-def test_normalize_dataframe_fillna_and_aggregate():
-    # Create a test DataFrame with NaN values and duplicated column names
-    test_data = {
-        "200": [None, 0, None, None, 1],
-        "302": [0, None, 3, 0, 0],
-        "503": [None, 0, 0, 2, None],
-    }
-    index = pd.to_datetime(
-        [
-            "2024-01-19 15:18:00",
-            "2024-01-19 15:19:00",
-            "2024-01-19 15:20:00",
-            "2024-01-19 15:21:00",
-            "2024-01-19 15:22:00",
-        ]
+def test_merge_incremental_frame():
+    # Previous frame covers 15:10 - 15:14, the delta re-fetches from 15:13 and adds 15:15 with a new label
+    previous = pd.DataFrame(
+        data={"200": [1.0, 2.0, 3.0, 4.0, 5.0]},
+        index=pd.date_range("2024-01-19 15:10:00", periods=5, freq="min"),
+    )
+    delta = pd.DataFrame(
+        data={"200": [9.0, 40.0, 50.0, 60.0], "500": [9.0, 0.0, 1.0, 2.0]},
+        index=pd.date_range("2024-01-19 15:12:00", periods=4, freq="min"),
     )
-    df = pd.DataFrame(data=test_data, index=index)
 
-    # Expected DataFrame after normalization
-    expected_data = {"200": [.0, 0, .0, .0, 1], "302": [0, .0, 3, 0, 0], "503": [.0, 0, 0, 2, .0]}
-    expected_df = pd.DataFrame(data=expected_data, index=index)
+    merged = _merge_incremental_frame(
+        previous,
+        delta,
+        delta_start=pd.Timestamp("2024-01-19 15:13:00", tz="UTC"),
+        window_start=pd.Timestamp("2024-01-19 15:11:30", tz="UTC"),
+    )
 
-    # Normalize the DataFrame
-    normalized_df = _normalize_dataframe(df)
+    # 15:10 falls out of the window, 15:11 - 15:12 are kept, 15:13 onwards come from the delta
+    expected_df = pd.DataFrame(
+        data={"200": [2.0, 3.0, 40.0, 50.0, 60.0], "500": [0.0, 0.0, 0.0, 1.0, 2.0]},
+        index=pd.date_range("2024-01-19 15:11:00", periods=5, freq="min"),
+    )
+    pd.testing.assert_frame_equal(merged, expected_df, check_freq=False)
 
-    # Check if the normalized DataFrame matches the expected DataFrame
-    pd.testing.assert_frame_equal(normalized_df, expected_df)
 
+def test_get_metric_incremental_fetches_only_new_minutes(monkeypatch):
+    incremental_frames.clear()
+    end_time = datetime(2024, 1, 19, 16, 0, 30, tzinfo=pytz.utc)
+    fetched_intervals = []
 
-def test_normalize_dataframe_with_mean_values():
-    # Create a test DataFrame with mean values
-    test_data = {"dvwa": [0.0, 0.381171, 0.035862, 0.034418, 0.034892]}
-    index = pd.to_datetime(
-        [
-            "2024-01-19 15:14:00",
-            "2024-01-19 15:15:00",
-            "2024-01-19 15:16:00",
-            "2024-01-19 15:17:00",
-            "2024-01-19 15:18:00",
-        ]
+    def fake_fetch_metric(metric, project_id, service_name, start_time, end_time):
+        fetched_intervals.append((start_time, end_time))
+        index = pd.date_range(_to_naive_utc(start_time).ceil("min"), _to_naive_utc(end_time), freq="min")
+        return pd.DataFrame(data={"dvwa": [1.0] * len(index)}, index=index)
+
+    monkeypatch.setattr(system_metric, "_fetch_metric", fake_fetch_metric)
+
+    first = _get_metric_incremental("CPU_utilization", "project", "dvwa", end_time, timedelta(hours=1))
+    second = _get_metric_incremental(
+        "CPU_utilization", "project", "dvwa", end_time + timedelta(minutes=1), timedelta(hours=1)
     )
-    df = pd.DataFrame(data=test_data, index=index)
 
-    # Expected DataFrame (in this case, it should be the same as input as no aggregation or NaN filling is needed)
-    expected_df = df.copy()
+    # The first call fetches the whole window, the second one only the overlap and the new minute
+    assert fetched_intervals[0][0] == end_time - timedelta(hours=1)
+    assert fetched_intervals[1][0] == pd.Timestamp("2024-01-19 15:56:59", tz="UTC")
+    assert first.index.max() == pd.Timestamp("2024-01-19 16:00:00")
+    assert second.index.min() == pd.Timestamp("2024-01-19 15:01:00")
+    assert second.index.max() == pd.Timestamp("2024-01-19 16:01:00")
+    incremental_frames.clear()
+
+
+def test_parse_resolution():
+    assert parse_resolution(None) == 0
+    assert parse_resolution("60s") == 60
+    assert parse_resolution("5m") == 300
+    assert parse_resolution("1h") == 3600
+    assert parse_resolution(120) == 120
+    # Cloud Monitoring rejects alignment periods under a minute
+    for invalid in ["0m", "-5m", "5x", "m", "1.5h", "10s", "30s", 59, "90s", 150]:
+        with pytest.raises(ValueError):
+            parse_resolution(invalid)
+
+
+def test_parse_reducer():
+    assert parse_reducer(None) is None
+    assert parse_reducer("max") == "REDUCE_MAX"
+    assert parse_reducer("Mean") == "REDUCE_MEAN"
+    with pytest.raises(ValueError):
+        parse_reducer("median")
+
+
+def test_parse_metric_reducer():
+    assert parse_metric_reducer("max", "5m") == "REDUCE_MAX"
+    assert parse_metric_reducer(None, None) is None
+    for resolution in (None, ""):
+        with pytest.raises(ValueError, match="needs a resolution"):
+            parse_metric_reducer("max", resolution)
+
+
+class FakePager(list):
+    """A list_time_series response without time series, iterable per time series or per page."""
+
+    @property
+    def pages(self):
+        return iter([ListTimeSeriesResponse(time_series=list(self))])
+
+
+def test_fetch_metric_with_resolution_aggregates_on_server(monkeypatch):
+    requests = []
+
+    class FakeMetricClient:
+        def list_time_series(self, request):
+            requests.append(request)
+            return FakePager()
+
+    monkeypatch.setattr(system_metric, "get_metric_client", FakeMetricClient)
+    end_time = datetime(2024, 1, 19, 16, 0, tzinfo=pytz.utc)
+
+    system_metric._fetch_metric("request_count", "project", "dvwa", end_time - timedelta(days=1), end_time, 300)
+
+    assert requests[0].page_size == system_metric.PAGE_SIZE
+    aggregation = requests[0].aggregation
+    assert aggregation.alignment_period.seconds == 300
+    assert aggregation.per_series_aligner == Aggregation.Aligner.ALIGN_SUM
+    assert aggregation.cross_series_reducer == Aggregation.Reducer.REDUCE_SUM
+    assert list(aggregation.group_by_fields) == ["metric.label.response_code"]
+
+
+def test_plan_shards_splits_into_adjacent_intervals(monkeypatch):
+    monkeypatch.setattr(system_metric, "SHARD_DURATION", timedelta(days=1))
+    end_time = datetime(2024, 1, 19, 16, 0, tzinfo=pytz.utc)
+
+    shards = system_metric._plan_shards(end_time - timedelta(days=2, hours=12), end_time)
+
+    assert len(shards) == 3
+    assert shards[0][0] == end_time - timedelta(days=2, hours=12)
+    assert shards[-1][1] == end_time
+    assert all(previous[1] == shard[0] for previous, shard in zip(shards, shards[1:]))
+    assert system_metric._plan_shards(end_time - timedelta(hours=1), end_time) == [
+        (end_time - timedelta(hours=1), end_time)
+    ]
+
+
+def test_fetch_metric_shards_match_single_query(monkeypatch):
+    end_time = datetime(2024, 1, 19, 16, 0, tzinfo=pytz.utc)
+    start_time = end_time - timedelta(hours=4)
+    # One point per minute and response code, including the points stamped on the shard boundaries
+    series = []
+    for code in ("200", "500"):
+        time_series = TimeSeries()
+        message = TimeSeries.pb(time_series)
+        message.metric.labels["response_code"] = code
+        for minute in range(240):
+            point = message.points.add()
+            point.interval.end_time.seconds = int(start_time.timestamp()) + 60 + minute * 60
+            point.value.int64_value = minute
+        series.append(message)
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    class FakeMetricClient:
+        def list_time_series(self, request):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.02)
+            first = request.interval.start_time.timestamp()
+            last = request.interval.end_time.timestamp()
+            response = []
+            for message in series:
+                shard = TimeSeries()
+                TimeSeries.pb(shard).metric.CopyFrom(message.metric)
+                TimeSeries.pb(shard).points.extend(
+                    point for point in message.points if first < point.interval.end_time.seconds <= last
+                )
+                response.append(shard)
+            with lock:
+                running[0] -= 1
+            return FakePager(response)
+
+    monkeypatch.setattr(system_metric, "get_metric_client", FakeMetricClient)
+    monkeypatch.setattr(system_metric, "SHARD_DURATION", timedelta(days=1))
+    single = system_metric._fetch_metric("request_count", "project", "dvwa", start_time, end_time)
+    monkeypatch.setattr(system_metric, "SHARD_DURATION", timedelta(minutes=30))
+    monkeypatch.setattr(system_metric, "SHARD_CONCURRENCY", 3)
+    max_running[0] = 0
+    sharded = system_metric._fetch_metric("request_count", "project", "dvwa", start_time, end_time)
+
+    pd.testing.assert_frame_equal(sharded, single)
+    assert len(sharded) == 240
+    assert sharded["200"].sum() == sum(range(240))
+    assert max_running[0] == 3
+
+
+def test_get_metric_async_native_path(monkeypatch):
+    metric_cache.clear()
+    requests = []
+
+    async def fake_consume_time_series_pages(request, consume):
+        requests.append(request)
+        consume([])
+
+    monkeypatch.setattr(system_metric, "consume_time_series_pages", fake_consume_time_series_pages)
+    monkeypatch.setattr(system_metric, "ASYNC_CLIENT_ENABLED", True)
+
+    result = asyncio.run(get_metric_async("CPU_utilization", 0, 1, 0, resolution="5m"))
+
+    assert isinstance(result, pd.DataFrame)
+    assert requests[0].aggregation.alignment_period.seconds == 300
+    assert "run.googleapis.com/container/cpu/utilizations" in requests[0].filter
+    metric_cache.clear()
+
+
+@pytest.mark.parametrize("resolution_seconds, period", [(300, 300), (0, 60)])
+def test_fetch_metric_percentiles_merge_labels_on_server(monkeypatch, resolution_seconds, period):
+    requests = []
 
-    # Normalize the DataFrame
-    normalized_df = _normalize_dataframe(df)
+    class FakeMetricClient:
+        def list_time_series(self, request):
+            requests.append(request)
+            return FakePager()
 
-    # Check if the normalized DataFrame matches the expected DataFrame
-    pd.testing.assert_frame_equal(normalized_df, expected_df)
+    monkeypatch.setattr(system_metric, "get_metric_client", FakeMetricClient)
+    end_time = datetime(2024, 1, 19, 16, 0, tzinfo=pytz.utc)
 
+    start_time = end_time - timedelta(days=1)
 
-def test_normalize_dataframe_remove_seconds_microseconds():
-    # Create a test DataFrame with precise time stamps
-    test_data = {"data": [1, 2, 3, 4, 5]}
-    index = pd.to_datetime(
+    df = system_metric._fetch_metric(
+        "request_latencies", "project", "dvwa", start_time, end_time, resolution_seconds, None, (50.0, 99.0)
+    )
+
+    aggregation = requests[0].aggregation
+    assert aggregation.alignment_period.seconds == period
+    assert aggregation.per_series_aligner == Aggregation.Aligner.ALIGN_DELTA
+    assert aggregation.cross_series_reducer == Aggregation.Reducer.REDUCE_SUM
+    assert list(aggregation.group_by_fields) == []
+    assert list(df.columns) == ["p50", "p99"]
+
+
+def test_get_metric_percentiles_validation():
+    with pytest.raises(ValueError):
+        system_metric.get_metric("request_count", hours=1, percentiles=True)
+    with pytest.raises(ValueError):
+        system_metric.get_metric("request_latencies", hours=1, percentiles=True, reducer="max")
+    with pytest.raises(ValueError):
+        system_metric.get_metric("request_latencies", hours=1, percentiles=[50, 101])
+
+
+def test_get_metric_heatmap_merges_labels_on_server(monkeypatch):
+    metric_cache.clear()
+    requests = []
+
+    class FakeMetricClient:
+        def list_time_series(self, request):
+            requests.append(request)
+            return FakePager()
+
+    monkeypatch.setattr(system_metric, "get_metric_client", FakeMetricClient)
+
+    heatmap = system_metric.get_metric_heatmap("request_latencies", hours=1, resolution="5m")
+
+    aggregation = requests[0].aggregation
+    assert aggregation.alignment_period.seconds == 300
+    assert aggregation.per_series_aligner == Aggregation.Aligner.ALIGN_DELTA
+    assert aggregation.cross_series_reducer == Aggregation.Reducer.REDUCE_SUM
+    assert len(heatmap) in (12, 13)
+    with pytest.raises(ValueError):
+        system_metric.get_metric_heatmap("request_count", hours=1)
+    metric_cache.clear()
+
+
+def test_parse_time_range():
+    expected = (datetime(2024, 1, 19, 15, 0, tzinfo=pytz.utc), datetime(2024, 1, 19, 16, 0, tzinfo=pytz.utc))
+
+    assert system_metric.parse_time_range(None, None) is None
+    assert system_metric.parse_time_range("2024-01-19T15:00:30Z", 1705680000) == expected
+    assert system_metric.parse_time_range("2024-01-19T17:00:00+02:00", "1705680000") == expected
+    assert system_metric.parse_time_range(datetime(2024, 1, 19, 15, 0), "2024-01-19 16:00") == expected
+    for start, end in [("2024-01-19", None), ("yesterday", "2024-01-19"), ("2024-01-19T15:00", "2024-01-19T15:00:59")]:
+        with pytest.raises(ValueError):
+            system_metric.parse_time_range(start, end)
+
+
+def test_get_metric_absolute_settled_window_is_cached_until_evicted(monkeypatch):
+    fetched_intervals = []
+
+    def fake_fetch_metric(metric, project_id, service_name, start_time, end_time, *args):
+        fetched_intervals.append((start_time, end_time))
+        return pd.DataFrame(data={"200": [1]}, index=pd.DatetimeIndex([_to_naive_utc(end_time)]))
+
+    monkeypatch.setattr(system_metric, "_fetch_metric", fake_fetch_metric)
+    monkeypatch.setattr(metric_cache, "ttl", 0.01)
+    metric_cache.clear()
+
+    settled = system_metric.get_metric("request_count", start="2024-01-19T15:00:00Z", end="2024-01-19T16:00:00Z")
+    now = datetime.now(tz=pytz.utc)
+    system_metric.get_metric("request_count", start=now - timedelta(hours=1), end=now)
+    time.sleep(0.05)
+
+    assert fetched_intervals[0] == (
+        datetime(2024, 1, 19, 15, tzinfo=pytz.utc),
+        datetime(2024, 1, 19, 16, tzinfo=pytz.utc),
+    )
+    # The settled window is served from the cache, the recent one has expired
+    cached = system_metric.get_metric("request_count", start=1705676400, end=1705680000)
+    system_metric.get_metric("request_count", start=now - timedelta(hours=1), end=now)
+
+    pd.testing.assert_frame_equal(cached, settled)
+    assert len(fetched_intervals) == 3
+    assert system_metric.is_immutable_window(datetime(2024, 1, 19, 16, tzinfo=pytz.utc))
+    assert not system_metric.is_immutable_window(now)
+    metric_cache.clear()
+
+
+def test_iter_all_metric_frames_yields_in_completion_order(monkeypatch):
+    delays = {"request_latencies": 0.2, "CPU_utilization": 0.0}
+    cancelled = []
+
+    async def fake_get_metric_async(metric, days, hours, minutes, **options):
+        try:
+            await asyncio.sleep(delays.get(metric, 0.05))
+        except asyncio.CancelledError:
+            cancelled.append(metric)
+            raise
+        if metric == "startup_latency":
+            raise RuntimeError("unavailable")
+        return pd.DataFrame({"200": [1.0]})
+
+    monkeypatch.setattr(system_metric, "get_metric_async", fake_get_metric_async)
+
+    async def collect(limit=None):
+        results = []
+        async for metric, result in system_metric.iter_all_metric_frames(hours=1):
+            results.append((metric, result))
+            if len(results) == limit:
+                break
+        return results
+
+    results = asyncio.run(collect())
+    assert [metric for metric, _ in results][0] == "CPU_utilization"
+    assert [metric for metric, _ in results][-1] == "request_latencies"
+    assert sorted(metric for metric, _ in results) == sorted(system_metric.METRICS_INFO)
+    assert isinstance(dict(results)["startup_latency"], RuntimeError)
+    # Stopping after the first metric cancels the others
+    asyncio.run(collect(limit=1))
+    assert len(cancelled) == len(system_metric.METRICS_INFO) - 1
+
+
+def test_parse_metric_batch():
+    queries = system_metric.parse_metric_batch(
         [
-            "2024-01-19 15:14:23.123456",
-            "2024-01-19 15:15:45.654321",
-            "2024-01-19 15:16:56.789101",
-            "2024-01-19 15:17:12.345678",
-            "2024-01-19 15:18:34.987654",
+            {"id": "cpu", "metric": "CPU_utilization", "window": "1h", "resolution": "5m"},
+            {"metric": "request_count", "days": "1", "max_points": "500", "incremental": False},
+            {"metric": "request_latencies", "window": "7d", "points": 300},
         ]
     )
-    df = pd.DataFrame(data=test_data, index=index)
 
-    # Expected DataFrame after removing seconds and microseconds
-    expected_index = pd.to_datetime(
+    assert queries[0] == system_metric.BatchQuery("cpu", "CPU_utilization", 0, 0, 60, {"resolution": "5m"})
+    assert queries[1] == system_metric.BatchQuery(
+        None, "request_count", 1, 0, 0, {"incremental": False, "max_points": 500}
+    )
+    assert (queries[2].minutes, queries[2].options) == (7 * 1440, {"points": 300})
+    for specs in (
+        [],
+        [{"metric": "unknown", "window": "1h"}],
+        [{"metric": "CPU_utilization", "window": "90s"}],
+        [{"metric": "CPU_utilization", "window": "1h", "hours": 1}],
+        [{"metric": "request_count", "window": "1h", "percentiles": [99]}],
+        [{"metric": "CPU_utilization", "window": "1h", "points": 10, "resolution": "5m"}],
+        [{"metric": "CPU_utilization", "window": "1h", "typo": 1}],
+        [{"metric": "CPU_utilization", "days": None}],
+        [{"metric": "CPU_utilization", "hours": 1.5}],
+        [{"metric": "CPU_utilization", "window": "1h", "incremental": "false"}],
+        [{"metric": "CPU_utilization", "window": "1h", "max_points": "many"}],
+        [{"metric": "CPU_utilization", "window": "1h"}] * (system_metric.BATCH_MAX_QUERIES + 1),
+    ):
+        with pytest.raises(ValueError):
+            system_metric.parse_metric_batch(specs)
+
+
+def test_get_metric_batch_runs_queries_concurrently(monkeypatch):
+    async def fake_get_metric_async(metric, days, hours, minutes, **options):
+        await asyncio.sleep(0.2)
+        if metric == "startup_latency":
+            raise RuntimeError("unavailable")
+        return pd.DataFrame({"200": [1.0] * minutes})
+
+    monkeypatch.setattr(system_metric, "get_metric_async", fake_get_metric_async)
+    queries = system_metric.parse_metric_batch(
         [
-            "2024-01-19 15:14:00",
-            "2024-01-19 15:15:00",
-            "2024-01-19 15:16:00",
-            "2024-01-19 15:17:00",
-            "2024-01-19 15:18:00",
+            {"metric": "CPU_utilization", "window": "1h"},
+            {"metric": "startup_latency", "window": "2h"},
+            {"metric": "request_count", "window": "24h"},
         ]
     )
-    expected_df = pd.DataFrame(data=test_data, index=expected_index)
 
-    # Normalize the DataFrame
-    normalized_df = _normalize_dataframe(df)
+    started = time.perf_counter()
+    results = asyncio.run(system_metric.get_metric_batch(queries))
+
+    assert time.perf_counter() - started < 0.5
+    assert [result.query for result in results] == queries
+    assert len(results[0].result) == 60 and len(results[2].result) == 1440
+    assert isinstance(results[1].result, RuntimeError)
+    assert all(0.2 <= result.elapsed < 0.5 for result in results)
+
 
-    # Check if the DataFrame index matches the expected index (with seconds and microseconds removed)
-    pd.testing.assert_index_equal(normalized_df.index, expected_df.index)
+def test_get_all_metrics_envelope(monkeypatch):
+    metric_cache.clear()
+
+    def fake_fetch_metric(metric, *args):
+        time.sleep(0.02)
+        if metric == "startup_latency":
+            raise PermissionError("denied")
+        return pd.DataFrame({"200": [1.0, 2.0], "500": [0.0, 1.0]}, index=pd.date_range("2024-01-19", periods=2))
+
+    monkeypatch.setattr(system_metric, "_fetch_metric", fake_fetch_metric)
+    monkeypatch.setattr(system_metric, "ASYNC_CLIENT_ENABLED", False)
+
+    first = asyncio.run(system_metric.get_all_metrics(hours=1, envelope=True))
+    second = asyncio.run(system_metric.get_all_metrics(hours=1, envelope=True))
+
+    cpu = first["CPU_utilization"]
+    assert (cpu["status"], cpu["error_class"], cpu["cache"], cpu["points"]) == ("ok", None, "miss", 4)
+    assert cpu["upstream_ms"] == 0.0  # Measured inside `_fetch_metric`, which is faked here
+    assert cpu["elapsed_ms"] >= 20
+    assert isinstance(cpu["data"], str)
+    assert second["CPU_utilization"]["cache"] == "hit"
+    failed = first["startup_latency"]
+    assert (failed["status"], failed["error_class"], failed["data"], failed["points"]) == (
+        "error",
+        "PermissionError",
+        None,
+        None,
+    )
+    assert "denied" in failed["error"]
+    # Without envelope the legacy strings are unchanged
+    legacy = asyncio.run(system_metric.get_all_metrics(hours=1))
+    assert legacy["CPU_utilization"] == cpu["data"]
+    metric_cache.clear()
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+import pytest
+from google.cloud.monitoring_v3 import TimeSeries
+
+from util.system_metric import METRICS_INFO, _metric_aggregator
+from util.timeseries_decoder import MinuteAggregator, decode_time_series
+
+START_SECONDS = 1705677240
+
+
+def build_normalized_dataframe(time_series: list[TimeSeries], metric: str) -> pd.DataFrame:
+    """Builds a metric frame with the aggregator the fetch paths stream the pages of a response into."""
+    aggregator = _metric_aggregator(metric)
+    aggregator.add(time_series)
+    return aggregator.result()
+
+
+def build_time_series(
+    label: str, label_value: str, value_field: str, minutes: int, seed: int, offset_seconds: int = 0, gaps: bool = False
+) -> TimeSeries:
+    """Builds a time series with one point per minute, optionally missing some minutes."""
+    rng = np.random.default_rng(seed)
+    series = TimeSeries()
+    message = TimeSeries.pb(series)
+    message.metric.labels[label] = label_value
+    message.resource.labels["service_name"] = "dvwa"
+    message.resource.labels["revision_name"] = f"dvwa-{seed:05d}"
+    for minute in range(minutes):
+        if gaps and rng.random() < 0.3:
+            continue
+        point = message.points.add()
+        point.interval.end_time.seconds = START_SECONDS + minute * 60 + offset_seconds
+        match value_field:
+            case "int64_value":
+                point.value.int64_value = int(rng.integers(0, 100))
+            case "double_value":
+                point.value.double_value = float(rng.random())
+            case "distribution_value":
+                point.value.distribution_value.count = int(rng.integers(0, 20))
+                point.value.distribution_value.mean = float(rng.random() * 500)
+    return series
+
+
+def explicit_series(
+    label: str, label_value: str, revision: str, points: dict[int, int | tuple[int, float]]
+) -> TimeSeries:
+    """Builds a time series with the given points per minute, (count, mean) tuples for distribution points."""
+    series = TimeSeries()
+    message = TimeSeries.pb(series)
+    message.metric.labels[label] = label_value
+    message.resource.labels["revision_name"] = revision
+    for minute, value in points.items():
+        point = message.points.add()
+        point.interval.end_time.seconds = START_SECONDS + minute * 60
+        if isinstance(value, tuple):
+            point.value.distribution_value.count, point.value.distribution_value.mean = value
+        else:
+            point.value.int64_value = value
+    return series
+
+
+def minutes_frame(values: dict[str, list], minutes: int = 3) -> pd.DataFrame:
+    index = pd.DatetimeIndex([(START_SECONDS + minute * 60) * 1_000_000_000 for minute in range(minutes)])
+    return pd.DataFrame(values, index=index, columns=pd.Index(list(values), dtype=object))
+
+
+# The points of two series of the label '200' and one of '500', per minute
+INTEGER_POINTS = ({0: 1, 1: 2, 2: 3}, {0: 10, 2: 30}, {1: 5})
+
+
+@pytest.mark.parametrize(
+    "metric, points, expected",
+    [
+        # Summed per label, a missing point counts as 0 and makes the column float
+        ("request_count", INTEGER_POINTS, {"200": [11.0, 2.0, 33.0], "500": [0.0, 5.0, 0.0]}),
+        ("instance_count", INTEGER_POINTS, {"200": [10.0, 2.0, 30.0], "500": [0.0, 5.0, 0.0]}),
+        # The largest mean in percent
+        (
+            "CPU_utilization",
+            ({0: (1, 0.25), 1: (1, 0.5), 2: (1, 0.75)}, {0: (1, 0.5), 2: (1, 0.25)}, {1: (1, 0.125)}),
+            {"200": [50.0, 50.0, 75.0], "500": [0.0, 12.5, 0.0]},
+        ),
+        # The mean of the merged distributions
+        (
+            "request_latencies",
+            ({0: (1, 100.0), 1: (2, 50.0), 2: (3, 10.0)}, {0: (3, 200.0), 2: (1, 50.0)}, {1: (4, 25.0)}),
+            {"200": [175.0, 50.0, 20.0], "500": [0.0, 25.0, 0.0]},
+        ),
+    ],
+)
+def test_metric_aggregator_combines_series_sharing_a_label(metric, points, expected):
+    label = METRICS_INFO[metric]["label"]
+    time_series = [
+        explicit_series(label, "200", "dvwa-00001", points[0]),
+        explicit_series(label, "200", "dvwa-00002", points[1]),
+        explicit_series(label, "500", "dvwa-00001", points[2]),
+    ]
+
+    result = build_normalized_dataframe(time_series, metric)
+
+    pd.testing.assert_frame_equal(result, minutes_frame(expected), check_exact=True)
+
+
+def test_metric_aggregator_keeps_integers_without_missing_points():
+    time_series = [
+        explicit_series("response_code", "200", "dvwa-00001", {0: 1, 1: 2, 2: 3}),
+        explicit_series("response_code", "500", "dvwa-00001", {0: 4, 1: 5, 2: 6}),
+    ]
+
+    result = build_normalized_dataframe(time_series, "request_count")
+
+    pd.testing.assert_frame_equal(result, minutes_frame({"200": [1, 2, 3], "500": [4, 5, 6]}), check_exact=True)
+
+
+def test_minute_aggregator_keeps_single_point_means_exact():
+    aggregator = MinuteAggregator("response_code", "weighted_mean")
+    aggregator.add(
+        [
+            explicit_series("response_code", "200", "dvwa-00001", {0: (3, 0.1), 1: (2, 1.5)}),
+            explicit_series("response_code", "200", "dvwa-00002", {0: (1, 2.0)}),
+            explicit_series("response_code", "500", "dvwa-00001", {0: (11, 93.78528683620819), 1: (3, 0.1)}),
+        ]
+    )
+
+    # 0.1 * 3 / 3 would be 0.10000000000000002, only the minute with two points of '200' is weighted
+    expected = minutes_frame({"200": [(0.1 * 3 + 2.0) / 4, 1.5], "500": [93.78528683620819, 0.1]}, minutes=2)
+    pd.testing.assert_frame_equal(aggregator.result(), expected, check_exact=True)
+
+
+def test_metric_aggregator_unaligned_series_share_minutes():
+    # as_dataframe keeps 15:14:00 and 15:14:05 apart, which duplicates the minutes once they are floored
+    time_series = [
+        build_time_series("response_code", "200", "int64_value", minutes=3, seed=0),
+        build_time_series("response_code", "500", "int64_value", minutes=3, seed=1, offset_seconds=5),
+    ]
+
+    result = build_normalized_dataframe(time_series, "request_count")
+
+    assert result.index.is_unique
+    assert len(result) == 3
+    assert result.to_numpy().sum() == sum(
+        point.value.int64_value for series in time_series for point in TimeSeries.pb(series).points
+    )
+
+
+def test_metric_aggregator_empty():
+    result = build_normalized_dataframe([], "request_count")
+
+    assert result.empty
+    assert result.to_json() == "{}"
+
+
+def test_decode_time_series_labels_and_codes():
+    time_series = [
+        build_time_series("response_code", "500", "int64_value", minutes=2, seed=0),
+        build_time_series("response_code", "200", "int64_value", minutes=3, seed=1),
+    ]
+
+    points = decode_time_series(time_series, "response_code")
+
+    assert points.labels == ["200", "500"]
+    assert points.label_codes.tolist() == [1, 1, 0, 0, 0]
+    assert len(set(points.series_keys)) == 2
+    assert points.timestamps[0] == START_SECONDS * 1_000_000_000
+    assert points.integer
+
+
+def test_decode_time_series_resource_label():
+    points = decode_time_series([build_time_series("state", "active", "double_value", 1, seed=0)], "service_name")
+
+    assert points.labels == ["dvwa"]
+    assert not points.integer
+
+
+def test_minute_aggregator_invalid_aggregation():
+    with pytest.raises(ValueError):
+        MinuteAggregator("response_code", "median")
+
+
+@pytest.mark.parametrize("aggregation", ["sum", "max", "weighted_mean"])
+def test_minute_aggregator_pages_match_one_pass(aggregation):
+    value_field = "distribution_value" if aggregation == "weighted_mean" else "int64_value"
+    time_series = [
+        build_time_series("response_code", "200", value_field, minutes=30, seed=0, gaps=True),
+        build_time_series("response_code", "500", value_field, minutes=30, seed=1, gaps=True),
+        build_time_series("response_code", "200", value_field, minutes=10, seed=2),
+    ]
+    one_pass = MinuteAggregator("response_code", aggregation)
+    one_pass.add(time_series)
+
+    # Pages in reverse order, with the first series split across two pages, so the minutes and labels grow
+    first_half, second_half = TimeSeries(), TimeSeries()
+    for half, points in ((first_half, slice(None, 10)), (second_half, slice(10, None))):
+        TimeSeries.pb(half).CopyFrom(TimeSeries.pb(time_series[0]))
+        del TimeSeries.pb(half).points[:]
+        TimeSeries.pb(half).points.extend(TimeSeries.pb(time_series[0]).points[points])
+    paged = MinuteAggregator("response_code", aggregation)
+    for page in ([time_series[2]], [time_series[1], second_half], [first_half]):
+        paged.add(page)
+
+    pd.testing.assert_frame_equal(paged.result(), one_pass.result())
+
+
+def test_minute_aggregator_memory_does_not_grow_with_series():
+    aggregator = MinuteAggregator("response_code", "sum")
+    for page in range(20):
+        page_series = [
+            build_time_series("response_code", str(code), "int64_value", 60, seed=page * 5 + code) for code in range(5)
+        ]
+        aggregator.add(page_series)
+
+    result = aggregator.result()
+
+    assert aggregator._values.shape == (60, 5)
+    assert result.shape == (60, 5)
+    assert result.dtypes.unique().tolist() == [np.dtype("int64")]
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator, Sequence, TypeVar
+
+from google.cloud.monitoring_v3 import ListTimeSeriesRequest, TimeSeries
+
+from util.gcp_clients import get_metric_async_client
+
+T = TypeVar("T")
+
+_normalize_pool: ThreadPoolExecutor | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _get_monitoring_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop that owns the async Monitoring client, starting it in a daemon thread on first use.
+
+    Flask runs every async view in a new event loop, and a gRPC asyncio channel is bound to the loop it was created
+    on. Running all Monitoring calls on one long-lived loop lets every request share a single channel.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="monitoring-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+async def run_on_monitoring_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a coroutine on the shared Monitoring loop and awaits its result from the caller's event loop.
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, _get_monitoring_loop())
+    return await asyncio.wrap_future(future)
+
+
+def iterate_on_monitoring_loop(iterator: AsyncIterator[T]) -> Iterator[T]:
+    """
+    Iterates an async iterator from synchronous code, e.g. the body of a streamed response, on the shared Monitoring
+    loop. That loop runs on while the caller handles an item, so the tasks of the iterator keep making progress.
+    Closing the returned generator closes the async iterator.
+    """
+    loop = _get_monitoring_loop()
+
+    async def next_item() -> T:
+        return await iterator.__anext__()
+
+    async def close() -> None:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(next_item(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(close(), loop).result()
+
+
+async def run_in_normalize_pool(func: Callable[..., T], *args: Any) -> T:
+    """
+    Runs CPU-bound DataFrame work in the bounded normalize pool and awaits its result.
+
+    The pool size is set by the 'METRIC_NORMALIZE_WORKERS' environment variable (default 4), so a burst of requests
+    cannot take every thread of the default executor.
+    """
+    global _normalize_pool
+    with _loop_lock:
+        if _normalize_pool is None:
+            _normalize_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("METRIC_NORMALIZE_WORKERS", default="4")),
+                thread_name_prefix="metric-normalize",
+            )
+    return await asyncio.get_running_loop().run_in_executor(_normalize_pool, func, *args)
+
+
+async def list_time_series(request: ListTimeSeriesRequest) -> list[TimeSeries]:
+    """
+    Issues a `list_time_series` call with the shared async client and collects every page.
+
+    Returns:
+        list[TimeSeries]: The time series of all result pages.
+    """
+    return await run_on_monitoring_loop(_list_time_series(request))
+
+
+async def _list_time_series(request: ListTimeSeriesRequest) -> list[TimeSeries]:
+    client = get_metric_async_client()
+    pager = await client.list_time_series(request=request)
+    return [time_series async for time_series in pager]
+
+
+async def consume_time_series_pages(
+    request: ListTimeSeriesRequest, consume: Callable[[Sequence[TimeSeries]], None]
+) -> None:
+    """
+    Issues a `list_time_series` call with the shared async client and hands every page to `consume`.
+
+    The pages are fetched one after the other and every page is consumed in the normalize pool before the next one
+    is requested, so only one page is held in memory at a time.
+    """
+    await run_on_monitoring_loop(_consume_time_series_pages(request, consume))
+
+
+async def _consume_time_series_pages(
+    request: ListTimeSeriesRequest, consume: Callable[[Sequence[TimeSeries]], None]
+) -> None:
+    client = get_metric_async_client()
+    pager = await client.list_time_series(request=request)
+    async for page in pager.pages:
+        await run_in_normalize_pool(consume, page.time_series)
+
+
+def _reset_after_fork() -> None:
+    # Threads do not survive a fork, so the child starts its own loop and pool on first use
+    global _loop, _loop_lock, _normalize_pool
+    _loop = None
+    _normalize_pool = None
+    _loop_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
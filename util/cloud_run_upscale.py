@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 from google.api_core.operation import Operation
 from google.cloud import run_v2
 
+from util.gcp_clients import get_services_client
+
 
 def cloud_run_upscale(memory_limit: str | None = None, cpu_limit: str | None = None) -> int:
     """
@@ -40,7 +42,7 @@ def cloud_run_upscale(memory_limit: str | None = None, cpu_limit: str | None = N
     SERVICE_REGION: str = os.getenv("SERVICE_REGION", default="us-central1")
     PROJECT_ID: str = os.getenv("PROJECT_ID", default="tsmccareerhack2024-icsd-grp1")
 
-    client: run_v2.ServicesClient = run_v2.ServicesClient()
+    client: run_v2.ServicesClient = get_services_client()
     resource_name: str = f"projects/{PROJECT_ID}/locations/{SERVICE_REGION}/services/{SERVICE_NAME}"
 
     service: run_v2.Service = client.get_service(name=resource_name)
@@ -90,7 +92,7 @@ def get_resources_limits() -> dict:
     SERVICE_REGION: str = os.getenv("SERVICE_REGION", default="default-region")
     PROJECT_ID: str = os.getenv("PROJECT_ID", default="default-project-id")
 
-    client: run_v2.ServicesClient = run_v2.ServicesClient()
+    client: run_v2.ServicesClient = get_services_client()
     resource_name: str = f"projects/{PROJECT_ID}/locations/{SERVICE_REGION}/services/{SERVICE_NAME}"
 
     try:
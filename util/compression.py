@@ -0,0 +1,111 @@
+import os
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Responses smaller than this are sent as they are, compressing them saves less than the headers cost
+MIN_BYTES = int(os.getenv("METRIC_COMPRESSION_MIN_BYTES", default=1024))
+# Responses from this size on are compressed while they are sent, rather than into a second buffer beforehand
+STREAM_BYTES = int(os.getenv("METRIC_COMPRESSION_STREAM_BYTES", default=1024 * 1024))
+CHUNK_BYTES = 64 * 1024
+
+# The levels trade CPU for size and have different ranges: gzip 1 to 9, brotli 0 to 11 and zstd 1 to 22. On metric
+# JSON, higher zstd and brotli levels save a few percent for several times the CPU, see `benchmarks.bench_compression`
+LEVELS = {
+    "zstd": int(os.getenv("METRIC_ZSTD_LEVEL", default=1)),
+    "br": int(os.getenv("METRIC_BROTLI_LEVEL", default=1)),
+    "gzip": int(os.getenv("METRIC_GZIP_LEVEL", default=5)),
+}
+
+
+def available_encodings() -> list[str]:
+    """
+    Returns the content encodings that can be sent, preferred first: zstd and brotli when installed, then gzip.
+    """
+    installed = {"zstd": zstandard is not None, "br": brotli is not None, "gzip": True}
+    return [encoding for encoding in LEVELS if installed[encoding]]
+
+
+def negotiate_encoding(accept_encodings) -> str | None:
+    """
+    Returns the content encoding preferred by an 'Accept-Encoding' header, or None if the body should be sent as is.
+
+    Args:
+        accept_encodings (werkzeug.datastructures.Accept): The parsed header, e.g. `request.accept_encodings`. Among
+                                                           encodings of the same quality, the first of
+                                                           `available_encodings` is chosen.
+    """
+    return accept_encodings.best_match(available_encodings())
+
+
+def _compressor(encoding: str, level: int) -> tuple[Callable[[bytes], bytes], Callable[[], bytes], Callable[[], bytes]]:
+    """
+    Returns the (compress, flush, finish) functions of a new compression stream, flush ending the bytes given so far
+    so that the client can decode them, and finish ending the stream.
+    """
+    if encoding == "gzip":
+        # A window of 2**15 with the gzip header and trailer
+        stream = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH), stream.flush
+    if encoding == "br" and brotli is not None:
+        stream = brotli.Compressor(quality=level)
+        return stream.process, stream.flush, stream.finish
+    if encoding == "zstd" and zstandard is not None:
+        stream = zstandard.ZstdCompressor(level=level).compressobj()
+        return stream.compress, lambda: stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), stream.flush
+    raise ValueError(f"Unsupported content encoding '{encoding}', expected one of {', '.join(available_encodings())}.")
+
+
+def compress_chunks(
+    chunks: Iterable[bytes], encoding: str, level: int | None = None, flush: bool = False
+) -> Iterator[bytes]:
+    """
+    Compresses a body while it is sent, one chunk at a time, so that neither the whole body nor the whole compressed
+    body has to be held at once.
+
+    Args:
+        chunks (Iterable[bytes]): The parts of the body.
+        encoding (str): 'gzip', 'br' or 'zstd', see `available_encodings`.
+        level (int | None): The compression level, defaults to the one of the encoding in LEVELS.
+        flush (bool): Whether to flush the compressed bytes of every chunk, for streamed responses whose every chunk
+                      should reach the client as soon as it is produced. Costs a little of the ratio.
+
+    Yields:
+        bytes: The compressed parts, without empty ones.
+
+    Raises:
+        ValueError: If the encoding is not available.
+    """
+    compress, flush_chunk, finish = _compressor(encoding, LEVELS.get(encoding, 0) if level is None else level)
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if flush:
+            compressed += flush_chunk()
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def compress(body: bytes, encoding: str, level: int | None = None) -> bytes:
+    """
+    Compresses a whole body, see `compress_chunks`.
+    """
+    return b"".join(compress_chunks([body], encoding, level))
+
+
+def split_chunks(body: bytes, chunk_bytes: int = CHUNK_BYTES) -> Iterator[memoryview]:
+    """
+    Yields views of consecutive parts of at most chunk_bytes of a body, without copying it.
+    """
+    view = memoryview(body)
+    for offset in range(0, len(view), chunk_bytes):
+        yield view[offset : offset + chunk_bytes]
@@ -0,0 +1,200 @@
+from datetime import datetime
+from typing import Iterable, Sequence
+
+import numpy as np
+import pandas as pd
+from google.api.distribution_pb2 import Distribution
+from google.cloud.monitoring_v3 import TimeSeries
+
+DEFAULT_PERCENTILES: tuple[float, ...] = (50.0, 90.0, 95.0, 99.0)
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+
+
+def bucket_bounds(bucket_options: Distribution.BucketOptions) -> np.ndarray:
+    """
+    Returns the boundaries of the finite buckets of a distribution.
+
+    For N finite buckets, N + 1 boundaries are returned. Bucket 0 is the underflow bucket (below the first
+    boundary), buckets 1 to N are the finite ones and bucket N + 1 is the overflow bucket (from the last boundary).
+
+    Raises:
+        ValueError: If the bucket options are not set.
+    """
+    match bucket_options.WhichOneof("options"):
+        case "exponential_buckets":
+            exponential = bucket_options.exponential_buckets
+            return exponential.scale * exponential.growth_factor ** np.arange(exponential.num_finite_buckets + 1)
+        case "linear_buckets":
+            linear = bucket_options.linear_buckets
+            return linear.offset + linear.width * np.arange(linear.num_finite_buckets + 1, dtype="float64")
+        case "explicit_buckets":
+            return np.asarray(bucket_options.explicit_buckets.bounds, dtype="float64")
+        case _:
+            raise ValueError("The distribution has no bucket options.")
+
+
+def bucket_lower_edges(bounds: np.ndarray) -> np.ndarray:
+    """
+    Returns the lower edge of every bucket, including the underflow bucket, which is taken to start at 0 (or at the
+    first boundary if that is negative).
+    """
+    return np.concatenate(([min(0.0, bounds[0])], bounds)) if len(bounds) else np.zeros(0)
+
+
+def merge_histograms(
+    time_series: Iterable[TimeSeries], period_seconds: int = 60
+) -> tuple[pd.DatetimeIndex, np.ndarray, np.ndarray]:
+    """
+    Merges the distribution points of every time series into one histogram per period (one minute by default).
+
+    The bucket counts of all points falling into the same period are added up, which is the exact merge of the
+    distributions as long as they share their bucket options (Cloud Monitoring uses fixed buckets per metric). The
+    points are written straight into preallocated arrays, without intermediate Python lists.
+
+    Args:
+        time_series (Iterable[TimeSeries]): Time series with distribution values, e.g. a Query.
+        period_seconds (int): The length of the periods the points are grouped into, aligned to the epoch.
+
+    Returns:
+        tuple: The periods (naive UTC), the bucket counts with one row per period, and the bucket boundaries
+               (see `bucket_bounds`).
+
+    Raises:
+        ValueError: If the time series do not all use the same bucket options.
+    """
+    series_points = [TimeSeries.pb(series).points for series in time_series]
+    num_points = sum(len(points) for points in series_points)
+    end_times = np.empty(num_points, dtype="int64")
+    counts = np.zeros((0, 0), dtype="int64")
+    bucket_options = None
+    row = 0
+    for points in series_points:
+        if not points:
+            continue
+        if bucket_options is None:
+            bucket_options = points[0].value.distribution_value.bucket_options
+            counts = np.zeros((num_points, len(bucket_bounds(bucket_options)) + 1), dtype="int64")
+        elif points[0].value.distribution_value.bucket_options != bucket_options:
+            raise ValueError("Distributions with different bucket options cannot be merged.")
+        for point in points:
+            end_time = point.interval.end_time
+            end_times[row] = end_time.seconds * 1_000_000_000 + end_time.nanos
+            # Trailing empty buckets are omitted from bucket_counts
+            point_counts = point.value.distribution_value.bucket_counts
+            counts[row, : len(point_counts)] = point_counts
+            row += 1
+
+    if bucket_options is None:
+        return pd.DatetimeIndex([]), counts, np.zeros(0)
+
+    period_ns = period_seconds * 1_000_000_000
+    periods, inverse = np.unique(end_times // period_ns, return_inverse=True)
+    histograms = np.zeros((len(periods), counts.shape[1]), dtype="int64")
+    np.add.at(histograms, inverse, counts)
+    return pd.DatetimeIndex(periods * period_ns), histograms, bucket_bounds(bucket_options)
+
+
+def histogram_percentiles(histograms: np.ndarray, bounds: np.ndarray, percentiles: Sequence[float]) -> np.ndarray:
+    """
+    Estimates percentiles from histograms, interpolating linearly inside the bucket holding each rank.
+
+    The underflow bucket is taken to start at 0 (or at the first boundary if that is negative), and ranks falling
+    into the overflow bucket are reported as its lower boundary. Rows without any count yield 0.0.
+
+    Args:
+        histograms (np.ndarray): Bucket counts with one row per histogram, see `merge_histograms`.
+        bounds (np.ndarray): The bucket boundaries, see `bucket_bounds`.
+        percentiles (Sequence[float]): The percentiles to estimate, between 0 and 100.
+
+    Returns:
+        np.ndarray: One row per histogram and one column per percentile.
+    """
+    if histograms.size == 0:
+        return np.zeros((histograms.shape[0], len(percentiles)))
+    lower_edges = bucket_lower_edges(bounds)
+    upper_edges = np.concatenate((bounds, bounds[-1:]))
+
+    cumulative = histograms.cumsum(axis=1)
+    totals = cumulative[:, -1]
+    ranks = totals[:, None] * (np.asarray(percentiles, dtype="float64")[None, :] / 100.0)
+
+    # The bucket of each rank is the first one whose cumulative count reaches it
+    buckets = (cumulative[:, None, :] < ranks[:, :, None]).sum(axis=2).clip(max=histograms.shape[1] - 1)
+    rows = np.arange(histograms.shape[0])[:, None]
+    in_bucket = histograms[rows, buckets]
+    below_bucket = cumulative[rows, buckets] - in_bucket
+    fraction = np.divide(ranks - below_bucket, in_bucket, out=np.zeros_like(ranks), where=in_bucket > 0)
+
+    values = lower_edges[buckets] + fraction.clip(0.0, 1.0) * (upper_edges[buckets] - lower_edges[buckets])
+    return np.where(totals[:, None] > 0, values, 0.0)
+
+
+def percentiles_dataframe(
+    time_series: Iterable[TimeSeries], percentiles: Sequence[float] = DEFAULT_PERCENTILES
+) -> pd.DataFrame:
+    """
+    Builds one percentile series per requested percentile from the merged histograms of distribution time series.
+
+    Returns:
+        pd.DataFrame: A DataFrame indexed by minute with the columns 'p50', 'p90', ... for the requested percentiles.
+    """
+    minutes, histograms, bounds = merge_histograms(time_series)
+    values = histogram_percentiles(histograms, bounds, percentiles)
+    columns = [f"p{percentile:g}" for percentile in percentiles]
+    return pd.DataFrame(values, index=minutes, columns=columns)
+
+
+def parse_percentiles(percentiles: bool | Sequence[float] | None) -> tuple[float, ...]:
+    """
+    Validates the percentiles requested for a metric, where True stands for DEFAULT_PERCENTILES.
+
+    Returns:
+        tuple: The percentiles, or an empty tuple if none are requested.
+
+    Raises:
+        ValueError: If a percentile is not a number between 0 and 100.
+    """
+    if percentiles is None or percentiles is False:
+        return ()
+    if percentiles is True:
+        return DEFAULT_PERCENTILES
+    try:
+        parsed = tuple(float(percentile) for percentile in percentiles)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid percentiles '{percentiles}', expected a list of numbers between 0 and 100.")
+    if not parsed or any(not 0 <= percentile <= 100 for percentile in parsed):
+        raise ValueError(f"Invalid percentiles '{percentiles}', expected a list of numbers between 0 and 100.")
+    return parsed
+
+
+def heatmap_dataframe(
+    time_series: Iterable[TimeSeries], start_time: datetime, end_time: datetime, period_seconds: int = 60
+) -> pd.DataFrame:
+    """
+    Builds a dense time x bucket heatmap from distribution time series, merging all labels.
+
+    Every period of the interval (start_time, end_time] has a row, also when there is no point in it, and every
+    bucket has a column labelled by its lower edge (see `bucket_lower_edges`).
+
+    Args:
+        time_series (Iterable[TimeSeries]): Time series with distribution values, e.g. a Query.
+        start_time (datetime): The start of the interval, timezone-aware.
+        end_time (datetime): The end of the interval, timezone-aware.
+        period_seconds (int): The length of a row, aligned to the epoch.
+
+    Returns:
+        pd.DataFrame: The int64 bucket counts, indexed by period (naive UTC).
+    """
+    periods, histograms, bounds = merge_histograms(time_series, period_seconds)
+    period_ns = period_seconds * 1_000_000_000
+    first = pd.Timestamp(start_time).value // period_ns
+    last = pd.Timestamp(end_time).value // period_ns
+
+    heatmap = np.zeros((last - first + 1, histograms.shape[1]), dtype="int64")
+    rows = periods.asi8 // period_ns - first
+    in_window = (rows >= 0) & (rows < len(heatmap))
+    heatmap[rows[in_window]] = histograms[in_window]
+
+    index = pd.DatetimeIndex((first + np.arange(len(heatmap))) * period_ns)
+    return pd.DataFrame(heatmap, index=index, columns=pd.Index(bucket_lower_edges(bounds), name="bucket"))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# LTTB keeps the first and the last point, and at least one point in between
+MIN_POINTS = 3
+
+
+def parse_max_points(max_points: int | str | None) -> int | None:
+    """
+    Validates the maximum number of rows requested for a metric frame.
+
+    Returns:
+        int | None: The number of rows, or None if no maximum is given.
+
+    Raises:
+        ValueError: If max_points is not a whole number of at least MIN_POINTS.
+    """
+    if max_points is None or max_points == "":
+        return None
+    if isinstance(max_points, bool) or not str(max_points).strip().isdigit() or int(max_points) < MIN_POINTS:
+        raise ValueError(f"Invalid max_points '{max_points}', expected a whole number of at least {MIN_POINTS}.")
+    return int(max_points)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Selects the rows to keep with Largest-Triangle-Three-Buckets.
+
+    The points between the first and the last one are split into max_points - 2 buckets, and in every bucket the
+    point forming the largest triangle with the average of the previous bucket and the average of the next bucket is
+    kept. Using the previous average rather than the previously selected point, as the original algorithm does,
+    removes the dependency between buckets, so that every bucket is computed at once. With several columns, the
+    areas are divided by the range of their column and the largest one decides, so a peak in any column is kept.
+
+    Args:
+        x (np.ndarray): The position of every point, increasing, shape (n,).
+        y (np.ndarray): The float64 values of every point, shape (n, columns).
+        max_points (int): The number of points to keep, at least MIN_POINTS.
+
+    Returns:
+        np.ndarray: The increasing positions of the rows to keep, all of them if there are at most max_points.
+    """
+    num_points = len(x)
+    if num_points <= max_points:
+        return np.arange(num_points)
+    num_buckets = max_points - 2
+    inner_x, inner_y = x[1:-1], y[1:-1]
+    # Bucket b holds the inner points [edges[b], edges[b + 1]), the sizes differ by one at most
+    edges = np.arange(num_buckets + 1) * (num_points - 2) // num_buckets
+    sizes = np.diff(edges)
+    bucket_of = np.repeat(np.arange(num_buckets), sizes)
+
+    # The anchors: the first point, the average of every bucket, and the last point
+    anchor_x = np.concatenate([x[:1], np.add.reduceat(inner_x, edges[:-1]) / sizes, x[-1:]])
+    anchor_y = np.concatenate([y[:1], np.add.reduceat(inner_y, edges[:-1], axis=0) / sizes[:, None], y[-1:]])
+    previous_x, previous_y = anchor_x[bucket_of], anchor_y[bucket_of]
+    next_x, next_y = anchor_x[bucket_of + 2], anchor_y[bucket_of + 2]
+
+    # Twice the area of the triangle (previous average, point, next average), per column
+    base_x, rise_x = (previous_x - next_x)[:, None], (previous_x - inner_x)[:, None]
+    areas = np.abs(base_x * (inner_y - previous_y) - rise_x * (next_y - previous_y))
+    ranges = np.ptp(y, axis=0)
+    scores = (areas / np.where(ranges > 0, ranges, 1.0)).max(axis=1)
+
+    # The largest score of every bucket, from a (buckets x largest bucket size) grid padded with -1
+    grid = np.full((num_buckets, int(sizes.max())), -1.0)
+    grid[bucket_of, np.arange(len(inner_x)) - edges[bucket_of]] = scores
+    selected = edges[:-1] + grid.argmax(axis=1) + 1
+    return np.concatenate([[0], selected, [num_points - 1]])
+
+
+def downsample(df: pd.DataFrame, max_points: int | None) -> pd.DataFrame:
+    """
+    Reduces a metric frame to at most max_points rows for plotting, see `lttb_indices`.
+
+    The rows kept are rows of the frame, with the values of every label and their dtypes, so peaks keep their exact
+    value and time. Frames with at most max_points rows are returned unchanged.
+    """
+    if max_points is None or len(df) <= max_points or df.columns.empty:
+        return df
+    timestamps = df.index.asi8
+    x = (timestamps - timestamps[0]) / 1e9
+    rows = lttb_indices(x, df.to_numpy(dtype="float64"), max_points)
+    return df.iloc[rows]
@@ -0,0 +1,99 @@
+import os
+import threading
+from typing import Callable, TypeVar
+
+from google.api_core.client_options import ClientOptions
+from google.cloud import run_v2
+from google.cloud.monitoring_v3 import MetricServiceAsyncClient, MetricServiceClient
+
+ClientT = TypeVar("ClientT")
+
+_clients: dict[tuple, object] = {}
+_clients_lock = threading.Lock()
+
+
+def get_metric_client() -> MetricServiceClient:
+    """
+    Returns the process-wide Cloud Monitoring client for the current credentials and endpoint.
+
+    The client is created on first use and its gRPC channel is reused by every later call.
+
+    Note:
+        The endpoint can be overridden with the 'MONITORING_API_ENDPOINT' environment variable.
+    """
+    return _get_client("monitoring", MetricServiceClient, os.getenv("MONITORING_API_ENDPOINT"))
+
+
+def get_metric_async_client() -> MetricServiceAsyncClient:
+    """
+    Returns the process-wide asyncio Cloud Monitoring client for the current credentials and endpoint.
+
+    The client's channel is bound to the event loop it is created on, so it must only be requested from the shared
+    Monitoring loop of `util.async_monitoring`.
+
+    Note:
+        The endpoint can be overridden with the 'MONITORING_API_ENDPOINT' environment variable.
+    """
+    return _get_client("monitoring_async", MetricServiceAsyncClient, os.getenv("MONITORING_API_ENDPOINT"))
+
+
+def get_services_client() -> run_v2.ServicesClient:
+    """
+    Returns the process-wide Cloud Run services client for the current credentials and endpoint.
+
+    The client is created on first use and its gRPC channel is reused by every later call.
+
+    Note:
+        The endpoint can be overridden with the 'RUN_API_ENDPOINT' environment variable.
+    """
+    return _get_client("run", run_v2.ServicesClient, os.getenv("RUN_API_ENDPOINT"))
+
+
+def reset_clients() -> None:
+    """
+    Drops every cached client, so that the next call creates new ones with freshly discovered credentials.
+    """
+    with _clients_lock:
+        _clients.clear()
+
+
+def _credentials_key() -> tuple[str | None, float | None]:
+    """
+    Identifies the credentials a new client would discover.
+
+    The key contains the 'GOOGLE_APPLICATION_CREDENTIALS' path and the modification time of that file, so that
+    rotating the key file or pointing the variable somewhere else results in a new client.
+    """
+    path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if not path:
+        return None, None
+    try:
+        return path, os.path.getmtime(path)
+    except OSError:
+        return path, None
+
+
+def _get_client(api: str, factory: Callable[..., ClientT], endpoint: str | None) -> ClientT:
+    key = (api, _credentials_key(), endpoint)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client_options = ClientOptions(api_endpoint=endpoint) if endpoint else None
+            client = factory(client_options=client_options)
+            # Clients of the same API created for outdated credentials or endpoints are no longer needed
+            for stale_key in [k for k in _clients if k[0] == api]:
+                del _clients[stale_key]
+            _clients[key] = client
+        return client  # type: ignore
+
+
+def _reset_after_fork() -> None:
+    # gRPC channels must not be shared with a forked child, and the lock may have been held by another thread of
+    # the parent at fork time, so the child starts with a fresh lock and without clients
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
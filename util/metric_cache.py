@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+import pandas as pd
+
+
+class MetricCache:
+    """
+    A thread-safe in-process cache for metric DataFrames with TTL expiry and LRU eviction.
+
+    Entries expire `ttl` seconds after they are stored, unless another ttl is given for them, e.g. `math.inf` for
+    data that cannot change anymore. When either `max_entries` or `max_bytes` would be exceeded,
+    the least recently used entries are evicted first. Hits, misses and evictions are counted so the cache
+    effectiveness can be observed at runtime.
+
+    Args:
+        ttl (float): The number of seconds an entry stays valid. A value of 0 or less disables caching.
+        max_entries (int): The maximum number of entries kept in the cache.
+        max_bytes (int): The maximum total memory, in bytes, of the cached DataFrames.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 256, max_bytes: int = 256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[float, int, pd.DataFrame]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> pd.DataFrame | None:
+        """
+        Returns a copy of the cached DataFrame for `key`, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2].copy()
+
+    def put(self, key: Hashable, df: pd.DataFrame, ttl: float | None = None) -> None:
+        """
+        Stores a copy of `df` under `key` for `ttl` seconds (the cache ttl by default), evicting least recently used
+        entries to stay within the limits.
+        """
+        if self.ttl <= 0:
+            return
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), size, df.copy())
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the cache. The counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the cache counters and current usage.
+
+        Returns:
+            dict: Example: {'hits': 10, 'misses': 2, 'evictions': 0, 'entries': 2, 'bytes': 20480}.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
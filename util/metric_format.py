@@ -0,0 +1,313 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+from pandas.io.json import ujson_dumps
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover
+    pa = None
+
+FORMATS = ("json", "columnar")
+
+JSON_MIMETYPE = "application/json"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_MIMETYPE = "application/msgpack"
+NDJSON_MIMETYPE = "application/x-ndjson"
+SSE_MIMETYPE = "text/event-stream"
+
+
+def parse_format(response_format: str | None) -> str:
+    """
+    Validates the response format requested for a metric endpoint.
+
+    Returns:
+        str: The format, 'json' (the legacy `DataFrame.to_json` string) when none is given.
+
+    Raises:
+        ValueError: If the format is not one of FORMATS.
+    """
+    if response_format is None or response_format == "":
+        return "json"
+    if response_format not in FORMATS:
+        raise ValueError(f"Invalid format '{response_format}', expected one of {', '.join(FORMATS)}.")
+    return response_format
+
+
+def to_columnar(df: pd.DataFrame) -> dict:
+    """
+    Converts a normalized metric DataFrame into a compact columnar structure.
+
+    The timestamps are stored once, as epoch milliseconds, followed by one float array per label in the same order.
+    The arrays are NumPy arrays, so the structure is serialized with `dumps_columnar` rather than `jsonify`.
+
+    Args:
+        df (pd.DataFrame): A DataFrame returned by `get_metric`.
+
+    Returns:
+        dict: Example: {'timestamps': array([1705677240000, 1705677300000]), 'series': {'dvwa': array([0.0, 38.1])}}.
+    """
+    if df.empty and not isinstance(df.index, pd.DatetimeIndex):
+        return {"timestamps": np.empty(0, dtype="int64"), "series": {}}
+    timestamps = df.index.asi8 // 1_000_000
+    values = df.to_numpy(dtype="float64").T
+    return {"timestamps": timestamps, "series": dict(zip(map(str, df.columns), values))}
+
+
+def dumps_columnar(columnar: dict) -> str:
+    """
+    Serializes columnar structures to JSON with the C encoder of pandas, at the precision `DataFrame.to_json` uses.
+    """
+    return ujson_dumps(columnar, double_precision=10, ensure_ascii=False)
+
+
+def all_metrics_to_columnar(results: dict[str, pd.DataFrame | Exception]) -> dict[str, dict]:
+    """
+    Converts the results of `get_all_metric_frames` to the columnar structure of each DataFrame.
+
+    Returns:
+        dict: The columnar structure of every metric, or {'error': message} for a metric that could not be retrieved.
+    """
+    response = {}
+    for metric, result in results.items():
+        if isinstance(result, pd.DataFrame):
+            response[metric] = to_columnar(result)
+        else:
+            response[metric] = {"error": f"An error occurred while getting the metric '{metric}':\n{result}"}
+    return response
+
+
+def to_metric_message(metric: str, result: pd.DataFrame | Exception, response_format: str, age: float | None) -> dict:
+    """
+    Converts the result of one metric to the message sent for it by the streamed responses.
+
+    Args:
+        metric (str): The name of the metric.
+        result (pd.DataFrame | Exception): The DataFrame of the metric, or the exception raised while getting it.
+        response_format (str): 'json' for the `DataFrame.to_json` string as 'data', or 'columnar' for the columnar
+                               structure, see `parse_format`.
+        age (float | None): The age of the data in seconds, see `get_metric_age`.
+
+    Returns:
+        dict: Example: {'metric': 'request_count', 'age': 12.0, 'data': {'timestamps': [...], 'series': {...}}}, or
+              {'metric': 'request_count', 'error': 'An error occurred ...'}.
+    """
+    if not isinstance(result, pd.DataFrame):
+        return {"metric": metric, "error": f"An error occurred while getting the metric '{metric}':\n{result}"}
+    if response_format == "columnar":
+        return {"metric": metric, "age": age, "data": to_columnar(result)}
+    return {"metric": metric, "age": age, "data": result.to_json()}
+
+
+def to_ndjson_line(metric: str, result: pd.DataFrame | Exception, response_format: str, age: float | None) -> str:
+    """
+    Converts one result of `iter_all_metric_frames` to a line of a streamed NDJSON response, see `to_metric_message`.
+    """
+    return dumps_columnar(to_metric_message(metric, result, response_format, age)) + "\n"
+
+
+def to_sse_event(event: str, message: dict, event_id: str | None = None) -> str:
+    """
+    Converts a message to a Server-Sent Event, e.g. 'event: rows', 'id: ...' and 'data: {...}' lines and a blank line.
+    """
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {dumps_columnar(message)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def binary_mimetypes() -> list[str]:
+    """
+    Returns the binary response mimetypes whose encoder is installed ('pyarrow' and 'msgpack' are optional).
+    """
+    mimetypes = []
+    if pa is not None:
+        mimetypes.append(ARROW_MIMETYPE)
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    return mimetypes
+
+
+def to_arrow(df: pd.DataFrame) -> bytes:
+    """
+    Encodes a normalized metric DataFrame as an Arrow IPC stream.
+
+    The table has a 'timestamp' column (millisecond timestamps, UTC) followed by one float64 column per label. The
+    float columns are handed to Arrow without copying.
+    """
+    columns = {"timestamp": _timestamps_ms(df).astype("datetime64[ms]")}
+    for label, values in zip(map(str, df.columns), df.to_numpy(dtype="float64").T):
+        columns[label] = values
+    return _write_arrow_stream(pa.table(columns))
+
+
+def all_metrics_to_arrow(results: dict[str, pd.DataFrame | Exception]) -> bytes:
+    """
+    Encodes the results of `get_all_metric_frames` as one Arrow IPC stream in long format.
+
+    Since the metrics have different labels, the table has the columns 'metric', 'label' (both dictionary-encoded),
+    'timestamp' and 'value'. Error messages of metrics that could not be retrieved are stored as JSON in the
+    'errors' entry of the schema metadata.
+    """
+    tables = []
+    errors = {}
+    for metric, result in results.items():
+        if not isinstance(result, pd.DataFrame):
+            errors[metric] = f"An error occurred while getting the metric '{metric}':\n{result}"
+            continue
+        values = result.to_numpy(dtype="float64")
+        labels = np.repeat(np.asarray(list(map(str, result.columns)), dtype=object), len(result))
+        tables.append(
+            pa.table(
+                {
+                    "metric": pa.array(np.full(values.size, metric, dtype=object)).dictionary_encode(),
+                    "label": pa.array(labels).dictionary_encode(),
+                    "timestamp": np.tile(_timestamps_ms(result), values.shape[1]).astype("datetime64[ms]"),
+                    "value": values.ravel(order="F"),
+                }
+            )
+        )
+    schema = pa.schema(
+        [
+            ("metric", pa.dictionary(pa.int32(), pa.string())),
+            ("label", pa.dictionary(pa.int32(), pa.string())),
+            ("timestamp", pa.timestamp("ms")),
+            ("value", pa.float64()),
+        ],
+        metadata={"errors": ujson_dumps(errors)},
+    )
+    table = pa.concat_tables([table.cast(schema) for table in tables]) if tables else schema.empty_table()
+    return _write_arrow_stream(table.replace_schema_metadata(schema.metadata))
+
+
+def to_msgpack(df: pd.DataFrame) -> bytes:
+    """
+    Encodes a normalized metric DataFrame as MessagePack, in the columnar layout of `to_columnar`.
+
+    The arrays are stored as raw little-endian buffers ('timestamps' int64 epoch milliseconds, one float64 buffer
+    per label in 'series'), which clients can map without parsing, e.g. with `numpy.frombuffer`.
+    """
+    return msgpack.packb(_columnar_buffers(df))
+
+
+def all_metrics_to_msgpack(results: dict[str, pd.DataFrame | Exception]) -> bytes:
+    """
+    Encodes the results of `get_all_metric_frames` as MessagePack, with the layout of `to_msgpack` per metric or
+    {'error': message} for a metric that could not be retrieved.
+    """
+    response = {}
+    for metric, result in results.items():
+        if isinstance(result, pd.DataFrame):
+            response[metric] = _columnar_buffers(result)
+        else:
+            response[metric] = {"error": f"An error occurred while getting the metric '{metric}':\n{result}"}
+    return msgpack.packb(response)
+
+
+def to_heatmap(df: pd.DataFrame) -> dict:
+    """
+    Converts a heatmap returned by `get_metric_heatmap` into a dense structure for `dumps_columnar`.
+
+    Returns:
+        dict: 'timestamps' (epoch milliseconds, one per row), 'buckets' (the lower edge of every bucket) and
+              'counts', the int64 matrix of rows x buckets.
+    """
+    return {
+        "timestamps": _timestamps_ms(df),
+        "buckets": df.columns.to_numpy(dtype="float64"),
+        "counts": df.to_numpy(dtype="int64"),
+    }
+
+
+def heatmap_to_msgpack(df: pd.DataFrame) -> bytes:
+    """
+    Encodes a heatmap as MessagePack: the arrays of `to_heatmap` as raw little-endian buffers ('counts' in row-major
+    order) and its 'shape' as [rows, buckets].
+    """
+    heatmap = to_heatmap(df)
+    return msgpack.packb(
+        {
+            "timestamps": heatmap["timestamps"].astype("<i8").tobytes(),
+            "buckets": heatmap["buckets"].astype("<f8").tobytes(),
+            "counts": np.ascontiguousarray(heatmap["counts"], dtype="<i8").tobytes(),
+            "shape": list(heatmap["counts"].shape),
+        }
+    )
+
+
+def encode_binary(df: pd.DataFrame, mimetype: str) -> bytes:
+    """
+    Encodes a normalized metric DataFrame with the binary encoder of `mimetype` (see `binary_mimetypes`).
+    """
+    return {ARROW_MIMETYPE: to_arrow, MSGPACK_MIMETYPE: to_msgpack}[mimetype](df)
+
+
+def encode_all_binary(results: dict[str, pd.DataFrame | Exception], mimetype: str) -> bytes:
+    """
+    Encodes the results of `get_all_metric_frames` with the binary encoder of `mimetype` (see `binary_mimetypes`).
+    """
+    return {ARROW_MIMETYPE: all_metrics_to_arrow, MSGPACK_MIMETYPE: all_metrics_to_msgpack}[mimetype](results)
+
+
+def frames_etag(results: dict[str, pd.DataFrame | Exception], *variant: str) -> str:
+    """
+    Returns a strong ETag for the response of metric frames, computed from a hash of their index, values, labels
+    and dtypes rather than from the encoded body, so an unchanged poll can be answered before encoding anything.
+
+    Args:
+        results (dict): The frame, or the exception raised while getting it, of every metric in the response.
+        *variant (str): What else decides the body, e.g. the format or the mimetype of the encoding.
+
+    Returns:
+        str: The first 32 hex digits of the digest, without quotes.
+    """
+    digest = hashlib.sha256()
+    for part in variant:
+        digest.update(f"{part}\0".encode())
+    for metric, result in results.items():
+        digest.update(f"{metric}\0".encode())
+        if isinstance(result, pd.DataFrame):
+            dtypes = list(result.dtypes)
+            digest.update(repr((list(map(str, result.columns)), list(map(str, dtypes)), result.shape)).encode())
+            # A frame of one dtype is one block, the others are hashed column by column
+            if len(set(dtypes)) <= 1:
+                values = [result.to_numpy()]
+            else:
+                values = [result[column].to_numpy() for column in result.columns]
+            for array in (result.index.to_numpy(), *values):
+                # The raw buffers of numeric arrays are hashed as they are, other ones through pandas
+                if array.dtype.kind in "biufcmM":
+                    digest.update(np.ascontiguousarray(array).tobytes())
+                else:
+                    digest.update(pd.util.hash_array(array).tobytes())
+        else:
+            digest.update(f"{type(result).__name__}: {result}".encode())
+    return digest.hexdigest()[:32]
+
+
+def _timestamps_ms(df: pd.DataFrame) -> np.ndarray:
+    if not isinstance(df.index, pd.DatetimeIndex):
+        return np.empty(0, dtype="int64")
+    return df.index.asi8 // 1_000_000
+
+
+def _columnar_buffers(df: pd.DataFrame) -> dict:
+    columnar = to_columnar(df)
+    return {
+        "timestamps": columnar["timestamps"].astype("<i8").tobytes(),
+        "series": {label: values.astype("<f8").tobytes() for label, values in columnar["series"].items()},
+    }
+
+
+def _write_arrow_stream(table: "pa.Table") -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
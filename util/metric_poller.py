@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+import pandas as pd
+
+
+class MetricPoller:
+    """
+    Keeps a fixed window of every metric warm in memory by refreshing it from a background thread.
+
+    Every metric is refreshed on its own schedule of `interval` seconds, randomized by `jitter` so that several
+    processes do not hit Cloud Monitoring in lockstep. After a failed refresh the delay doubles per consecutive
+    failure, up to `max_backoff` seconds, while the last good frame keeps being served.
+
+    Args:
+        fetch (Callable): Fetches a metric, called as `fetch(metric, minutes=window_minutes)`.
+        metrics (Iterable[str]): The metrics to keep warm.
+        window (timedelta): The window kept in memory. Requests for longer windows are not served by the poller.
+        interval (float): The number of seconds between two refreshes of a metric.
+        jitter (float): The maximum relative deviation applied to every delay, e.g. 0.1 for +/-10%.
+        max_backoff (float): The maximum delay, in seconds, after consecutive failures.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[..., pd.DataFrame],
+        metrics: Iterable[str],
+        window: timedelta = timedelta(days=1),
+        interval: float = 60.0,
+        jitter: float = 0.1,
+        max_backoff: float = 900.0,
+    ):
+        self.fetch = fetch
+        self.metrics = list(metrics)
+        self.window = window
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self._frames: dict[str, pd.DataFrame] = {}
+        self._failures: dict[str, int] = {metric: 0 for metric in self.metrics}
+        self._errors: dict[str, str] = {}
+        self._next_refresh: dict[str, float] = {metric: 0.0 for metric in self.metrics}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """
+        Starts the background thread, if it is not running yet.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metric-poller", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread after its current refresh.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get(self, metric: str, window: timedelta) -> pd.DataFrame | None:
+        """
+        Returns a copy of the last `window` of a metric, or None if the poller cannot serve it.
+
+        The frame keeps the 'fetched_at' attribute of the refresh it comes from, so callers can report its age.
+        """
+        if window > self.window:
+            return None
+        with self._lock:
+            df = self._frames.get(metric)
+        if df is None:
+            return None
+        window_start = (pd.Timestamp(datetime.utcnow()) - window).floor("min")
+        result = df[df.index >= window_start].copy()
+        result.attrs = dict(df.attrs)
+        return result
+
+    def refresh(self, metric: str) -> None:
+        """
+        Fetches a metric now and schedules its next refresh, with a backoff if the fetch failed.
+        """
+        window_minutes = int(self.window.total_seconds() // 60)
+        try:
+            df = self.fetch(metric, minutes=window_minutes)
+        except Exception as e:
+            with self._lock:
+                self._failures[metric] += 1
+                self._errors[metric] = f"{type(e).__name__}: {e}"
+                delay = min(self.interval * 2 ** self._failures[metric], self.max_backoff)
+                self._next_refresh[metric] = time.monotonic() + self._jittered(delay)
+            print(f"An error occurred while polling the metric '{metric}':\n{e}")
+            return
+        with self._lock:
+            self._frames[metric] = df
+            self._failures[metric] = 0
+            self._errors.pop(metric, None)
+            self._next_refresh[metric] = time.monotonic() + self._jittered(self.interval)
+
+    def status(self) -> dict[str, dict]:
+        """
+        Returns, per metric, the time of the last successful refresh, the consecutive failures and the last error.
+        """
+        with self._lock:
+            return {
+                metric: {
+                    "fetched_at": self._frames[metric].attrs.get("fetched_at") if metric in self._frames else None,
+                    "failures": self._failures[metric],
+                    "error": self._errors.get(metric),
+                }
+                for metric in self.metrics
+            }
+
+    def _jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for metric in self.metrics:
+                if self._stop.is_set():
+                    return
+                if self._next_refresh[metric] <= now:
+                    self.refresh(metric)
+            with self._lock:
+                next_refresh = min(self._next_refresh.values())
+            self._stop.wait(max(next_refresh - time.monotonic(), 0.1))
@@ -0,0 +1,162 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# The rollup tiers, as bucket lengths in seconds: 1 minute (the raw data), 5 minutes and 1 hour
+TIERS = (60, 300, 3600)
+ROLLUP_AGGREGATIONS = ("sum", "mean", "max")
+
+
+def plan_tier(window: timedelta, points: int) -> int:
+    """
+    Picks the coarsest tier that still gives at least `points` buckets over the window.
+
+    Returns:
+        int: The bucket length in seconds, 60 (the raw minutes) if no coarser tier has enough buckets.
+
+    Raises:
+        ValueError: If points is not a positive integer.
+    """
+    if isinstance(points, bool) or not isinstance(points, int) or points <= 0:
+        raise ValueError(f"Invalid points '{points}', expected a positive integer.")
+    window_seconds = window.total_seconds()
+    return max((tier for tier in TIERS if window_seconds / tier >= points), default=TIERS[0])
+
+
+def rollup(df: pd.DataFrame, seconds: int, aggregation: str) -> pd.DataFrame:
+    """
+    Aggregates the minutes of a normalized metric frame into buckets of `seconds`, labelled by their start.
+
+    Args:
+        df (pd.DataFrame): A frame returned by `get_metric`, sorted by time.
+        seconds (int): The bucket length, a multiple of 60.
+        aggregation (str): 'sum', 'mean' or 'max' of the minutes with data in every bucket. The minute frames hold
+                           0.0 where a label had no data, so the mean leaves zero cells out of the sum and the divisor
+                           (a mean latency of exactly 0 is not a measurement).
+
+    Returns:
+        pd.DataFrame: One row per bucket with data, with the columns of df.
+    """
+    if not len(df):
+        return df
+    bucket_ns = seconds * 1_000_000_000
+    buckets, starts = np.unique(df.index.asi8 // bucket_ns, return_index=True)
+    values = df.to_numpy()
+    match aggregation:
+        case "sum":
+            result = np.add.reduceat(values, starts, axis=0)
+        case "max":
+            result = np.maximum.reduceat(values, starts, axis=0)
+        case "mean":
+            sums = np.add.reduceat(values.astype("float64"), starts, axis=0)
+            sizes = np.add.reduceat((values != 0).astype("float64"), starts, axis=0)
+            result = np.divide(sums, sizes, out=np.zeros_like(sums), where=sizes > 0)
+        case _:
+            raise ValueError(f"Invalid aggregation '{aggregation}', expected one of {', '.join(ROLLUP_AGGREGATIONS)}.")
+    return pd.DataFrame(result, index=pd.DatetimeIndex(buckets * bucket_ns), columns=df.columns)
+
+
+class RollupStore:
+    """
+    Keeps the coarser tiers of every metric, maintained incrementally from the minute frames `get_metric` produces.
+
+    For every key (metric, project and service) and tier, the buckets of one contiguous range are kept: frames that
+    overlap or touch the range extend it, the buckets they cover are recomputed, and a frame that does not is kept
+    instead when it is newer. Only complete buckets are stored, i.e. buckets starting after the start of the window
+    of the frame and ending before its `settled_time`, after which Cloud Monitoring may still add late points.
+
+    Args:
+        tiers (tuple[int, ...]): The bucket lengths, in seconds, kept for every key.
+        retention (timedelta): The age after which buckets are dropped.
+    """
+
+    def __init__(self, tiers: tuple[int, ...] = TIERS[1:], retention: timedelta = timedelta(days=35)):
+        self.tiers = tiers
+        self.retention = retention
+        # (key, tier) -> (frame of the buckets, first bucket, end bucket), buckets counted from the epoch
+        self._ranges: dict[tuple, tuple[pd.DataFrame, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def update(
+        self, key: tuple, df: pd.DataFrame, aggregation: str, window_start: datetime, settled_time: datetime
+    ) -> None:
+        """
+        Rolls the minutes of a frame covering the window from `window_start` up into every tier.
+
+        Args:
+            key (tuple): The metric, project and service of the frame.
+            df (pd.DataFrame): A normalized frame of raw minutes with all the data of its window.
+            aggregation (str): How the minutes of a bucket are combined, see `rollup`.
+            window_start (datetime): The start of the window of the frame.
+            settled_time (datetime): The time before which the minutes of the frame are final.
+        """
+        window_start_ns = pd.Timestamp(window_start).value
+        settled_ns = pd.Timestamp(settled_time).value
+        retention_start_ns = settled_ns - int(self.retention.total_seconds() * 1_000_000_000)
+        for tier in self.tiers:
+            bucket_ns = tier * 1_000_000_000
+            # Complete buckets only: from the one after the bucket containing the window start (whose first point
+            # may be excluded, as the start of an interval is exclusive) to the last one ending before settled
+            retention_first = -(-retention_start_ns // bucket_ns)
+            first = max(window_start_ns // bucket_ns + 1, retention_first)
+            end = settled_ns // bucket_ns
+            if end <= first:
+                continue
+            buckets_of_rows = df.index.asi8 // bucket_ns if len(df) else np.zeros(0, dtype="int64")
+            buckets = rollup(df[(buckets_of_rows >= first) & (buckets_of_rows < end)], tier, aggregation)
+            with self._lock:
+                frame, stored_first, stored_end = self._merged(
+                    self._ranges.get((key, tier)), buckets, first, end, bucket_ns
+                )
+                if stored_first < retention_first:
+                    frame = frame[frame.index.asi8 >= retention_first * bucket_ns]
+                    stored_first = retention_first
+                self._ranges[(key, tier)] = (frame, stored_first, stored_end)
+
+    def get(self, key: tuple, tier: int, window_start: datetime) -> tuple[pd.DataFrame, datetime] | None:
+        """
+        Returns the stored buckets of a tier after the bucket containing `window_start`, and the end of the range.
+
+        Returns:
+            tuple | None: The buckets and the time up to which they cover the data, or None if the stored range does
+                          not reach back to `window_start`.
+        """
+        with self._lock:
+            stored = self._ranges.get((key, tier))
+        if stored is None:
+            return None
+        frame, first, end = stored
+        bucket_ns = tier * 1_000_000_000
+        first_bucket = pd.Timestamp(window_start).value // bucket_ns + 1
+        if first_bucket < first or first_bucket >= end:
+            return None
+        buckets = frame[frame.index.asi8 >= first_bucket * bucket_ns]
+        return buckets, datetime.fromtimestamp(end * tier, tz=pd.Timestamp(window_start).tzinfo)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ranges.clear()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the number of stored ranges and buckets.
+        """
+        with self._lock:
+            return {"ranges": len(self._ranges), "buckets": sum(len(frame) for frame, _, _ in self._ranges.values())}
+
+    @staticmethod
+    def _merged(
+        stored: tuple[pd.DataFrame, int, int] | None, buckets: pd.DataFrame, first: int, end: int, bucket_ns: int
+    ) -> tuple[pd.DataFrame, int, int]:
+        if stored is None or first > stored[2]:
+            # Nothing stored yet, or a newer range that does not touch the stored one
+            return buckets, first, end
+        frame, stored_first, stored_end = stored
+        if end < stored_first:
+            return stored
+        # The buckets of [first, end) are replaced, including the ones that have no data anymore
+        outside = (frame.index.asi8 < first * bucket_ns) | (frame.index.asi8 >= end * bucket_ns)
+        merged = pd.concat([frame[outside], buckets]).fillna(0.0).sort_index(axis=0).sort_index(axis=1)
+        return merged, min(first, stored_first), max(end, stored_end)
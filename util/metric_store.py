@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+MINUTES_PER_CHUNK = 1440
+
+# (metric, project_id, service_name)
+SeriesKey = tuple[str, str, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_chunks (
+    metric TEXT NOT NULL,
+    project_id TEXT NOT NULL,
+    service_name TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    minute_values BLOB NOT NULL,
+    dtype TEXT NOT NULL DEFAULT 'float64',
+    PRIMARY KEY (metric, project_id, service_name, chunk, label)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metric_coverage (
+    metric TEXT NOT NULL,
+    project_id TEXT NOT NULL,
+    service_name TEXT NOT NULL,
+    first_minute INTEGER NOT NULL,
+    end_minute INTEGER NOT NULL,
+    PRIMARY KEY (metric, project_id, service_name, first_minute)
+) WITHOUT ROWID;
+"""
+
+
+class MetricStore:
+    """
+    Persists normalized metric values in SQLite, so that minutes fetched once are answered locally afterwards.
+
+    The values of every metric, project, service and label are stored in columnar chunks of one day: a blob of
+    MINUTES_PER_CHUNK float64 values indexed by minute, NaN where the minute had no point. The primary key puts the
+    chunk before the label, so a window of every label is a single range scan that reads a few blobs per day. The
+    ranges of minutes that were fetched are recorded separately, which tells a minute without points from a minute
+    that was never fetched. Only minutes that cannot change anymore should be written. The dtype of the frames
+    written is kept with every chunk, so that integer metrics are read back as int64.
+
+    Several processes may share the database: a write reads and replaces its chunks in one IMMEDIATE transaction, so
+    concurrent writers of the same chunk cannot lose each other's minutes.
+
+    Args:
+        path (str): The path of the SQLite database, created on first use.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def missing(self, key: SeriesKey, first_minute: int, end_minute: int) -> list[tuple[int, int]]:
+        """
+        Returns the ranges [first, end) of epoch minutes in [first_minute, end_minute) that were never written.
+        """
+        with self._lock:
+            covered = self._connect().execute(
+                "SELECT first_minute, end_minute FROM metric_coverage"
+                " WHERE metric = ? AND project_id = ? AND service_name = ? AND end_minute > ? AND first_minute < ?"
+                " ORDER BY first_minute",
+                (*key, first_minute, end_minute),
+            )
+            gaps = []
+            position = first_minute
+            for covered_first, covered_end in covered:
+                if covered_first > position:
+                    gaps.append((position, covered_first))
+                position = max(position, covered_end)
+            if position < end_minute:
+                gaps.append((position, end_minute))
+            return gaps
+
+    def read(self, key: SeriesKey, first_minute: int, end_minute: int) -> pd.DataFrame:
+        """
+        Returns the stored values of the epoch minutes in [first_minute, end_minute), one row per minute with values
+        and one column per label, with missing labels filled with 0.0 like `MinuteAggregator` does. The frame is
+        int64 when only int64 frames were written to the chunks read and no label is missing from a row.
+        """
+        first_chunk = first_minute // MINUTES_PER_CHUNK
+        with self._lock:
+            chunks = self._connect().execute(
+                "SELECT chunk, label, minute_values, dtype FROM metric_chunks"
+                " WHERE metric = ? AND project_id = ? AND service_name = ? AND chunk >= ? AND chunk <= ?",
+                (*key, first_chunk, (end_minute - 1) // MINUTES_PER_CHUNK),
+            ).fetchall()
+        labels = sorted({label for _, label, _, _ in chunks})
+        columns = {label: position for position, label in enumerate(labels)}
+        num_chunks = max(0, (end_minute - 1) // MINUTES_PER_CHUNK - first_chunk + 1)
+        grid = np.full((num_chunks * MINUTES_PER_CHUNK, len(labels)), np.nan)
+        for chunk, label, minute_values, _ in chunks:
+            offset = (chunk - first_chunk) * MINUTES_PER_CHUNK
+            grid[offset : offset + MINUTES_PER_CHUNK, columns[label]] = np.frombuffer(minute_values, dtype="<f8")
+
+        start = first_minute - first_chunk * MINUTES_PER_CHUNK
+        grid = grid[start : start + max(end_minute - first_minute, 0)]
+        rows = np.flatnonzero(~np.isnan(grid).all(axis=1)) if len(labels) else np.zeros(0, dtype="int64")
+        index = pd.DatetimeIndex((first_minute + rows) * NANOSECONDS_PER_MINUTE)
+        values = grid[rows]
+        if chunks and all(dtype == "int64" for _, _, _, dtype in chunks) and not np.isnan(values).any():
+            values = values.astype("int64")
+        else:
+            values = np.nan_to_num(values, nan=0.0)
+        return pd.DataFrame(values, index=index, columns=pd.Index(labels, dtype=object))
+
+    def write(self, key: SeriesKey, df: pd.DataFrame, first_minute: int, end_minute: int) -> None:
+        """
+        Stores the rows of a normalized frame in the epoch minutes [first_minute, end_minute) and records the range
+        as fetched.
+        """
+        minutes = df.index.asi8 // NANOSECONDS_PER_MINUTE if len(df) else np.zeros(0, dtype="int64")
+        in_range = (minutes >= first_minute) & (minutes < end_minute)
+        minutes = minutes[in_range]
+        values = df.to_numpy(dtype="float64")[in_range] if len(df.columns) else np.zeros((len(minutes), 0))
+        chunks = minutes // MINUTES_PER_CHUNK
+
+        dtypes = ["int64" if dtype == "int64" else "float64" for dtype in df.dtypes.astype(str)]
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                # Takes the write lock before reading the chunks, which another process may be replacing
+                connection.execute("BEGIN IMMEDIATE")
+                for chunk in np.unique(chunks).tolist():
+                    in_chunk = chunks == chunk
+                    offsets = minutes[in_chunk] - chunk * MINUTES_PER_CHUNK
+                    for column, label in enumerate(map(str, df.columns)):
+                        chunk_values, chunk_dtype = self._read_chunk(connection, key, chunk, label)
+                        chunk_values[offsets] = values[in_chunk, column]
+                        # A chunk stays int64 only while every frame written to it is
+                        dtype = dtypes[column] if chunk_dtype in (None, "int64") else chunk_dtype
+                        connection.execute(
+                            "INSERT OR REPLACE INTO metric_chunks"
+                            " (metric, project_id, service_name, chunk, label, minute_values, dtype)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (*key, chunk, label, chunk_values.astype("<f8").tobytes(), dtype),
+                        )
+                self._add_coverage(connection, key, first_minute, end_minute)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the number of stored chunks and of fetched minute ranges.
+        """
+        with self._lock:
+            connection = self._connect()
+            (chunks,) = connection.execute("SELECT COUNT(*) FROM metric_chunks").fetchone()
+            (ranges,) = connection.execute("SELECT COUNT(*) FROM metric_coverage").fetchone()
+        return {"chunks": chunks, "ranges": ranges}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL lets the workers of other processes read while one of them writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            # Databases created before the dtype was stored hold float64 chunks
+            if "dtype" not in {column[1] for column in connection.execute("PRAGMA table_info(metric_chunks)")}:
+                connection.execute("ALTER TABLE metric_chunks ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float64'")
+                connection.commit()
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _read_chunk(
+        connection: sqlite3.Connection, key: SeriesKey, chunk: int, label: str
+    ) -> tuple[np.ndarray, str | None]:
+        row = connection.execute(
+            "SELECT minute_values, dtype FROM metric_chunks"
+            " WHERE metric = ? AND project_id = ? AND service_name = ? AND chunk = ? AND label = ?",
+            (*key, chunk, label),
+        ).fetchone()
+        if row is None:
+            return np.full(MINUTES_PER_CHUNK, np.nan), None
+        return np.frombuffer(row[0], dtype="<f8").copy(), row[1]
+
+    @staticmethod
+    def _add_coverage(connection: sqlite3.Connection, key: SeriesKey, first_minute: int, end_minute: int) -> None:
+        # Merge the new range with the ranges it overlaps or touches
+        overlapping = connection.execute(
+            "SELECT first_minute, end_minute FROM metric_coverage"
+            " WHERE metric = ? AND project_id = ? AND service_name = ? AND end_minute >= ? AND first_minute <= ?",
+            (*key, first_minute, end_minute),
+        ).fetchall()
+        for covered_first, covered_end in overlapping:
+            first_minute = min(first_minute, covered_first)
+            end_minute = max(end_minute, covered_end)
+        connection.execute(
+            "DELETE FROM metric_coverage"
+            " WHERE metric = ? AND project_id = ? AND service_name = ? AND first_minute >= ? AND first_minute <= ?",
+            (*key, first_minute, end_minute),
+        )
+        connection.execute("INSERT INTO metric_coverage VALUES (?, ?, ?, ?, ?)", (*key, first_minute, end_minute))
@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Iterable
+
+import pandas as pd
+
+
+class Subscription:
+    """
+    The queue of the events pushed to one subscriber of a `MetricBroadcaster`.
+
+    Every event is a tuple ('rows', metric, DataFrame) with the new or changed minute rows of a metric, or ('error',
+    metric, message) after a failed fetch. None marks the end of the subscription.
+    """
+
+    def __init__(self, metrics: Iterable[str], max_events: int):
+        self.metrics = frozenset(metrics)
+        self.events: queue.Queue[tuple | None] = queue.Queue(maxsize=max_events)
+
+    def get(self, timeout: float) -> tuple | None:
+        """
+        Waits up to timeout seconds for the next event.
+
+        Raises:
+            queue.Empty: If no event came in time.
+        """
+        return self.events.get(timeout=timeout)
+
+
+def changed_rows(previous: pd.DataFrame | None, current: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the rows of current that are not in previous or whose values differ, e.g. a minute that filled up or
+    received late points since the previous fetch.
+    """
+    if previous is None or previous.empty:
+        return current
+    aligned = previous.reindex(index=current.index, columns=current.columns)
+    unchanged = ((aligned == current) | (aligned.isna() & current.isna())).all(axis=1)
+    return current[~unchanged.to_numpy()]
+
+
+class MetricBroadcaster:
+    """
+    Pushes the new minute rows of metrics to any number of subscribers from one shared background thread.
+
+    Every `interval` seconds, each metric with at least one subscriber is fetched once over the last `window`, and
+    the rows that are new or changed since the previous fetch are queued for every subscriber of the metric, so the
+    upstream work does not grow with the number of subscribers. A new subscriber first gets the last fetched window.
+    A metric nobody subscribed to before is fetched right away. A subscriber whose queue is full is dropped, its
+    stream ends and the client reconnects. The thread starts with the first subscriber and stops with the last one.
+
+    Args:
+        fetch (Callable): Fetches a metric, called as `fetch(metric, minutes=window_minutes)`.
+        window (timedelta): The window fetched, which also bounds how late a changed minute is still sent.
+        interval (float): The number of seconds between two fetches of a metric.
+        max_events (int): The maximum number of events queued for a subscriber.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[..., pd.DataFrame],
+        window: timedelta = timedelta(minutes=10),
+        interval: float = 30.0,
+        max_events: int = 100,
+    ):
+        self.fetch = fetch
+        self.window = window
+        self.interval = interval
+        self.max_events = max_events
+        self._subscriptions: set[Subscription] = set()
+        self._frames: dict[str, pd.DataFrame] = {}
+        self._fetches = 0
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self, metrics: Iterable[str]) -> Subscription:
+        """
+        Registers a subscriber of the given metrics, starting the background thread if it is not running.
+        """
+        subscription = Subscription(metrics, self.max_events)
+        with self._lock:
+            subscribed = set().union(*(other.metrics for other in self._subscriptions))
+            for metric in subscription.metrics:
+                if metric in self._frames:
+                    subscription.events.put_nowait(("rows", metric, self._frames[metric]))
+            self._subscriptions.add(subscription)
+            self._pending |= subscription.metrics - subscribed
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="metric-broadcaster", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Removes a subscriber. Metrics without subscribers are not fetched anymore.
+        """
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            subscribed = set().union(*(other.metrics for other in self._subscriptions))
+            for metric in set(self._frames) - subscribed:
+                del self._frames[metric]
+        self._wake.set()
+
+    def broadcast(self, metrics: Iterable[str] | None = None) -> None:
+        """
+        Fetches the given metrics, by default every subscribed one, once and queues their new or changed rows for
+        their subscribers.
+        """
+        if metrics is None:
+            with self._lock:
+                metrics = sorted(set().union(*(subscription.metrics for subscription in self._subscriptions)))
+        window_minutes = int(self.window.total_seconds() // 60)
+        for metric in metrics:
+            try:
+                df = self.fetch(metric, minutes=window_minutes)
+            except Exception as e:
+                print(f"An error occurred while fetching the metric '{metric}' for the stream:\n{e}")
+                self._publish(metric, ("error", metric, f"An error occurred while getting the metric '{metric}'"))
+                continue
+            with self._lock:
+                self._fetches += 1
+                rows = changed_rows(self._frames.get(metric), df)
+                self._frames[metric] = df
+            if not rows.empty:
+                self._publish(metric, ("rows", metric, rows))
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the number of subscribers, of metrics they subscribed to and of upstream fetches so far.
+        """
+        with self._lock:
+            metrics = set().union(*(subscription.metrics for subscription in self._subscriptions))
+            return {"subscribers": len(self._subscriptions), "metrics": len(metrics), "fetches": self._fetches}
+
+    def _publish(self, metric: str, event: tuple) -> None:
+        with self._lock:
+            subscriptions = [subscription for subscription in self._subscriptions if metric in subscription.metrics]
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                print("Dropping a metric stream subscriber that does not keep up")
+                self.unsubscribe(subscription)
+                # Makes room for the end marker, the subscriber reconnects and starts from the last window
+                with subscription.events.mutex:
+                    subscription.events.queue.clear()
+                subscription.events.put_nowait(None)
+
+    def _run(self) -> None:
+        while self._has_subscribers():
+            with self._lock:
+                self._pending.clear()
+            self.broadcast()
+            deadline = time.monotonic() + self.interval
+            # Woken early by subscribers coming and going: fetch the newly subscribed metrics, or stop
+            while self._wake.wait(max(deadline - time.monotonic(), 0)):
+                self._wake.clear()
+                if not self._has_subscribers():
+                    return
+                with self._lock:
+                    pending, self._pending = self._pending, set()
+                if pending:
+                    self.broadcast(sorted(pending))
+
+    def _has_subscribers(self) -> bool:
+        # Clears the thread while holding the lock, so that `subscribe` starts a new one if needed
+        with self._lock:
+            if not self._subscriptions:
+                self._thread = None
+                return False
+            return True
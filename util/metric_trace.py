@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+
+class MetricTrace:
+    """
+    How one metric request was served, filled in by the fetch paths of `util.system_metric` while it is the active
+    trace of the context (see `start_trace`).
+
+    Attributes:
+        cache (str | None): 'hit' (metric cache), 'poller' (background poller), 'rollup' (rollup tiers), 'shared'
+                            (joined an identical fetch in flight) or 'miss' (fetched from Cloud Monitoring).
+        upstream_seconds (float): The time spent fetching from Cloud Monitoring, decoding the pages as they arrive.
+        normalize_seconds (float): The time spent building, converting and downsampling the frame afterwards.
+    """
+
+    __slots__ = ("cache", "upstream_seconds", "normalize_seconds")
+
+    def __init__(self):
+        self.cache: str | None = None
+        self.upstream_seconds = 0.0
+        self.normalize_seconds = 0.0
+
+
+_active_trace: ContextVar[MetricTrace | None] = ContextVar("metric_trace", default=None)
+
+
+def start_trace() -> MetricTrace:
+    """
+    Makes a new trace the active one of the current context, e.g. of the task getting one metric, and returns it.
+    Tasks and `contextvars.copy_context` copies created afterwards report to the same trace.
+    """
+    trace = MetricTrace()
+    _active_trace.set(trace)
+    return trace
+
+
+def trace_cache(outcome: str) -> None:
+    """
+    Records where the active trace, if any, was served from. The first outcome recorded wins, so that an outer path
+    (e.g. the rollup tiers) is not overwritten by the nested request it makes.
+    """
+    trace = _active_trace.get()
+    if trace is not None and trace.cache is None:
+        trace.cache = outcome
+
+
+@contextmanager
+def traced(phase: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block to the 'upstream' or 'normalize' time of the active trace, if any.
+    """
+    trace = _active_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = f"{phase}_seconds"
+        setattr(trace, attribute, getattr(trace, attribute) + time.perf_counter() - started)
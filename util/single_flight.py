@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+from functools import partial
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key (the leader) runs the work, every caller arriving while it is in flight waits for
+    the leader's result or exception instead of running the work again. Threads and asyncio tasks share the same
+    flights, since waiting is done on a `concurrent.futures.Future`.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.deduplicated = 0
+        self._flights: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], T]) -> tuple[T, bool]:
+        """
+        Runs `func` unless a call with the same key is in flight, in which case its result is awaited.
+
+        Returns:
+            tuple: The result and whether it was shared with another caller (True for every caller but the leader).
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except CancelledError:
+                # The flight was abandoned by a cancelled async leader: lead or join a new one
+                continue
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._leave(key)
+        return future.result(), False
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """
+        The asyncio counterpart of `do`. `func` returns the awaitable to run when this caller is the leader.
+
+        The work runs in its own task, shielded from the callers: a leader cancelled while others wait on its flight
+        (e.g. a closed streamed response) does not cancel the work, and a cancelled waiter does not cancel the
+        flight. Only if the task itself is cancelled, e.g. with its event loop, is the flight abandoned, and its
+        waiters run or join a new one instead of receiving the cancellation.
+
+        Returns:
+            tuple: The result and whether it was shared with another caller (True for every caller but the leader).
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+        task = asyncio.ensure_future(func())
+        task.add_done_callback(partial(self._settle, key, future))
+        return await asyncio.shield(task), False
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the number of executed calls, deduplicated calls and flights currently in progress.
+        """
+        with self._lock:
+            return {"calls": self.calls, "deduplicated": self.deduplicated, "in_flight": len(self._flights)}
+
+    def _join(self, key: Hashable) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.calls += 1
+            return future, True
+
+    def _settle(self, key: Hashable, future: Future, task: asyncio.Future) -> None:
+        self._leave(key)
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def _leave(self, key: Hashable) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
@@ -1,15 +1,160 @@
 import asyncio
+import contextvars
+import math
 import os
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Iterable, NamedTuple, Sequence
 
 import pandas as pd
 import pytz
 from dotenv import load_dotenv
-from google.cloud.monitoring_v3 import MetricServiceClient
+from google.cloud.monitoring_v3 import ListTimeSeriesRequest, MetricServiceClient, TimeSeries
 from google.cloud.monitoring_v3.query import Query
 
+from util.async_monitoring import consume_time_series_pages, list_time_series, run_in_normalize_pool
+from util.distribution import heatmap_dataframe, parse_percentiles, percentiles_dataframe
+from util.downsample import downsample, parse_max_points
+from util.gcp_clients import get_metric_client
+from util.metric_cache import MetricCache
+from util.metric_poller import MetricPoller
+from util.metric_rollup import RollupStore, plan_tier, rollup
+from util.metric_stream import MetricBroadcaster
+from util.metric_trace import MetricTrace, start_trace, trace_cache, traced
+from util.metric_store import MetricStore
+from util.single_flight import SingleFlight
+from util.timeseries_decoder import MinuteAggregator
 
-def get_metric(metric: str, days: int = 0, hours: int = 0, minutes: int = 0) -> pd.DataFrame:
+# For each metric: the Cloud Monitoring metric type, the label used as column name, the server-side aggregation
+# (per-series aligner, cross-series reducer grouped by the label) that mirrors `_metric_aggregator` when a
+# resolution is requested, the value type of its points, and how its minutes are combined into rollup buckets
+METRICS_INFO: dict[str, dict[str, str]] = {
+    "request_count": {
+        "type": "run.googleapis.com/request_count",
+        "label": "response_code",
+        "group_by": "metric.label.response_code",
+        "aligner": "ALIGN_SUM",
+        "reducer": "REDUCE_SUM",
+        "value_type": "INT64",
+        "rollup": "sum",
+    },
+    "request_latencies": {
+        "type": "run.googleapis.com/request_latencies",
+        "label": "response_code",
+        "group_by": "metric.label.response_code",
+        "aligner": "ALIGN_DELTA",
+        "reducer": "REDUCE_SUM",
+        "value_type": "DISTRIBUTION",
+        "rollup": "mean",
+    },
+    "instance_count": {
+        "type": "run.googleapis.com/container/instance_count",
+        "label": "state",
+        "group_by": "metric.label.state",
+        "aligner": "ALIGN_MAX",
+        "reducer": "REDUCE_MAX",
+        "value_type": "INT64",
+        "rollup": "max",
+    },
+    "CPU_utilization": {
+        "type": "run.googleapis.com/container/cpu/utilizations",
+        "label": "service_name",
+        "group_by": "resource.label.service_name",
+        "aligner": "ALIGN_MEAN",
+        "reducer": "REDUCE_MAX",
+        "value_type": "DISTRIBUTION",
+        "rollup": "max",
+    },
+    "memory_utilization": {
+        "type": "run.googleapis.com/container/memory/utilizations",
+        "label": "service_name",
+        "group_by": "resource.label.service_name",
+        "aligner": "ALIGN_MEAN",
+        "reducer": "REDUCE_MAX",
+        "value_type": "DISTRIBUTION",
+        "rollup": "max",
+    },
+    "startup_latency": {
+        "type": "run.googleapis.com/container/startup_latencies",
+        "label": "service_name",
+        "group_by": "resource.label.service_name",
+        "aligner": "ALIGN_MEAN",
+        "reducer": "REDUCE_MAX",
+        "value_type": "DISTRIBUTION",
+        "rollup": "max",
+    },
+}
+
+load_dotenv()
+metric_cache = MetricCache(
+    ttl=float(os.getenv("METRIC_CACHE_TTL", default="60")),
+    max_entries=int(os.getenv("METRIC_CACHE_MAX_ENTRIES", default="256")),
+    max_bytes=int(os.getenv("METRIC_CACHE_MAX_BYTES", default=str(256 * 1024 * 1024))),
+)
+# Last normalized frame per (metric, project, service, window), used as the base of incremental fetches
+incremental_frames = MetricCache(
+    ttl=float(os.getenv("METRIC_INCREMENTAL_TTL", default="3600")),
+    max_entries=int(os.getenv("METRIC_INCREMENTAL_MAX_ENTRIES", default="64")),
+)
+# In-flight upstream fetches by cache key, so that concurrent identical queries are only run once
+metric_flights = SingleFlight()
+INCREMENTAL_OVERLAP = timedelta(minutes=int(os.getenv("METRIC_INCREMENTAL_OVERLAP_MINUTES", default="3")))
+
+# Settled minutes of raw-resolution queries persisted across restarts, enabled with METRIC_STORE=1
+metric_store: MetricStore | None = (
+    MetricStore(os.getenv("METRIC_STORE_PATH", default="./db/metric_store.db"))
+    if os.getenv("METRIC_STORE", default="0") == "1"
+    else None
+)
+# Minutes older than this are considered final: Cloud Monitoring no longer adds late points to them
+STORE_SETTLE = timedelta(minutes=int(os.getenv("METRIC_STORE_SETTLE_MINUTES", default="5")))
+# The 5 minute and 1 hour buckets of every metric, kept up to date from the raw-resolution frames fetched
+metric_rollups = RollupStore(retention=timedelta(days=int(os.getenv("METRIC_ROLLUP_RETENTION_DAYS", default="35"))))
+
+# The background poller, once started by `start_metric_poller`
+metric_poller: MetricPoller | None = None
+_metric_poller_lock = threading.Lock()
+# The shared fetch loop of the live metric streams, once created by `get_metric_broadcaster`
+metric_broadcaster: MetricBroadcaster | None = None
+
+ASYNC_CLIENT_ENABLED = os.getenv("METRIC_ASYNC_CLIENT", default="1") != "0"
+# The maximum number of points per page of a ListTimeSeries response, which bounds the points held in memory
+PAGE_SIZE = int(os.getenv("METRIC_PAGE_SIZE", default="100000"))
+# Raw queries over longer windows are split into shards of this length, fetched at most SHARD_CONCURRENCY at a time
+SHARD_DURATION = timedelta(hours=int(os.getenv("METRIC_SHARD_HOURS", default="24")))
+SHARD_CONCURRENCY = int(os.getenv("METRIC_SHARD_CONCURRENCY", default="4"))
+# The maximum number of queries of one `get_metric_batch` request
+BATCH_MAX_QUERIES = int(os.getenv("METRIC_BATCH_MAX_QUERIES", default="20"))
+# The options of `get_metric` a batch query can set besides its window
+BATCH_OPTIONS = ("incremental", "resolution", "reducer", "percentiles", "points", "max_points", "start", "end")
+
+RESOLUTION_UNITS: dict[str, int] = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+REDUCERS: dict[str, str] = {
+    "sum": "REDUCE_SUM",
+    "mean": "REDUCE_MEAN",
+    "max": "REDUCE_MAX",
+    "min": "REDUCE_MIN",
+}
+
+
+def get_metric(
+    metric: str,
+    days: int = 0,
+    hours: int = 0,
+    minutes: int = 0,
+    use_cache: bool = True,
+    incremental: bool = False,
+    resolution: str | int | None = None,
+    reducer: str | None = None,
+    percentiles: bool | Sequence[float] | None = None,
+    points: int | None = None,
+    max_points: int | None = None,
+    start: datetime | str | int | None = None,
+    end: datetime | str | int | None = None,
+) -> pd.DataFrame:
     """
     Retrieves specified metrics for a Google Cloud Run service over a specified time range.
 
@@ -23,109 +168,772 @@ def get_metric(metric: str, days: int = 0, hours: int = 0, minutes: int = 0) ->
         days (int): The number of days to go back in time for the metric data.
         hours (int): The number of hours to go back in time for the metric data.
         minutes (int): The number of minutes to go back in time for the metric data.
+        use_cache (bool): Whether to serve and store the result in the in-process metric cache. Results are keyed by
+                          metric, project, service and the window aligned to the minute. When the metric poller is
+                          running, windows it covers are served from its memory instead.
+        incremental (bool): Whether to reuse the previously fetched frame for the same metric and window, and only
+                            query Cloud Monitoring for the minutes added since then (plus a small overlap).
+                            Ignored when a resolution is requested.
+        resolution (str | int | None): The alignment period, e.g. '60s', '5m', '1h' or a number of seconds. When set,
+                                       Cloud Monitoring aligns and reduces the series before they are transferred.
+        reducer (str | None): The cross-series reducer used with a resolution: 'sum', 'mean', 'max' or 'min'.
+                              Defaults to the reducer of the metric in METRICS_INFO.
+        percentiles (bool | Sequence[float] | None): For distribution metrics, the percentiles to return instead of
+                                                     the means per label, e.g. [50, 99], or True for p50, p90, p95
+                                                     and p99. They are estimated from the histograms of all labels
+                                                     merged per minute (or per resolution period).
+        points (int | None): The number of rows wanted over the window. The coarsest rollup tier (1 minute,
+                             5 minutes or 1 hour) that still gives at least that many rows is returned, see
+                             `_get_metric_rolled_up`. Cannot be combined with a resolution, reducer or percentiles.
+        max_points (int | None): The maximum number of rows returned, e.g. the width of a chart. Longer frames are
+                                 downsampled with LTTB (see `util.downsample`), which keeps peaks visible. The cache
+                                 holds the full frame.
+        start (datetime | str | int | None): The start of an absolute window, instead of days, hours and minutes
+                                             back from now. An ISO 8601 time, an epoch time in seconds, or a
+                                             datetime, see `parse_time_range`. Requires end.
+        end (datetime | str | int | None): The end of an absolute window. Windows that ended before the settle delay
+                                           cannot change anymore and stay in the cache until they are evicted.
 
     Returns:
-        pd.DataFrame: A pandas DataFrame containing the queried metric data.
+        pd.DataFrame: A pandas DataFrame containing the queried metric data. Its 'fetched_at' attribute holds the
+                      epoch time the data was fetched from Cloud Monitoring. With percentiles, the columns are
+                      'p50', 'p90', ... instead of the labels.
+
+    Raises:
+        ValueError: If the resolution, the reducer, the percentiles, the points or the time range are invalid.
 
     Note:
         The function requires the 'PROJECT_ID' environment variable to be set, which specifies the GCP project ID.
         If not set, it defaults to 'tsmccareerhack2024-icsd-grp1'.
+        The cache is configured by the 'METRIC_CACHE_TTL' (seconds), 'METRIC_CACHE_MAX_ENTRIES' and
+        'METRIC_CACHE_MAX_BYTES' environment variables. The re-fetched overlap of incremental queries is set by
+        'METRIC_INCREMENTAL_OVERLAP_MINUTES'. With 'METRIC_STORE' set to '1', raw-resolution minutes older than
+        'METRIC_STORE_SETTLE_MINUTES' (default 5) are kept in the SQLite database at 'METRIC_STORE_PATH' and only
+        the minutes missing from it are fetched from Cloud Monitoring. Rollup buckets older than
+        'METRIC_ROLLUP_RETENTION_DAYS' (default 35) are dropped.
     """
+    absolute = start is not None or end is not None
     # if all values are 0, return empty dataframe
-    if days == 0 and hours == 0 and minutes == 0:
+    if days == 0 and hours == 0 and minutes == 0 and not absolute:
         return pd.DataFrame()
+    if max_points is not None:
+        df = get_metric(
+            metric,
+            days,
+            hours,
+            minutes,
+            use_cache,
+            incremental,
+            resolution,
+            reducer,
+            percentiles,
+            points,
+            start=start,
+            end=end,
+        )
+        with traced("normalize"):
+            return downsample(df, max_points)
+    if points is not None:
+        tier = plan_metric_tier(days, hours, minutes, points, resolution, reducer, percentiles, start, end)
+        if tier > 60:
+            trace_cache("rollup")
+            return _get_metric_rolled_up(metric, days, hours, minutes, tier, use_cache, start, end)
+    polled = _get_polled_metric(metric, days, hours, minutes, use_cache, resolution, reducer, percentiles, absolute)
+    if polled is not None:
+        return polled
+    metric_query = _make_metric_query(metric, days, hours, minutes, resolution, reducer, percentiles, start, end)
+
+    def fetch() -> pd.DataFrame:
+        if metric_store is not None and _is_raw_query(metric_query):
+            return _get_metric_stored(metric_store, *metric_query[:5])
+        if incremental and not absolute and not metric_query.resolution_seconds and not metric_query.percentiles:
+            return _get_metric_incremental(
+                metric,
+                metric_query.project_id,
+                metric_query.service_name,
+                metric_query.end_time,
+                metric_query.end_time - metric_query.start_time,
+            )
+        return _fetch_metric(*metric_query)
+
+    return _cached_fetch(metric_query, fetch, use_cache)
+
+
+class MetricQuery(NamedTuple):
+    """
+    A fully resolved metric query. The fields are in the order of the `_fetch_metric` arguments.
+    """
+
+    metric: str
+    project_id: str
+    service_name: str
+    start_time: datetime
+    end_time: datetime
+    resolution_seconds: int = 0
+    reducer: str | None = None
+    percentiles: tuple[float, ...] = ()
+
+    def cache_key(self) -> tuple:
+        """
+        Returns the key of the query in the metric cache, with the window aligned to the minute.
+        """
+        return (
+            self.metric,
+            self.project_id,
+            self.service_name,
+            self.end_time.replace(second=0, microsecond=0),
+            self.end_time - self.start_time,
+            self.resolution_seconds,
+            self.reducer,
+            self.percentiles,
+        )
+
+
+def _make_metric_query(
+    metric: str,
+    days: int,
+    hours: int,
+    minutes: int,
+    resolution: str | int | None,
+    reducer: str | None,
+    percentiles: bool | Sequence[float] | None = None,
+    start: datetime | str | int | None = None,
+    end: datetime | str | int | None = None,
+) -> MetricQuery:
+    """
+    Resolves the project, service and time interval of a metric request, ending now unless start and end are given.
+
+    Raises:
+        ValueError: If the resolution, the reducer, the percentiles or the time range are invalid, or a reducer is
+                    given without a resolution.
+    """
+    resolution_seconds = parse_resolution(resolution)
+    reducer_name = parse_metric_reducer(reducer, resolution)
+    percentile_values = parse_metric_percentiles(metric, percentiles, reducer_name)
+    time_range = parse_time_range(start, end)
     load_dotenv(override=True)
     PROJECT_ID: str = os.getenv("PROJECT_ID", default="tsmccareerhack2024-icsd-grp1")
     SERVER_NAME: str = os.getenv("SERVER_NAME", default="dvwa")
-    metrics_info: dict[str, dict[str, str]] = {
-        "request_count": {
-            "type": "run.googleapis.com/request_count",
-            "label": "response_code",
-        },
-        "request_latencies": {
-            "type": "run.googleapis.com/request_latencies",
-            "label": "response_code",
-        },
-        "instance_count": {
-            "type": "run.googleapis.com/container/instance_count",
-            "label": "state",
-        },
-        "CPU_utilization": {
-            "type": "run.googleapis.com/container/cpu/utilizations",
-            "label": "service_name",
-        },
-        "memory_utilization": {
-            "type": "run.googleapis.com/container/memory/utilizations",
-            "label": "service_name",
-        },
-        "startup_latency": {
-            "type": "run.googleapis.com/container/startup_latencies",
-            "label": "service_name",
-        },
-    }
+    if time_range is not None:
+        start_time, end_time = time_range
+    else:
+        end_time = datetime.utcnow().replace(tzinfo=pytz.timezone("UTC"))
+        start_time = end_time - timedelta(days=days, hours=hours, minutes=minutes)
+    return MetricQuery(
+        metric, PROJECT_ID, SERVER_NAME, start_time, end_time, resolution_seconds, reducer_name, percentile_values
+    )
+
+
+def parse_time_range(
+    start: datetime | str | int | float | None, end: datetime | str | int | float | None
+) -> tuple[datetime, datetime] | None:
+    """
+    Converts the start and end of an absolute window into UTC datetimes, floored to the minute like the data.
+
+    Both are given as an ISO 8601 time (UTC unless it has an offset, e.g. '2024-01-19T15:00:00Z'), an epoch time in
+    seconds, or a datetime.
 
-    client: MetricServiceClient = MetricServiceClient()
-    query: Query = Query(
-        client=client,
-        project=PROJECT_ID,
-        metric_type=metrics_info[metric]["type"],
-        end_time=datetime.utcnow().replace(tzinfo=pytz.timezone("UTC")),
-        days=days,
-        hours=hours,
-        minutes=minutes,
-    ).select_resources(service_name=SERVER_NAME)
+    Returns:
+        tuple[datetime, datetime] | None: The start and end time, or None if neither is given.
 
-    result: pd.DataFrame = query.as_dataframe(label=metrics_info[metric]["label"])
+    Raises:
+        ValueError: If only one of them is given, one is not a valid time, or the window is empty.
+    """
+    if (start is None or start == "") and (end is None or end == ""):
+        return None
+    if start is None or start == "" or end is None or end == "":
+        raise ValueError("An absolute time range needs both a start and an end.")
+    start_time, end_time = _parse_time(start), _parse_time(end)
+    if end_time <= start_time:
+        raise ValueError(f"Invalid time range, the end '{end}' is not at least a minute after the start '{start}'.")
+    return start_time, end_time
 
-    return _normalize_dataframe(result, metric)
 
+def _parse_time(value: datetime | str | int | float) -> datetime:
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            timestamp = pd.Timestamp(value, unit="s")
+        elif isinstance(value, str) and value.strip().replace(".", "", 1).isdigit():
+            timestamp = pd.Timestamp(float(value), unit="s")
+        elif isinstance(value, (str, datetime)):
+            timestamp = pd.Timestamp(value)
+        else:
+            raise ValueError
+    except (ValueError, OverflowError):
+        raise ValueError(f"Invalid time '{value}', expected an ISO 8601 time or an epoch time in seconds.")
+    timestamp = timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+    return timestamp.floor("min").to_pydatetime().replace(tzinfo=pytz.utc)
 
-def _normalize_dataframe(df: pd.DataFrame, metric: str) -> pd.DataFrame:
+
+def is_immutable_window(end_time: datetime) -> bool:
+    """
+    Returns whether the data of a window ending at `end_time` cannot change anymore, i.e. it ended before the
+    settle delay (METRIC_STORE_SETTLE_MINUTES) after which Cloud Monitoring no longer adds late points.
     """
-    Normalizes and aggregates a DataFrame with potentially duplicated column names.
+    return end_time <= datetime.now(tz=pytz.utc) - STORE_SETTLE
 
-    This function first fills any NaN values with 0.0. It then standardizes the data by averaging values across
-    multiple time points if necessary. Finally, it handles duplicated column names by transposing the DataFrame,
-    grouping by column names, summing the values, and transposing back. This method is chosen to avoid the
-    deprecation warning associated with using DataFrame.groupby with axis=1.
+
+def _cached_fetch(
+    metric_query: MetricQuery,
+    fetch: Callable[[], pd.DataFrame],
+    use_cache: bool = True,
+    cache_key: tuple | None = None,
+) -> pd.DataFrame:
+    """
+    Serves a resolved query from the metric cache, or runs `fetch` once for every identical query running at the same
+    time, then stamps the frame with its fetch time, rolls it up and caches it.
 
     Args:
-        df (pd.DataFrame): The DataFrame to be normalized and aggregated.
+        metric_query (MetricQuery): The query, which decides the cache lifetime and whether the frame is rolled up.
+        fetch (Callable): Returns the frame of the query, e.g. from Cloud Monitoring or the metric store.
+        use_cache (bool): Whether to serve and store the frame in the metric cache.
+        cache_key (tuple | None): The key of the frame in the cache and of the shared fetch, by default the key of the
+                                  query.
+    """
+    cache_key = cache_key or metric_query.cache_key()
+    cached = _get_cached_metric(cache_key, use_cache)
+    if cached is not None:
+        return cached
+
+    def fetch_and_put() -> pd.DataFrame:
+        trace_cache("miss")
+        return _put_fetched_metric(metric_query, cache_key, fetch(), use_cache)
+
+    df, shared = metric_flights.do(cache_key, fetch_and_put)
+    return _shared_metric(df, shared)
+
+
+async def _cached_fetch_async(
+    metric_query: MetricQuery, fetch: Callable[[], Awaitable[pd.DataFrame]], use_cache: bool = True
+) -> pd.DataFrame:
+    """
+    The asyncio counterpart of `_cached_fetch`. The fetch is shared with identical queries of the synchronous path.
+    """
+    cache_key = metric_query.cache_key()
+    cached = _get_cached_metric(cache_key, use_cache)
+    if cached is not None:
+        return cached
+
+    async def fetch_and_put() -> pd.DataFrame:
+        trace_cache("miss")
+        return _put_fetched_metric(metric_query, cache_key, await fetch(), use_cache)
+
+    df, shared = await metric_flights.do_async(cache_key, fetch_and_put)
+    return _shared_metric(df, shared)
+
+
+def _get_cached_metric(cache_key: tuple, use_cache: bool) -> pd.DataFrame | None:
+    cached = metric_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        trace_cache("hit")
+    return cached
+
+
+def _put_fetched_metric(metric_query: MetricQuery, cache_key: tuple, df: pd.DataFrame, use_cache: bool) -> pd.DataFrame:
+    df.attrs["fetched_at"] = time.time()
+    _update_rollups(metric_query, df)
+    if use_cache:
+        metric_cache.put(cache_key, df, ttl=_cache_ttl(metric_query))
+    return df
+
+
+def _shared_metric(df: pd.DataFrame, shared: bool) -> pd.DataFrame:
+    # Callers that joined another fetch get their own copy of the frame
+    if shared:
+        trace_cache("shared")
+        return df.copy()
+    return df
+
+
+def _cache_ttl(metric_query: MetricQuery) -> float | None:
+    # Settled windows are kept until evicted, the others for the ttl of the cache
+    return math.inf if is_immutable_window(metric_query.end_time) else None
+
+
+def parse_resolution(resolution: str | int | None) -> int:
+    """
+    Converts a resolution such as '60s', '5m', '1h' or a number of seconds into seconds.
+
+    Cloud Monitoring rejects alignment periods under a minute, and the data is per minute anyway, so the resolution
+    must be a whole number of minutes.
 
     Returns:
-        pd.DataFrame: The normalized and aggregated DataFrame.
+        int: The alignment period in seconds, or 0 if no resolution is given.
+
+    Raises:
+        ValueError: If the resolution is not a positive whole number of seconds, minutes, hours or days, or not a
+                    whole number of minutes.
+    """
+    if resolution is None or resolution == "":
+        return 0
+    text = str(resolution).strip().lower()
+    unit = RESOLUTION_UNITS.get(text[-1:], None)
+    number = text[:-1] if unit is not None else text
+    if not number.isdigit() or int(number) <= 0 or int(number) * (unit or 1) % 60:
+        raise ValueError(f"Invalid resolution '{resolution}', expected whole minutes, e.g. '60s', '5m', '1h'.")
+    return int(number) * (unit or 1)
+
+
+def parse_reducer(reducer: str | None) -> str | None:
+    """
+    Converts a reducer name such as 'sum' or 'max' into the Cloud Monitoring reducer.
+
+    Raises:
+        ValueError: If the reducer is not one of the REDUCERS.
+    """
+    if reducer is None or reducer == "":
+        return None
+    if reducer.lower() not in REDUCERS:
+        raise ValueError(f"Invalid reducer '{reducer}', expected one of {', '.join(REDUCERS)}.")
+    return REDUCERS[reducer.lower()]
+
+
+def parse_metric_reducer(reducer: str | None, resolution: str | int | None) -> str | None:
     """
-    # Fill NaN values with 0.0
-    df = df.fillna(0.0)
+    Validates the reducer requested for a metric, see `parse_reducer`. Series are only reduced on the server when
+    they are aligned, so a reducer needs a resolution.
 
-    # remove seconds and microseconds from the index
-    df.index = df.index.map(lambda x: x.replace(second=0, microsecond=0))
+    Raises:
+        ValueError: If the reducer is invalid, or given without a resolution.
+    """
+    reducer_name = parse_reducer(reducer)
+    if reducer_name is not None and not parse_resolution(resolution):
+        raise ValueError("A reducer needs a resolution, e.g. resolution=5m.")
+    return reducer_name
 
-    # Standardize the data (e.g., averaging values across multiple time points)
-    for index, row in df.iterrows():
-        for column_name, value in row.items():
-            if hasattr(value, "mean"):
-                df.loc[index, column_name] = value.mean  # type: ignore
 
-    # Transpose the DataFrame, group by the column names and sum the values, and then transpose back
-    # This approach is used to handle the deprecation warning for DataFrame.groupby with axis=1
+def parse_metric_percentiles(
+    metric: str, percentiles: bool | Sequence[float] | None, reducer: str | None = None
+) -> tuple[float, ...]:
+    """
+    Validates the percentiles requested for a metric, see `util.distribution.parse_percentiles`.
+
+    Raises:
+        ValueError: If the percentiles are invalid, the metric has no distribution values, or a reducer is given.
+    """
+    parsed = parse_percentiles(percentiles)
+    if parsed and METRICS_INFO.get(metric, {}).get("value_type") != "DISTRIBUTION":
+        raise ValueError(f"Percentiles are only available for distribution metrics, not '{metric}'.")
+    if parsed and reducer is not None:
+        raise ValueError("Percentiles merge the histograms of all labels and cannot be combined with a reducer.")
+    return parsed
+
+
+def _fetch_metric(
+    metric: str,
+    project_id: str,
+    service_name: str,
+    start_time: datetime,
+    end_time: datetime,
+    resolution_seconds: int = 0,
+    reducer: str | None = None,
+    percentiles: tuple[float, ...] = (),
+) -> pd.DataFrame:
+    """
+    Queries Cloud Monitoring for a metric over the interval (start_time, end_time] and normalizes the result.
+
+    With a resolution, every series is aligned to periods of `resolution_seconds` and the series are reduced per
+    label on the server, so only one point per period and label is transferred. With percentiles, the distributions
+    are merged into one histogram per period and the requested percentiles are returned instead.
+
+    The response is read page by page (of at most PAGE_SIZE points) and every page is reduced into running
+    per-minute aggregates before the next one is fetched, so memory does not grow with the number of time series.
+    Raw queries longer than SHARD_DURATION are split into time shards (see `_plan_shards`) that are fetched
+    concurrently, at most SHARD_CONCURRENCY at a time, into the same aggregates.
+    """
+    client = get_metric_client()
+    query = _build_query(
+        client,
+        metric,
+        project_id,
+        service_name,
+        start_time,
+        end_time,
+        resolution_seconds,
+        reducer,
+        merge_labels=bool(percentiles),
+    )
+    if percentiles:
+        # The query is read while the histograms are merged, so both count as upstream time
+        with traced("upstream"):
+            return _build_percentiles_dataframe(query, metric, percentiles)
+    aggregator = _metric_aggregator(metric)
+
+    def consume(request: ListTimeSeriesRequest) -> None:
+        for page in client.list_time_series(request=request).pages:
+            aggregator.add(page.time_series)
+
+    requests = _shard_requests(query, start_time, end_time, resolution_seconds)
+    with traced("upstream"):
+        if len(requests) == 1:
+            consume(requests[0])
+        else:
+            with ThreadPoolExecutor(min(SHARD_CONCURRENCY, len(requests)), thread_name_prefix="metric-shard") as pool:
+                list(pool.map(consume, requests))
+    with traced("normalize"):
+        return aggregator.result()
+
+
+async def _fetch_metric_async(
+    metric: str,
+    project_id: str,
+    service_name: str,
+    start_time: datetime,
+    end_time: datetime,
+    resolution_seconds: int = 0,
+    reducer: str | None = None,
+    percentiles: tuple[float, ...] = (),
+) -> pd.DataFrame:
+    """
+    The asyncio counterpart of `_fetch_metric`.
+
+    The request is issued with the shared `MetricServiceAsyncClient`, and every page is reduced in the bounded
+    normalize pool as it arrives instead of blocking a thread for the whole call. The shards of long raw queries
+    run concurrently, at most SHARD_CONCURRENCY at a time.
+    """
+    query = _build_query(
+        None,
+        metric,
+        project_id,
+        service_name,
+        start_time,
+        end_time,
+        resolution_seconds,
+        reducer,
+        merge_labels=bool(percentiles),
+    )
+    if percentiles:
+        # Query only builds its request inside the synchronous iterator, so the parameters are taken from it directly
+        with traced("upstream"):
+            time_series = await list_time_series(
+                ListTimeSeriesRequest(**query._build_query_params(page_size=PAGE_SIZE))
+            )
+        with traced("normalize"):
+            return await run_in_normalize_pool(_build_percentiles_dataframe, time_series, metric, percentiles)
+    aggregator = _metric_aggregator(metric)
+    semaphore = asyncio.Semaphore(SHARD_CONCURRENCY)
+
+    async def consume(request: ListTimeSeriesRequest) -> None:
+        async with semaphore:
+            await consume_time_series_pages(request, aggregator.add)
+
+    requests = _shard_requests(query, start_time, end_time, resolution_seconds)
+    with traced("upstream"):
+        await asyncio.gather(*(consume(request) for request in requests))
+    with traced("normalize"):
+        return aggregator.result()
+
+
+def _plan_shards(start_time: datetime, end_time: datetime) -> list[tuple[datetime, datetime]]:
+    """
+    Splits the interval (start_time, end_time] into consecutive shards of at most SHARD_DURATION.
+
+    The shards are half-open and adjacent, so every point is fetched by exactly one shard: a point stamped on a
+    boundary belongs to the shard ending there. A minute split by a boundary is merged again by the aggregator the
+    shards share.
+    """
+    num_shards = max(1, -(-(end_time - start_time) // SHARD_DURATION))
+    boundaries = [start_time + (end_time - start_time) * shard / num_shards for shard in range(num_shards)]
+    return list(zip(boundaries, boundaries[1:] + [end_time]))
+
+
+def _shard_requests(
+    query: Query, start_time: datetime, end_time: datetime, resolution_seconds: int = 0
+) -> list[ListTimeSeriesRequest]:
+    # Aligned queries are small and their periods would have to line up with the boundaries, so they are not split
+    shards = _plan_shards(start_time, end_time) if not resolution_seconds else [(start_time, end_time)]
+    return [
+        ListTimeSeriesRequest(
+            **query.select_interval(end_time=shard_end, start_time=shard_start)._build_query_params(page_size=PAGE_SIZE)
+        )
+        for shard_start, shard_end in shards
+    ]
+
+
+def _metric_aggregator(metric: str) -> MinuteAggregator:
+    """
+    Returns an empty aggregator combining the points of a metric: requests are summed per label, latencies merged
+    into count-weighted means, and the other metrics take the maximum of their series.
+    """
+    label = METRICS_INFO[metric]["label"]
     match metric:
-        case "request_count" | "request_latencies":
-            df = df.T.groupby(level=0).sum().T
+        case "request_latencies":
+            return MinuteAggregator(label, "weighted_mean")
         case "CPU_utilization" | "memory_utilization":
-            df = df.T.groupby(level=0).max().T
             # convert to percentage
-            df = df * 100
+            return MinuteAggregator(label, "max", scale=100)
         case "startup_latency" | "instance_count":
-            df = df.T.groupby(level=0).max().T
+            return MinuteAggregator(label, "max")
         case _:
-            df = df.T.groupby(level=0).sum().T
+            return MinuteAggregator(label, "sum")
+
+
+def _build_percentiles_dataframe(
+    time_series: Iterable[TimeSeries], metric: str, percentiles: Sequence[float]
+) -> pd.DataFrame:
+    df = percentiles_dataframe(time_series, percentiles)
+    if metric in ("CPU_utilization", "memory_utilization"):
+        # convert to percentage, like the means
+        df = df * 100
     return df
 
 
-async def get_metric_async(metric: str, days: int = 0, hours: int = 0, minutes: int = 0) -> pd.DataFrame:
+def _build_query(
+    client: MetricServiceClient | None,
+    metric: str,
+    project_id: str,
+    service_name: str,
+    start_time: datetime,
+    end_time: datetime,
+    resolution_seconds: int = 0,
+    reducer: str | None = None,
+    merge_labels: bool = False,
+) -> Query:
+    """
+    Builds the query of a metric, aligned and reduced on the server when a resolution is given.
+
+    With `merge_labels`, the distributions of a distribution metric are instead aligned with ALIGN_DELTA and summed
+    across all labels, which merges their histograms per period, one minute unless a resolution is given. The raw
+    histograms of every series are never transferred.
+    """
+    query: Query = (
+        Query(client=client, project=project_id, metric_type=METRICS_INFO[metric]["type"])
+        .select_interval(end_time=end_time, start_time=start_time)
+        .select_resources(service_name=service_name)
+    )
+    if merge_labels:
+        return query.align("ALIGN_DELTA", seconds=resolution_seconds or 60).reduce("REDUCE_SUM")
+    if not resolution_seconds:
+        return query
+    info = METRICS_INFO[metric]
+    aligner = info["aligner"]
+    if aligner == "ALIGN_DELTA" and reducer not in (None, info["reducer"]):
+        # Only sums keep distributions, the other reducers need the numeric mean of every series
+        aligner = "ALIGN_MEAN"
+    query = query.align(aligner, seconds=resolution_seconds)
+    return query.reduce(reducer or info["reducer"], info["group_by"])
+
+
+def _get_metric_incremental(
+    metric: str, project_id: str, service_name: str, end_time: datetime, window: timedelta
+) -> pd.DataFrame:
+    """
+    Returns the metric over the window ending at `end_time`, fetching only the minutes missing from the last frame.
+
+    The previously returned frame for the same metric, project, service and window is kept in `incremental_frames`.
+    Cloud Monitoring is only queried from `INCREMENTAL_OVERLAP` before its newest row, so late points of the most
+    recent minutes are picked up again. Without a usable previous frame, the whole window is fetched.
+    """
+    state_key = (metric, project_id, service_name, window)
+    previous = incremental_frames.get(state_key)
+
+    window_start = end_time - window
+    if previous is None or previous.empty:
+        df = _fetch_metric(metric, project_id, service_name, window_start, end_time)
+    else:
+        delta_start = previous.index.max().tz_localize("UTC") - INCREMENTAL_OVERLAP
+        if delta_start <= window_start:
+            df = _fetch_metric(metric, project_id, service_name, window_start, end_time)
+        else:
+            # The interval start is exclusive, so step back one second to include points stamped exactly at it
+            delta = _fetch_metric(metric, project_id, service_name, delta_start - timedelta(seconds=1), end_time)
+            df = _merge_incremental_frame(previous, delta, delta_start, window_start)
+
+    incremental_frames.put(state_key, df)
+    return df
+
+
+def _is_raw_query(metric_query: MetricQuery) -> bool:
+    return not metric_query.resolution_seconds and metric_query.reducer is None and not metric_query.percentiles
+
+
+def _get_metric_stored(
+    store: MetricStore, metric: str, project_id: str, service_name: str, start_time: datetime, end_time: datetime
+) -> pd.DataFrame:
+    """
+    Returns the metric over (start_time, end_time], answering the settled minutes from the local store.
+
+    Settled minutes (older than STORE_SETTLE) missing from the store are fetched once and written to it. The minutes
+    after them may still receive late points, so they are always fetched from Cloud Monitoring and never stored.
+    """
+    key = (metric, project_id, service_name)
+    first_minute = _epoch_minute(start_time)
+    settled_minute = _epoch_minute(end_time - STORE_SETTLE)
+    if settled_minute <= first_minute:
+        return _fetch_metric(metric, project_id, service_name, start_time, end_time)
+
+    for gap_first, gap_end in store.missing(key, first_minute, settled_minute):
+        # The interval start is exclusive, so step back one second to include points stamped exactly at it
+        gap = _fetch_metric(
+            metric, project_id, service_name, _minute_time(gap_first) - timedelta(seconds=1), _minute_time(gap_end)
+        )
+        store.write(key, gap, gap_first, gap_end)
+
+    stored = store.read(key, first_minute, settled_minute)
+    settled_time = _minute_time(settled_minute)
+    recent = _fetch_metric(metric, project_id, service_name, settled_time - timedelta(seconds=1), end_time)
+    return _merge_incremental_frame(stored, recent, settled_time, start_time)
+
+
+def _epoch_minute(time: datetime) -> int:
+    return int(pd.Timestamp(time).value // 60_000_000_000)
+
+
+def _minute_time(minute: int) -> datetime:
+    return datetime.fromtimestamp(minute * 60, tz=pytz.utc)
+
+
+def plan_metric_tier(
+    days: int,
+    hours: int,
+    minutes: int,
+    points: int,
+    resolution: str | int | None = None,
+    reducer: str | None = None,
+    percentiles: bool | Sequence[float] | None = None,
+    start: datetime | str | int | None = None,
+    end: datetime | str | int | None = None,
+) -> int:
+    """
+    Picks the rollup tier of a window for a point budget, see `util.metric_rollup.plan_tier`.
+
+    Returns:
+        int: The bucket length of the tier in seconds.
+
+    Raises:
+        ValueError: If the points or the time range are invalid, or the points are combined with a resolution, a
+                    reducer or percentiles.
+    """
+    if resolution not in (None, "") or reducer not in (None, "") or percentiles:
+        raise ValueError("Points pick the resolution and cannot be combined with a resolution, reducer or percentiles.")
+    time_range = parse_time_range(start, end)
+    if time_range is not None:
+        return plan_tier(time_range[1] - time_range[0], points)
+    return plan_tier(timedelta(days=days, hours=hours, minutes=minutes), points)
+
+
+def _update_rollups(metric_query: MetricQuery, df: pd.DataFrame) -> None:
+    # Only raw minutes can be rolled up, and only the buckets before the settle delay are final
+    if _is_raw_query(metric_query) and metric_query.metric in METRICS_INFO:
+        metric_rollups.update(
+            (metric_query.metric, metric_query.project_id, metric_query.service_name),
+            df,
+            METRICS_INFO[metric_query.metric]["rollup"],
+            metric_query.start_time,
+            metric_query.end_time - STORE_SETTLE,
+        )
+
+
+def _get_metric_rolled_up(
+    metric: str,
+    days: int,
+    hours: int,
+    minutes: int,
+    tier: int,
+    use_cache: bool = True,
+    start: datetime | str | int | None = None,
+    end: datetime | str | int | None = None,
+) -> pd.DataFrame:
+    """
+    Returns the buckets of a rollup tier over the window, one row per bucket labelled by its start.
+
+    The buckets that ended before the settle delay come from `metric_rollups` when the stored tier reaches back to
+    the start of the window, and only the minutes after them are fetched, with `get_metric`, and rolled up. Otherwise
+    the minutes of the whole window are fetched (from the cache, the store or Cloud Monitoring), which also fills the
+    tier for the next request. Absolute windows are always rolled up from their minutes, which are cached until
+    evicted once they have settled. The bucket containing the start of the window is left out since it is
+    incomplete, the last one holds the minutes up to the end of the window.
+    """
+    metric_query = _make_metric_query(metric, days, hours, minutes, None, None, None, start, end)
+    aggregation = METRICS_INFO[metric]["rollup"]
+    key = (metric, metric_query.project_id, metric_query.service_name)
+    stored = metric_rollups.get(key, tier, metric_query.start_time) if start is None else None
+    if stored is None:
+        df = get_metric(metric, days, hours, minutes, use_cache=use_cache, start=start, end=end)
+        first_bucket = _to_naive_utc(metric_query.start_time).floor(f"{tier}s") + timedelta(seconds=tier)
+        result = rollup(df[df.index >= first_bucket], tier, aggregation)
+    else:
+        buckets, covered_until = stored
+        # Fetch the minutes after the stored buckets, with one more minute as margin
+        recent_minutes = int((metric_query.end_time - covered_until).total_seconds() // 60) + 2
+        df = get_metric(metric, minutes=recent_minutes, use_cache=use_cache)
+        recent = rollup(df[df.index >= _to_naive_utc(covered_until)], tier, aggregation)
+        result = pd.concat([buckets, recent]).fillna(0.0).sort_index(axis=1)
+    result.attrs["fetched_at"] = df.attrs.get("fetched_at")
+    return result
+
+
+def _merge_incremental_frame(
+    previous: pd.DataFrame, delta: pd.DataFrame, delta_start: datetime, window_start: datetime
+) -> pd.DataFrame:
+    """
+    Merges a freshly fetched delta into the previous normalized frame.
+
+    Rows of the previous frame from `delta_start` onwards are replaced by the delta, since the latest minutes may
+    have been incomplete when they were first fetched. Rows that fell out of the window are dropped and labels
+    missing on one side are filled with 0.0, the same as `MinuteAggregator` does.
+
+    Args:
+        previous (pd.DataFrame): The normalized frame returned by the previous fetch.
+        delta (pd.DataFrame): The normalized frame of the newly fetched interval.
+        delta_start (datetime): The start of the newly fetched interval, aligned to the minute.
+        window_start (datetime): The start of the requested window.
+
+    Returns:
+        pd.DataFrame: The merged frame, sorted by time and by label.
+    """
+    # The normalized frames are indexed by naive UTC timestamps
+    delta_start_ts = _to_naive_utc(delta_start)
+    window_start_ts = _to_naive_utc(window_start).floor("min")
+
+    kept = previous[(previous.index >= window_start_ts) & (previous.index < delta_start_ts)]
+    fresh = delta[delta.index >= delta_start_ts]
+    merged = pd.concat([kept, fresh]).fillna(0.0)
+    return merged.sort_index(axis=0).sort_index(axis=1)
+
+
+def _to_naive_utc(time: datetime) -> pd.Timestamp:
+    timestamp = pd.Timestamp(time)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp
+
+
+async def get_metric_async(metric: str, days: int = 0, hours: int = 0, minutes: int = 0, **options) -> pd.DataFrame:
+    """
+    Retrieves a metric like `get_metric` without blocking the event loop.
+
+    By default the query is issued with the asyncio Monitoring client and only the DataFrame work uses a thread of
+    the bounded normalize pool. Incremental queries, queries with a point budget, every query when the metric store
+    is enabled, or every query when the 'METRIC_ASYNC_CLIENT' environment variable is '0', fall back to running
+    `get_metric` in the default executor.
+
+    Args:
+        metric (str): The specific metric to retrieve, see `get_metric`.
+        days (int): The number of days to go back in time for the metric data.
+        hours (int): The number of hours to go back in time for the metric data.
+        minutes (int): The number of minutes to go back in time for the metric data.
+        **options: Keyword options of `get_metric`.
+
+    Returns:
+        pd.DataFrame: A pandas DataFrame containing the queried metric data.
+    """
+    max_points = options.pop("max_points", None)
+    if max_points is not None:
+        df = await get_metric_async(metric, days, hours, minutes, **options)
+        with traced("normalize"):
+            return await run_in_normalize_pool(downsample, df, max_points)
+    native = not options.get("incremental", False) and options.get("points") is None and metric_store is None
+    if ASYNC_CLIENT_ENABLED and native:
+        # Neither is set on this path
+        options.pop("incremental", None)
+        options.pop("points", None)
+        return await _get_metric_native(metric, days, hours, minutes, **options)
+
     loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(None, get_metric, metric, days, hours, minutes)
+    fetch = partial(get_metric, metric, days, hours, minutes, **options)
+    # In a copy of the context, so that the active trace follows the request into the executor
+    result = await loop.run_in_executor(None, contextvars.copy_context().run, fetch)
     if isinstance(result, Exception):
         raise result
     if isinstance(result, pd.DataFrame):
@@ -133,23 +941,458 @@ async def get_metric_async(metric: str, days: int = 0, hours: int = 0, minutes:
     raise Exception(f"Unexpected result type: {type(result)}")
 
 
-async def get_all_metrics(days: int = 0, hours: int = 0, minutes: int = 0) -> dict[str, str]:
-    metric_list = [
-        "request_count",
-        "request_latencies",
-        "instance_count",
-        "CPU_utilization",
-        "memory_utilization",
-        "startup_latency",
-    ]
+async def _get_metric_native(
+    metric: str,
+    days: int = 0,
+    hours: int = 0,
+    minutes: int = 0,
+    use_cache: bool = True,
+    incremental: bool = False,
+    resolution: str | int | None = None,
+    reducer: str | None = None,
+    percentiles: bool | Sequence[float] | None = None,
+    start: datetime | str | int | None = None,
+    end: datetime | str | int | None = None,
+) -> pd.DataFrame:
+    absolute = start is not None or end is not None
+    if days == 0 and hours == 0 and minutes == 0 and not absolute:
+        return pd.DataFrame()
+    polled = _get_polled_metric(metric, days, hours, minutes, use_cache, resolution, reducer, percentiles, absolute)
+    if polled is not None:
+        return polled
+    metric_query = _make_metric_query(metric, days, hours, minutes, resolution, reducer, percentiles, start, end)
+    # Identical queries share one upstream fetch, also with queries running on the synchronous path
+    return await _cached_fetch_async(metric_query, partial(_fetch_metric_async, *metric_query), use_cache)
+
+
+def get_metric_heatmap(
+    metric: str = "request_latencies",
+    days: int = 0,
+    hours: int = 0,
+    minutes: int = 0,
+    resolution: str | int | None = None,
+    use_cache: bool = True,
+    start: datetime | str | int | None = None,
+    end: datetime | str | int | None = None,
+) -> pd.DataFrame:
+    """
+    Retrieves the time x bucket heatmap of a distribution metric, with the histograms of all labels merged.
+
+    Cloud Monitoring merges the distributions per period (ALIGN_DELTA + REDUCE_SUM), so a single series with one
+    histogram per period is transferred, and its bucket counts are written directly into one int64 matrix.
+
+    Args:
+        metric (str): A distribution metric: 'request_latencies' (default), 'startup_latency', 'CPU_utilization' or
+                      'memory_utilization'.
+        days (int): The number of days to go back in time for the metric data.
+        hours (int): The number of hours to go back in time for the metric data.
+        minutes (int): The number of minutes to go back in time for the metric data.
+        resolution (str | int | None): The period of a row, e.g. '60s', '5m', '1h'. Defaults to one minute.
+        use_cache (bool): Whether to serve and store the result in the in-process metric cache.
+        start (datetime | str | int | None): The start of an absolute window, see `get_metric`.
+        end (datetime | str | int | None): The end of an absolute window, see `get_metric`.
+
+    Returns:
+        pd.DataFrame: The bucket counts, with one row per period of the window and one column per bucket labelled
+                      by its lower edge (see `util.distribution.heatmap_dataframe`).
+
+    Raises:
+        ValueError: If the metric has no distribution values, or the resolution or the time range is invalid.
+    """
+    if METRICS_INFO.get(metric, {}).get("value_type") != "DISTRIBUTION":
+        raise ValueError(f"Heatmaps are only available for distribution metrics, not '{metric}'.")
+    if days == 0 and hours == 0 and minutes == 0 and start is None and end is None:
+        return pd.DataFrame()
+    metric_query = _make_metric_query(metric, days, hours, minutes, resolution or 60, None, None, start, end)
+
+    def fetch() -> pd.DataFrame:
+        query = _build_query(
+            get_metric_client(),
+            metric,
+            metric_query.project_id,
+            metric_query.service_name,
+            metric_query.start_time,
+            metric_query.end_time,
+            metric_query.resolution_seconds,
+            merge_labels=True,
+        )
+        return heatmap_dataframe(query, metric_query.start_time, metric_query.end_time, metric_query.resolution_seconds)
+
+    return _cached_fetch(metric_query, fetch, use_cache, cache_key=("heatmap", *metric_query.cache_key()))
+
+
+def get_metric_stats() -> dict[str, dict]:
+    """
+    Returns the counters of the metric cache and of the request coalescing, the poller status if it runs, the size
+    of the metric store if it is enabled, and the size of the rollup tiers.
+
+    Returns:
+        dict: Example: {'cache': {'hits': 10, 'misses': 2, ...}, 'single_flight': {'calls': 2, 'deduplicated': 5, ...}}.
+    """
+    stats: dict[str, dict] = {"cache": metric_cache.stats(), "single_flight": metric_flights.stats()}
+    if metric_poller is not None:
+        stats["poller"] = metric_poller.status()
+    if metric_broadcaster is not None:
+        stats["streams"] = metric_broadcaster.stats()
+    if metric_store is not None:
+        stats["store"] = metric_store.stats()
+    stats["rollups"] = metric_rollups.stats()
+    return stats
+
+
+def start_metric_poller() -> MetricPoller:
+    """
+    Starts the background poller that keeps every metric of METRICS_INFO warm in memory, if it is not running yet.
+
+    While it runs, `get_metric` and `get_metric_async` answer raw-resolution windows it covers from memory, without
+    waiting for Cloud Monitoring.
+
+    Returns:
+        MetricPoller: The running poller.
+
+    Note:
+        The poller is configured by the 'METRIC_POLLER_INTERVAL' (seconds, default 60), 'METRIC_POLLER_WINDOW_MINUTES'
+        (default 1440), 'METRIC_POLLER_JITTER' (default 0.1) and 'METRIC_POLLER_MAX_BACKOFF' (seconds, default 900)
+        environment variables.
+    """
+    global metric_poller
+    with _metric_poller_lock:
+        if metric_poller is None:
+            metric_poller = MetricPoller(
+                fetch=partial(get_metric, use_cache=False, incremental=True),
+                metrics=METRICS_INFO,
+                window=timedelta(minutes=int(os.getenv("METRIC_POLLER_WINDOW_MINUTES", default="1440"))),
+                interval=float(os.getenv("METRIC_POLLER_INTERVAL", default="60")),
+                jitter=float(os.getenv("METRIC_POLLER_JITTER", default="0.1")),
+                max_backoff=float(os.getenv("METRIC_POLLER_MAX_BACKOFF", default="900")),
+            )
+        metric_poller.start()
+        return metric_poller
+
+
+def get_metric_broadcaster() -> MetricBroadcaster:
+    """
+    Returns the broadcaster that fetches the metrics of the live streams once for all their subscribers.
+
+    Returns:
+        MetricBroadcaster: The broadcaster, whose thread runs while it has subscribers.
+
+    Note:
+        The broadcaster is configured by the 'METRIC_STREAM_INTERVAL' (seconds, default 30),
+        'METRIC_STREAM_WINDOW_MINUTES' (default 10) and 'METRIC_STREAM_MAX_EVENTS' (default 100) environment
+        variables.
+    """
+    global metric_broadcaster
+    with _metric_poller_lock:
+        if metric_broadcaster is None:
+            metric_broadcaster = MetricBroadcaster(
+                fetch=partial(get_metric, use_cache=False, incremental=True),
+                window=timedelta(minutes=int(os.getenv("METRIC_STREAM_WINDOW_MINUTES", default="10"))),
+                interval=float(os.getenv("METRIC_STREAM_INTERVAL", default="30")),
+                max_events=int(os.getenv("METRIC_STREAM_MAX_EVENTS", default="100")),
+            )
+        return metric_broadcaster
+
+
+def _get_polled_metric(
+    metric: str,
+    days: int,
+    hours: int,
+    minutes: int,
+    use_cache: bool = True,
+    resolution: str | int | None = None,
+    reducer: str | None = None,
+    percentiles: bool | Sequence[float] | None = None,
+    absolute: bool = False,
+) -> pd.DataFrame | None:
+    # The poller only holds the raw minutes of windows ending now
+    raw = resolution is None and reducer is None and not percentiles
+    if metric_poller is None or not use_cache or not raw or absolute:
+        return None
+    polled = metric_poller.get(metric, timedelta(days=days, hours=hours, minutes=minutes))
+    if polled is not None:
+        trace_cache("poller")
+    return polled
+
+
+def get_metric_age(result: pd.DataFrame | Exception) -> float | None:
+    """
+    Returns the number of seconds since the data of a DataFrame returned by `get_metric` was fetched, or None if it
+    is not known (e.g. for an exception).
+    """
+    if not isinstance(result, pd.DataFrame):
+        return None
+    fetched_at = result.attrs.get("fetched_at")
+    if fetched_at is None:
+        return None
+    return max(time.time() - fetched_at, 0.0)
+
+
+async def get_all_metric_frames(
+    days: int = 0, hours: int = 0, minutes: int = 0, **options
+) -> dict[str, pd.DataFrame | Exception]:
+    """
+    Retrieves every metric of METRICS_INFO concurrently.
+
+    Returns:
+        dict: The DataFrame of every metric, or the exception raised while getting it.
+    """
+    metric_list = list(METRICS_INFO)
 
     results = await asyncio.gather(
-        *(get_metric_async(metric, days, hours, minutes) for metric in metric_list),
+        *(get_metric_async(metric, days, hours, minutes, **options) for metric in metric_list),
         return_exceptions=True,
     )
+    return dict(zip(metric_list, results))
+
+
+async def iter_all_metric_frames(
+    days: int = 0, hours: int = 0, minutes: int = 0, **options
+) -> AsyncIterator[tuple[str, pd.DataFrame | Exception]]:
+    """
+    Retrieves every metric of METRICS_INFO concurrently, like `get_all_metric_frames`, but yields every metric as
+    soon as it is ready rather than once the slowest one is. The metrics not yielded yet are cancelled when the
+    iteration is closed early, e.g. when the client of a streamed response goes away.
+
+    Yields:
+        tuple: The name of a metric and its DataFrame, or the exception raised while getting it, in completion order.
+    """
+
+    async def get_named(metric: str) -> tuple[str, pd.DataFrame | Exception]:
+        try:
+            return metric, await get_metric_async(metric, days, hours, minutes, **options)
+        except Exception as e:
+            return metric, e
+
+    tasks = [asyncio.ensure_future(get_named(metric)) for metric in METRICS_INFO]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class MetricResult(NamedTuple):
+    """
+    The outcome of one metric of `get_all_metric_results`: its DataFrame or the exception raised while getting it,
+    the trace of how it was served, and the seconds it took.
+    """
+
+    result: pd.DataFrame | Exception
+    trace: MetricTrace
+    elapsed: float
+
+
+class BatchQuery(NamedTuple):
+    """
+    One validated query of a metric batch, see `parse_batch_query`.
+    """
+
+    id: str | int | None
+    metric: str
+    days: int
+    hours: int
+    minutes: int
+    options: dict
 
+
+class BatchResult(NamedTuple):
+    """
+    The outcome of one query of a metric batch: its DataFrame or the exception raised while getting it, and the
+    seconds it took.
+    """
+
+    query: BatchQuery
+    result: pd.DataFrame | Exception
+    elapsed: float
+
+
+def parse_batch_query(spec: dict) -> BatchQuery:
+    """
+    Validates one query of a metric batch.
+
+    Args:
+        spec (dict): The 'metric', its window as 'window' (a duration such as '90m', '24h' or '7d'), as 'days',
+                     'hours' and 'minutes', or as an absolute 'start' and 'end', the other options of `get_metric`
+                     ('resolution', 'reducer', 'percentiles', 'points', 'max_points', 'incremental'), and an
+                     optional 'id' echoed in the result.
+
+    Returns:
+        BatchQuery: The query.
+
+    Raises:
+        ValueError: If the query has unknown keys, an unknown metric, an invalid window or invalid options.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("A query must be an object with at least a 'metric'.")
+    unknown = set(spec) - {"id", "metric", "window", "days", "hours", "minutes", *BATCH_OPTIONS}
+    if unknown:
+        raise ValueError(f"Unknown query keys '{', '.join(sorted(unknown))}'.")
+    metric = spec.get("metric")
+    if metric not in METRICS_INFO:
+        raise ValueError(f"Invalid metric '{metric}', expected one of {', '.join(METRICS_INFO)}.")
+    days, hours, minutes = (_parse_batch_unit(spec, unit) for unit in ("days", "hours", "minutes"))
+    if spec.get("window") not in (None, ""):
+        if days or hours or minutes:
+            raise ValueError("A window cannot be combined with days, hours or minutes.")
+        try:
+            minutes = parse_resolution(spec["window"]) // 60
+        except ValueError as e:
+            window = spec["window"]
+            raise ValueError(f"Invalid window '{window}', expected whole minutes, e.g. '90m', '24h', '7d'.") from e
+    options = {option: spec[option] for option in BATCH_OPTIONS if option in spec}
+    parse_resolution(options.get("resolution"))
+    reducer = parse_metric_reducer(options.get("reducer"), options.get("resolution"))
+    parse_metric_percentiles(metric, options.get("percentiles"), reducer)
+    if not isinstance(options.get("incremental", False), bool):
+        raise ValueError(f"Invalid incremental '{options['incremental']}', expected true or false.")
+    if "max_points" in options:
+        options["max_points"] = parse_max_points(options["max_points"])
+    parse_time_range(options.get("start"), options.get("end"))
+    if options.get("points") is not None:
+        plan_metric_tier(
+            days,
+            hours,
+            minutes,
+            options["points"],
+            options.get("resolution"),
+            options.get("reducer"),
+            options.get("percentiles"),
+            options.get("start"),
+            options.get("end"),
+        )
+    return BatchQuery(spec.get("id"), metric, days, hours, minutes, options)
+
+
+def _parse_batch_unit(spec: dict, unit: str) -> int:
+    value = spec.get(unit, 0)
+    if isinstance(value, bool) or not str(value).strip().isdigit():
+        raise ValueError(f"Invalid {unit} '{value}', expected a whole number.")
+    return int(value)
+
+
+def parse_metric_batch(specs: list[dict]) -> list[BatchQuery]:
+    """
+    Validates the queries of a metric batch, see `parse_batch_query`.
+
+    Raises:
+        ValueError: If there are no queries or more than BATCH_MAX_QUERIES, or a query is invalid, with its position.
+    """
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("Expected a non-empty list of queries.")
+    if len(specs) > BATCH_MAX_QUERIES:
+        raise ValueError(f"Too many queries ({len(specs)}), at most {BATCH_MAX_QUERIES} are allowed per batch.")
+    queries = []
+    for position, spec in enumerate(specs):
+        try:
+            queries.append(parse_batch_query(spec))
+        except ValueError as e:
+            raise ValueError(f"Invalid query {position}: {e}") from e
+    return queries
+
+
+async def get_metric_batch(queries: list[BatchQuery]) -> list[BatchResult]:
+    """
+    Runs the queries of a metric batch concurrently, each with its own window, through `get_metric_async`, so they
+    share the clients, the metric cache and the coalescing of identical queries with every other request.
+
+    Returns:
+        list[BatchResult]: The result of every query, in the order of the queries.
+    """
+
+    async def run(query: BatchQuery) -> BatchResult:
+        started = time.perf_counter()
+        try:
+            result = await get_metric_async(query.metric, query.days, query.hours, query.minutes, **query.options)
+        except Exception as e:
+            result = e
+        return BatchResult(query, result, time.perf_counter() - started)
+
+    return list(await asyncio.gather(*(run(query) for query in queries)))
+
+
+async def get_all_metric_results(
+    days: int = 0, hours: int = 0, minutes: int = 0, **options
+) -> dict[str, MetricResult]:
+    """
+    Retrieves every metric of METRICS_INFO concurrently, like `get_all_metric_frames`, and traces how each one was
+    served (see `util.metric_trace.MetricTrace`).
+
+    Returns:
+        dict: The result of every metric, with its DataFrame or the exception raised while getting it.
+    """
+
+    async def get_traced(metric: str) -> MetricResult:
+        # Every metric runs in its own task, with its own context and so its own trace
+        trace = start_trace()
+        started = time.perf_counter()
+        try:
+            result = await get_metric_async(metric, days, hours, minutes, **options)
+        except Exception as e:
+            result = e
+        return MetricResult(result, trace, time.perf_counter() - started)
+
+    metric_list = list(METRICS_INFO)
+    results = await asyncio.gather(*(get_traced(metric) for metric in metric_list))
+    return dict(zip(metric_list, results))
+
+
+def metric_envelope(metric: str, metric_result: MetricResult) -> dict:
+    """
+    Describes the outcome of one metric of `get_all_metric_results`, without its data.
+
+    Returns:
+        dict: Example: {'status': 'ok', 'error_class': None, 'error': None, 'cache': 'miss', 'elapsed_ms': 412.0,
+              'upstream_ms': 380.2, 'normalize_ms': 11.5, 'points': 5760, 'age': 0.4}, where 'points' is the number
+              of values (rows times labels). A failed metric has the status 'error', the class and the message of
+              the exception, and no points.
+    """
+    result, trace, elapsed = metric_result
+    failed = isinstance(result, Exception)
+    return {
+        "status": "error" if failed else "ok",
+        "error_class": type(result).__name__ if failed else None,
+        "error": f"An error occurred while getting the metric '{metric}':\n{result}" if failed else None,
+        "cache": trace.cache,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "upstream_ms": round(trace.upstream_seconds * 1000, 1),
+        "normalize_ms": round(trace.normalize_seconds * 1000, 1),
+        "points": None if failed else int(result.size),
+        "age": get_metric_age(result),
+    }
+
+
+async def get_all_metrics(
+    days: int = 0, hours: int = 0, minutes: int = 0, envelope: bool = False, **options
+) -> dict[str, str] | dict[str, dict]:
+    """
+    Retrieves every metric of METRICS_INFO concurrently as JSON.
+
+    Args:
+        envelope (bool): Whether to return, per metric, the description of `metric_envelope` with the
+                         `DataFrame.to_json` string as 'data' (None for a failed metric), rather than the JSON string
+                         or an error message.
+        **options: Keyword options of `get_metric`.
+    """
+    if not envelope:
+        return all_metrics_to_json(await get_all_metric_frames(days, hours, minutes, **options))
+    results = await get_all_metric_results(days, hours, minutes, **options)
+    return {
+        metric: {
+            **metric_envelope(metric, metric_result),
+            "data": metric_result.result.to_json() if isinstance(metric_result.result, pd.DataFrame) else None,
+        }
+        for metric, metric_result in results.items()
+    }
+
+
+def all_metrics_to_json(results: dict[str, pd.DataFrame | Exception]) -> dict[str, str]:
+    """
+    Converts the results of `get_all_metric_frames` to the JSON string of each DataFrame, or an error message.
+    """
     response = {}
-    for metric, result in zip(metric_list, results):
+    for metric, result in results.items():
         if isinstance(result, Exception):
             response[metric] = f"An error occurred while getting the metric '{metric}':\n{result}"
         elif isinstance(result, pd.DataFrame):
@@ -0,0 +1,253 @@
+import threading
+from typing import Iterable, NamedTuple
+
+import numpy as np
+import pandas as pd
+from google.cloud.monitoring_v3 import TimeSeries
+
+AGGREGATIONS = ("sum", "max", "weighted_mean")
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+
+
+class DecodedPoints(NamedTuple):
+    """
+    The points of a set of time series, one array element per point.
+
+    Attributes:
+        timestamps (np.ndarray): The end time of every point, as int64 epoch nanoseconds.
+        values (np.ndarray): The float64 value of every point, the mean for distribution points.
+        counts (np.ndarray): The float64 count of every distribution point, 0 for numeric points.
+        label_codes (np.ndarray): The position of the label of every point in `labels`.
+        labels (list[str]): The sorted, distinct labels of the time series.
+        series_keys (list[tuple]): The identity (metric and resource labels) of every time series, including those
+                                   without points.
+        integer (bool): Whether every point is an integer.
+    """
+
+    timestamps: np.ndarray
+    values: np.ndarray
+    counts: np.ndarray
+    label_codes: np.ndarray
+    labels: list[str]
+    series_keys: list[tuple]
+    integer: bool
+
+
+def decode_time_series(time_series: Iterable[TimeSeries], label: str) -> DecodedPoints:
+    """
+    Decodes time series, e.g. the pages of a ListTimeSeries response, into flat NumPy arrays.
+
+    The raw protobuf messages are read directly and every point is written into preallocated arrays, instead of
+    building one pandas Series per time series as `Query.as_dataframe` does.
+
+    Args:
+        time_series (Iterable[TimeSeries]): The time series to decode.
+        label (str): The metric or resource label that names every time series, the same as the `label` argument
+                     of `Query.as_dataframe`. Metric labels take precedence and missing labels are ''.
+
+    Returns:
+        DecodedPoints: The points of all the time series.
+    """
+    messages = [TimeSeries.pb(series) for series in time_series]
+    sizes = np.fromiter((len(message.points) for message in messages), dtype="int64", count=len(messages))
+    num_points = int(sizes.sum())
+
+    timestamps = np.empty(num_points, dtype="int64")
+    values = np.empty(num_points, dtype="float64")
+    counts = np.zeros(num_points, dtype="float64")
+    series_labels = [_series_label(message, label) for message in messages]
+    # The field set in the TypedValue of the first point of every series with points
+    value_fields = {message.points[0].value.WhichOneof("value") for message in messages if message.points}
+
+    start = 0
+    for message, size in zip(messages, sizes):
+        end = start + size
+        points = message.points
+        if not size:
+            continue
+        timestamps[start:end] = np.fromiter(
+            (point.interval.end_time.seconds * 1_000_000_000 + point.interval.end_time.nanos for point in points),
+            dtype="int64",
+            count=size,
+        )
+        field = points[0].value.WhichOneof("value")
+        if field == "distribution_value":
+            values[start:end] = np.fromiter(
+                (point.value.distribution_value.mean for point in points), dtype="float64", count=size
+            )
+            counts[start:end] = np.fromiter(
+                (point.value.distribution_value.count for point in points), dtype="float64", count=size
+            )
+        else:
+            values[start:end] = np.fromiter(
+                (getattr(point.value, field) for point in points), dtype="float64", count=size
+            )
+        start = end
+
+    labels, label_of_series = np.unique(np.asarray(series_labels, dtype=object), return_inverse=True)
+    return DecodedPoints(
+        timestamps=timestamps,
+        values=values,
+        counts=counts,
+        label_codes=np.repeat(label_of_series.astype("int32"), sizes),
+        labels=[str(value) for value in labels],
+        series_keys=[_series_key(message) for message in messages],
+        integer=value_fields == {"int64_value"},
+    )
+
+
+class MinuteAggregator:
+    """
+    Reduces time series into running per-minute aggregates, one column per label, as they arrive page by page.
+
+    Only the aggregates are kept between pages, so the memory used grows with the number of minutes and labels but
+    not with the number of time series or points. In the result, points of time series sharing a label in the same
+    minute are combined, missing points count as 0.0, and integer metrics keep the int64 dtype when every minute has
+    a point of every time series. Unlike with `Query.as_dataframe`, points of series that are not aligned to the same
+    second share one row per minute rather than producing duplicated minutes. Pages may be added from several
+    threads, e.g. by the shards of one query.
+
+    Args:
+        label (str): The metric or resource label that names the columns, see `decode_time_series`.
+        aggregation (str): How points sharing a label are combined: 'sum', 'max', or 'weighted_mean' (the mean of
+                           merged distributions, weighted by their counts, or the sum where there are no counts). A
+                           minute with a single point of a label keeps its mean as is, since multiplying it by its
+                           count and dividing it back is not bit-exact.
+        scale (float): A factor applied to the result, e.g. 100 for percentages.
+
+    Raises:
+        ValueError: If the aggregation is not one of AGGREGATIONS.
+    """
+
+    def __init__(self, label: str, aggregation: str, scale: float = 1.0):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Invalid aggregation '{aggregation}', expected one of {', '.join(AGGREGATIONS)}.")
+        self.label = label
+        self.aggregation = aggregation
+        self.scale = scale
+        self._labels: list[str] = []
+        self._label_codes: dict[str, int] = {}
+        self._series: set[tuple] = set()
+        self._integer = True
+        self._first_minute = 0
+        # Per minute and label: the sum or max of the values, and for weighted means the counts, weighted sums and
+        # number of points
+        self._values = np.zeros((0, 0), dtype="float64")
+        self._counts = np.zeros((0, 0), dtype="float64")
+        self._weighted_sums = np.zeros((0, 0), dtype="float64")
+        self._cell_points = np.zeros((0, 0), dtype="int64")
+        self._points_per_minute = np.zeros(0, dtype="int64")
+        self._lock = threading.Lock()
+
+    def add(self, time_series: Iterable[TimeSeries]) -> None:
+        """
+        Adds the points of time series, e.g. one page of a ListTimeSeries response, to the aggregates.
+        """
+        points = decode_time_series(time_series, self.label)
+        with self._lock:
+            self._add_points(points)
+
+    def _add_points(self, points: DecodedPoints) -> None:
+        self._series.update(points.series_keys)
+        codes = np.asarray([self._label_code(label) for label in points.labels], dtype="int64")
+        if not len(points.timestamps):
+            self._reserve(self._first_minute, self._first_minute + len(self._points_per_minute) - 1)
+            return
+        self._integer = self._integer and points.integer
+
+        minutes = points.timestamps // NANOSECONDS_PER_MINUTE
+        self._reserve(int(minutes.min()), int(minutes.max()))
+        rows = minutes - self._first_minute
+        cells = rows * len(self._labels) + codes[points.label_codes]
+        num_cells = self._values.size
+
+        if self.aggregation == "max":
+            np.maximum.at(self._values.reshape(-1), cells, points.values)
+        else:
+            self._values += np.bincount(cells, weights=points.values, minlength=num_cells).reshape(self._values.shape)
+        if self.aggregation == "weighted_mean":
+            counts = np.bincount(cells, weights=points.counts, minlength=num_cells)
+            weighted_sums = np.bincount(cells, weights=points.values * points.counts, minlength=num_cells)
+            self._counts += counts.reshape(self._counts.shape)
+            self._weighted_sums += weighted_sums.reshape(self._weighted_sums.shape)
+            self._cell_points += np.bincount(cells, minlength=num_cells).reshape(self._cell_points.shape)
+        self._points_per_minute += np.bincount(rows, minlength=len(self._points_per_minute))
+
+    def result(self) -> pd.DataFrame:
+        """
+        Returns the aggregated frame: one row per minute with points, one column per label in sorted order.
+        """
+        if not self._labels:
+            return pd.DataFrame(index=pd.DatetimeIndex([]), columns=pd.Index([], dtype=object))
+        rows = np.flatnonzero(self._points_per_minute)
+        order = np.argsort(np.asarray(self._labels, dtype=object))
+        grid = self._values[rows][:, order]
+        if self.aggregation == "weighted_mean":
+            counts = self._counts[rows][:, order]
+            weighted_sums = self._weighted_sums[rows][:, order]
+            merged = self._cell_points[rows][:, order] > 1
+            # Cells without counts keep the sum of their values, cells of a single point keep its mean
+            grid = np.divide(weighted_sums, counts, out=grid, where=(counts > 0) & merged)
+
+        # Like DataFrame.fillna followed by the aggregation, integer points stay integers unless a point is missing
+        has_every_point = bool(np.all(self._points_per_minute[rows] == len(self._series)))
+        if self._integer and self.aggregation != "weighted_mean" and has_every_point:
+            grid = grid.astype("int64")
+        if self.scale != 1.0:
+            grid = grid * self.scale
+
+        index = pd.DatetimeIndex((self._first_minute + rows) * NANOSECONDS_PER_MINUTE)
+        columns = pd.Index([self._labels[code] for code in order], dtype=object)
+        return pd.DataFrame(grid, index=index, columns=columns)
+
+    def _label_code(self, label: str) -> int:
+        if label not in self._label_codes:
+            self._label_codes[label] = len(self._labels)
+            self._labels.append(label)
+        return self._label_codes[label]
+
+    def _reserve(self, first_minute: int, last_minute: int) -> None:
+        """
+        Grows the aggregates to cover the minutes from first_minute to last_minute and every known label.
+        """
+        num_minutes = len(self._points_per_minute)
+        if num_minutes:
+            first_minute = min(first_minute, self._first_minute)
+            last_minute = max(last_minute, self._first_minute + num_minutes - 1)
+        shape = (last_minute - first_minute + 1, len(self._labels))
+        if shape == self._values.shape and first_minute == self._first_minute:
+            return
+        offset = self._first_minute - first_minute if num_minutes else 0
+        self._values = _grown(self._values, shape, offset)
+        if self.aggregation == "weighted_mean":
+            self._counts = _grown(self._counts, shape, offset)
+            self._weighted_sums = _grown(self._weighted_sums, shape, offset)
+            self._cell_points = _grown(self._cell_points, shape, offset)
+        points_per_minute = np.zeros(shape[0], dtype="int64")
+        points_per_minute[offset : offset + num_minutes] = self._points_per_minute
+        self._points_per_minute = points_per_minute
+        self._first_minute = first_minute
+
+
+def _grown(array: np.ndarray, shape: tuple[int, int], offset: int) -> np.ndarray:
+    grown = np.zeros(shape, dtype=array.dtype)
+    grown[offset : offset + array.shape[0], : array.shape[1]] = array
+    return grown
+
+
+def _series_key(message) -> tuple:
+    return (
+        message.metric.type,
+        tuple(sorted(message.metric.labels.items())),
+        message.resource.type,
+        tuple(sorted(message.resource.labels.items())),
+    )
+
+
+def _series_label(message, label: str) -> str:
+    if label in message.metric.labels:
+        return message.metric.labels[label]
+    if label == "resource_type":
+        return message.resource.type
+    return message.resource.labels.get(label, "")